@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""
+Benchmark the hot paths of the project on synthetic inputs of one or more
+sizes (see modules/benchmark.py), save the timings of each phase to a JSON
+file and compare them with a baseline, e.g.:
+
+$ ./benchmark.py --duration 5 20 --layer_n_neurons 16 64 \\
+    --baseline results/benchmark_baseline.json
+
+The cases are:
+* 'encode': encoding a .wav file of tones into spikes, as gen_audio_spikes.py
+  does, both directly and through an empty and a full encoding cache
+* 'runtime': constructing the network (init_neurons, init_connections and
+  the monitors), running it in runtime mode and saving the results
+* 'standalone': the same in standalone mode, with the run split into code
+  generation, compilation and running the binary
+* 'analysis': analyse_note_responses and order_spikes_by_note on random
+  output spikes
+* 'render': saving the variables for a movie and rendering its frames as
+  write_movie.py does (without encoding them)
+Exits with status 1 if any phase regressed or any case failed.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import itertools
+import matplotlib
+matplotlib.use('Agg')
+import numpy as np
+import brian2 as b2
+from brian2.codegen.cpp_prefs import get_compiler_and_args
+
+import stdp_sounds
+import modules.params as param_mod
+import modules.utils as utils_mod
+import modules.audio as audio_mod
+import modules.spike_file as spike_file_mod
+import modules.encoding_cache as encoding_cache_mod
+import modules.monitoring as monitoring_mod
+import modules.results_file as results_file_mod
+import modules.movie as movie_mod
+import modules.benchmark as benchmark_mod
+
+CASES = ['encode', 'runtime', 'standalone', 'analysis', 'render']
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=CASES)
+    # sizes to benchmark every combination of
+    parser.add_argument('--duration', type=float, nargs='+', default=[5.0])
+    parser.add_argument('--n_inputs', type=int, nargs='+', default=[513])
+    parser.add_argument('--layer_n_neurons', type=int, nargs='+',
+                        default=[16])
+    # run each case this many times, keeping the fastest time of each phase
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--output', default='results/benchmark.json')
+    # compare with the results saved in this file, or save the results
+    # there if it doesn't exist yet (or with --update_baseline)
+    parser.add_argument('--baseline')
+    parser.add_argument('--update_baseline', action='store_true')
+    # phases this much slower than the baseline (as a fraction) regressed
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    # where to write the inputs and outputs of the cases (by default a
+    # temporary directory, removed afterwards)
+    parser.add_argument('--work_dir')
+    return parser.parse_args()
+
+def simulation_params(spikes_filename, size, extra_args=()):
+    argv = ['--input_spikes_file', spikes_filename,
+            '--layer_n_neurons', str(size['layer_n_neurons']),
+            '--run_time', str(size['duration']),
+            '--no_plots'] + list(extra_args)
+    return param_mod.get_params(argv)
+
+def build_network(size, timings, extra_args=()):
+    """
+    Construct the network for random input spikes of the given size, as
+    stdp_sounds.simulate does.
+    """
+    timings.counts['n_input_spikes'] = \
+        benchmark_mod.write_input_spikes('input.spikes', size)
+    params = simulation_params('input.spikes', size, extra_args)
+    (neuron_params, connection_params, monitor_params, run_params, _) = params
+    np.random.seed(run_params['seed'])
+    with timings.phase('load_input'):
+        input_spikes = stdp_sounds.prepare_input(run_params)
+    with timings.phase('init_neurons'):
+        neurons = stdp_sounds.init_neurons(
+            input_spikes, run_params['layer_n_neurons'], neuron_params)
+    with timings.phase('init_connections'):
+        connections = stdp_sounds.init_connections(neurons, connection_params)
+    with timings.phase('init_monitors'):
+        plans = monitoring_mod.monitor_plans(monitor_params,
+                                             run_params['run_time'],
+                                             'layer1vis' in neurons)
+        monitors = stdp_sounds.init_monitors(neurons, connections, plans)
+    return (run_params, neurons, connections, monitors)
+
+def encode(size, timings):
+    benchmark_mod.write_tones_wav('input.wav', size['duration'])
+    n_inputs = min(size['n_inputs'], audio_mod.NFFT//2 + 1)
+    if n_inputs < audio_mod.NFFT//2 + 1:
+        matrix = audio_mod.input_matrix(benchmark_mod.SAMPLERATE, 'mel',
+                                        n_inputs)
+    else:
+        matrix = None
+    timings.counts['n_inputs'] = n_inputs
+
+    with timings.phase('encode'):
+        writer = spike_file_mod.SpikeFileWriter('encoded.spikes', n_inputs,
+                                                dt=audio_mod.DT)
+        for (times, indices) in audio_mod.encode_wav('input.wav',
+                                                     matrix=matrix):
+            writer.write_times(times, indices)
+        writer.close(duration=size['duration'])
+    timings.counts['n_spikes'] = len(spike_file_mod.SpikeFile(
+        'encoded.spikes'))
+
+    if os.path.isdir('encoding_cache'):
+        shutil.rmtree('encoding_cache')
+    cache = encoding_cache_mod.StageCache('encoding_cache')
+    for phase in ['encode_cache_empty', 'encode_cache_full']:
+        with timings.phase(phase):
+            pipeline = encoding_cache_mod.EncodingPipeline('input.wav', cache)
+            pipeline.spike_file(matrix)
+
+def runtime(size, timings):
+    (run_params, neurons, connections, monitors) = build_network(
+        size, timings, ['--no_standalone'])
+    with timings.phase('run'):
+        stdp_sounds.run_simulation(run_params, neurons, connections,
+                                   monitors, 'benchmark')
+    timings.counts['n_output_spikes'] = len(monitors['spikes']['layer1e'])
+    with timings.phase('save_results'):
+        stdp_sounds.save_results(monitors, 'benchmark', connections)
+
+def standalone(size, timings):
+    build_dir = os.path.abspath('standalone')
+    b2.set_device('cpp_standalone', directory=build_dir, build_on_run=False)
+    (run_params, neurons, connections, monitors) = build_network(size,
+                                                                 timings)
+    with timings.phase('codegen'):
+        stdp_sounds.run_simulation(run_params, neurons, connections,
+                                   monitors, 'benchmark')
+        b2.device.build(directory=build_dir, compile=False, run=False)
+    with timings.phase('compile'):
+        (compiler, _) = get_compiler_and_args()
+        b2.device.compile_source(build_dir, compiler, debug=False, clean=True)
+    with timings.phase('run'):
+        b2.device.run()
+    timings.counts['n_output_spikes'] = len(monitors['spikes']['layer1e'])
+    with timings.phase('save_results'):
+        stdp_sounds.save_results(monitors, 'benchmark', connections)
+
+def analysis(size, timings):
+    (times, indices) = benchmark_mod.random_spikes(
+        size['duration'], size['layer_n_neurons'], benchmark_mod.OUTPUT_RATE)
+    timings.counts['n_spikes'] = len(times)
+    n_notes = len(benchmark_mod.NOTE_FREQS)
+    with timings.phase('analyse_note_responses'):
+        favourite_notes = utils_mod.analyse_note_responses(
+            indices, times, benchmark_mod.NOTE_LENGTH, n_notes,
+            from_time=size['duration']/2, to_time=size['duration'])
+    with timings.phase('order_spikes_by_note'):
+        utils_mod.order_spikes_by_note(indices, times, favourite_notes)
+
+def render(size, timings):
+    n_frames = int(size['duration'] * movie_mod.FPS)
+    n_neurons = size['layer_n_neurons']
+    n_synapses = size['n_inputs'] * n_neurons
+    rng = np.random.RandomState(0)
+    # (weights drifting away from random initial weights, generated a block
+    # of frames at a time)
+    weights = np.lib.format.open_memmap('weights.npy', mode='w+',
+                                        shape=(n_frames, n_synapses))
+    initial = rng.rand(n_synapses) * 0.4
+    drift = rng.randn(n_synapses) * 0.1 / max(n_frames, 1)
+    for start in range(0, n_frames, movie_mod.BLOCK_FRAMES):
+        frame_ns = np.arange(start, min(start + movie_mod.BLOCK_FRAMES,
+                                        n_frames))
+        weights[start:start + len(frame_ns)] = \
+            initial + frame_ns[:, np.newaxis] * drift
+    (input_times, input_indices) = benchmark_mod.random_spikes(
+        size['duration'], size['n_inputs'], benchmark_mod.INPUT_RATE)
+    (output_times, output_indices) = benchmark_mod.random_spikes(
+        size['duration'], n_neurons, benchmark_mod.OUTPUT_RATE)
+    filename = 'vis_vars' + results_file_mod.FILE_EXTENSION
+
+    with timings.phase('save_vis_vars'):
+        movie_mod.save_vis_vars(
+            filename,
+            potential=rng.rand(n_frames, n_neurons),
+            weights=weights,
+            weight_targets=np.tile(np.arange(n_neurons), size['n_inputs']),
+            input_spike_times=input_times,
+            input_spike_indices=input_indices,
+            output_spike_times=output_times,
+            output_spike_indices=output_indices)
+    del weights
+    with timings.phase('load_movie_data'):
+        data = movie_mod.load_movie_data(filename, range(min(n_neurons, 4)))
+    with timings.phase('renderer_setup'):
+        renderer = movie_mod.FrameRenderer(data)
+    with timings.phase('render'):
+        for frame_n in range(n_frames):
+            renderer.render(frame_n)
+    timings.counts['n_frames'] = n_frames
+
+def main():
+    args = get_args()
+    sizes = [{'duration': duration, 'n_inputs': n_inputs,
+              'layer_n_neurons': layer_n_neurons}
+             for (duration, n_inputs, layer_n_neurons) in itertools.product(
+                 args.duration, args.n_inputs, args.layer_n_neurons)]
+
+    if args.work_dir is None:
+        work_root = tempfile.mkdtemp(prefix='stdp_sounds_benchmark_')
+    else:
+        work_root = os.path.abspath(args.work_dir)
+    results = []
+    try:
+        for size in sizes:
+            for case in args.cases:
+                print("Running %s %s..." % (case,
+                                            benchmark_mod.size_name(size)))
+                work_dir = os.path.join(work_root, case,
+                                        benchmark_mod.size_name(size))
+                if not os.path.isdir(os.path.join(work_dir, 'results')):
+                    os.makedirs(os.path.join(work_dir, 'results'))
+                repeats = [benchmark_mod.run_case(case, globals()[case], size,
+                                                  work_dir)
+                           for _ in range(args.repeat)]
+                result = benchmark_mod.best_of(repeats)
+                benchmark_mod.print_results([result])
+                results.append(result)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_root)
+
+    benchmark_mod.save_results(args.output, results)
+    print("Saved results to %s" % args.output)
+
+    failed = any(result['error'] is not None for result in results)
+    if args.baseline is None:
+        sys.exit(1 if failed else 0)
+    if args.update_baseline or not os.path.exists(args.baseline):
+        benchmark_mod.save_results(args.baseline, results)
+        print("Saved baseline to %s" % args.baseline)
+        sys.exit(1 if failed else 0)
+
+    comparisons = benchmark_mod.compare(
+        results, benchmark_mod.load_results(args.baseline), args.tolerance)
+    print("Compared with %s:" % args.baseline)
+    benchmark_mod.print_comparisons(comparisons)
+    regressed = any(comparison[-1] for comparison in comparisons)
+    sys.exit(1 if failed or regressed else 0)
+
+if __name__ == '__main__':
+    main()
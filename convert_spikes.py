@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+Convert spikes pickled as a (times, indices) tuple by older versions of
+gen_audio_spikes.py into spike files (see modules/spike_file.py).
+"""
+
+from __future__ import print_function, division
+import os.path
+import argparse
+import numpy as np
+
+import modules.spike_file as spike_file_mod
+
+parser = argparse.ArgumentParser()
+parser.add_argument('pickle_files', nargs='+', metavar='spikes.pickle')
+parser.add_argument('--n_inputs', type=int, default=513)
+parser.add_argument('--dt', type=float, default=spike_file_mod.DEFAULT_DT)
+args = parser.parse_args()
+
+for pickle_filename in args.pickle_files:
+    spike_filename = os.path.splitext(pickle_filename)[0] + \
+        spike_file_mod.FILE_EXTENSION
+    print("Converting %s to %s..." % (pickle_filename, spike_filename))
+    (times, indices) = spike_file_mod.load_spikes(pickle_filename)
+    times = np.asarray(times, dtype=float)
+    indices = np.asarray(indices)
+    # (keeping the order of simultaneous spikes)
+    order = np.argsort(times, kind='mergesort')
+    (times, indices) = (times[order], indices[order])
+    spike_file_mod.write_spikes(
+        spike_filename, times, indices,
+        n_inputs=args.n_inputs,
+        dt=args.dt,
+        metadata={'source': os.path.basename(pickle_filename)}
+    )
+
+    (new_times, new_indices) = spike_file_mod.SpikeFile(spike_filename).read()
+    if not np.array_equal(new_indices, indices):
+        raise Exception("Indices changed in conversion")
+    max_error = np.amax(np.abs(new_times - times)) if len(times) > 0 else 0
+    if max_error > 0:
+        print("Warning: spike times moved by up to %g s "
+              "to fit timesteps of %g s" % (max_error, args.dt))
+    print("done! (%d spikes, %d -> %d bytes)" %
+          (len(times), os.path.getsize(pickle_filename),
+           os.path.getsize(spike_filename)))
@@ -1,79 +1,311 @@
 #!/usr/bin/env python
 
+"""
+Encode .wav files as input spikes (see modules/audio.py).
+
+Any number of .wav files, directories of them or glob patterns can be given,
+in which case the files are spread across a pool of --processes processes.
+The spike files are written to --output_dir (test_inputs by default), along
+with a manifest (MANIFEST_FILENAME) describing every spike file in it: the
+source file and its SHA-1, the number of inputs and spikes, the duration and
+the encoding parameters.
+"""
+
 from __future__ import print_function, division
-import brian2 as b2
-import brian2.hears as b2h
 import matplotlib.pyplot as plt
 import numpy as np
+import os
 import os.path
-import pickle
-import pylab
+import sys
+import glob
+import json
+import shutil
 import argparse
-from scipy import ndimage
-
-parser = argparse.ArgumentParser()
-parser.add_argument('wav_file')
-parser.add_argument('--interactive', action='store_true')
-args = parser.parse_args()
-
-input_filename = args.wav_file
-input_name = os.path.basename(input_filename).replace(".wav", "")
-
-b2.set_device(
-    'cpp_standalone',
-    directory=('/tmp/brian_standalone_%s' % input_name)
-)
-
-sound = b2h.loadsound(input_filename)
-
-if args.interactive:
-    plt.ion()
-
-plt.figure()
-(pxx, freqs, bins, im) = \
-        pylab.specgram(x=sound[:, 0].flatten(), NFFT=1024, Fs=sound.samplerate)
-n_freqs = len(freqs)
-plt.savefig('figures/%s_spectrogram.png' % input_name)
-spectral_power = 10 * np.log10(pxx)
-
-min_power = np.amin(spectral_power)
-max_power = np.amax(spectral_power)
-power_range = max_power - min_power
-spectral_power_normalised = (spectral_power - min_power)/power_range
-
-# emphasise components extending horizontally, in time
-kernel_len = 4
-kernel = np.ones((1, kernel_len))
-spectral_input = ndimage.convolve(spectral_power_normalised, kernel)
-spectral_input[spectral_input < 0.7*kernel_len] = 0
-
-plt.figure()
-plt.imshow(spectral_input, aspect='auto', origin='lower')
-plt.savefig('figures/%s_spectral_input.png' % input_name)
-
-dt = (bins[1] - bins[0]) * b2.second
-sound_input = b2.TimedArray(spectral_input.T, dt=dt)
-
-eqs = '''
-dv/dt = (I-v)/(10*ms) : 1
-I = sound_input(t, i): 1
-'''
-anf = b2.NeuronGroup(N=n_freqs, model=eqs, reset='v=0', threshold='v>1')
-m = b2.SpikeMonitor(anf)
-
-print("Building and running simulation...")
-b2.run(sound.duration, report='stdout')
-print("Done!")
-
-print("Writing spike files...")
-indices = np.array(m.i)
-times = np.array(m.t)
-pickle_file = 'test_inputs/' + input_name + '.pickle'
-with open(pickle_file, 'wb') as f:
-    pickle.dump((times, indices), f)
-print("done!")
-
-plt.figure()
-plt.plot(m.t/b2.second, m.i, 'k.', markersize=1)
-plt.ylim([0, n_freqs])
-plt.savefig('figures/spectrogram_%s_spikes.png' % input_name)
+import traceback
+import multiprocessing
+
+import modules.audio as audio_mod
+import modules.spike_file as spike_file_mod
+import modules.encoding_cache as encoding_cache_mod
+
+MANIFEST_FILENAME = 'manifest.json'
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    # .wav files, directories of them or glob patterns
+    parser.add_argument('wav_files', nargs='+')
+    parser.add_argument('--interactive', action='store_true')
+    # normalise the spectrogram by the range of the whole file (reading it
+    # twice), or by the range of everything up to each block (see
+    # modules/audio.py)
+    parser.add_argument('--normalisation', choices=['global', 'running'],
+                        default='global')
+    # how much audio to process at a time
+    parser.add_argument('--block_seconds', type=float, default=10.0)
+    # don't plot the spectrogram, which needs all of it in memory
+    parser.add_argument('--no_figures', action='store_true')
+    # map the spectrogram's NFFT/2 + 1 frequency bins into fewer inputs:
+    # either the linear bins between --min_freq and --max_freq (in Hz), or
+    # --n_bands log- or mel-spaced bands between them (see modules/audio.py)
+    parser.add_argument('--bands', choices=['linear', 'log', 'mel'],
+                        default='linear')
+    parser.add_argument('--n_bands', type=int, default=64)
+    parser.add_argument('--min_freq', type=float, default=0.0)
+    parser.add_argument('--max_freq', type=float)
+    # and/or drop the inputs whose peak power is more than this many dB below
+    # that of the loudest one (reading the file an extra time)
+    parser.add_argument('--drop_silent', type=float)
+    # length of the kernel the spectrogram is smoothed with in time, the
+    # threshold (as a fraction of the kernel length) below which it's zeroed,
+    # and the time constant of the encoding neurons (in seconds)
+    parser.add_argument('--kernel_len', type=int, default=audio_mod.KERNEL_LEN)
+    parser.add_argument('--threshold', type=float,
+                        default=audio_mod.THRESHOLD)
+    parser.add_argument('--tc_v', type=float, default=audio_mod.TC_V)
+    # where to write the spike files (and the manifest), or for a single .wav
+    # file, the spike file itself (which then isn't added to a manifest)
+    parser.add_argument('--output_dir', default='test_inputs')
+    parser.add_argument('--output')
+    # cache the output of each stage of the encoding (see
+    # modules/encoding_cache.py), so that changing the parameters of later
+    # stages doesn't recompute the earlier ones
+    parser.add_argument('--cache_dir',
+                        default=encoding_cache_mod.default_cache_dir())
+    parser.add_argument('--no_cache', action='store_true')
+    # how many files to encode at once
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    return parser.parse_args()
+
+def wav_filenames(patterns):
+    """
+    Expand a list of .wav files, directories and glob patterns into a sorted
+    list of .wav files.
+    """
+    filenames = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, '*.wav'))
+        elif os.path.exists(pattern):
+            matches = [pattern]
+        else:
+            matches = glob.glob(pattern)
+            if len(matches) == 0:
+                raise ValueError("No .wav files matching %s" % pattern)
+        filenames.update(matches)
+    return sorted(filenames)
+
+def input_name(wav_filename):
+    return os.path.basename(wav_filename).replace(".wav", "")
+
+def encoding_metadata(wav_filename, args):
+    metadata = {'source': os.path.basename(wav_filename),
+                'normalisation': args.normalisation,
+                'bands': args.bands,
+                'min_freq': args.min_freq,
+                'max_freq': args.max_freq,
+                'drop_silent': args.drop_silent,
+                'kernel_len': args.kernel_len,
+                'threshold': args.threshold,
+                'tc_v': args.tc_v}
+    if args.bands != 'linear':
+        metadata['n_bands'] = args.n_bands
+    return metadata
+
+def encode_file(wav_filename, spike_filename, args):
+    """
+    Encode one .wav file to spike_filename (plotting figures unless
+    args.no_figures), returning its manifest entry.
+    """
+    name = input_name(wav_filename)
+
+    spectral_power = []
+    spectral_input = []
+    def keep_frames(pxx, frames_input):
+        spectral_power.append(10 * np.log10(pxx))
+        spectral_input.append(frames_input)
+    if args.no_figures or not args.no_cache:
+        frames_callback = None
+    else:
+        frames_callback = keep_frames
+
+    (samplerate, n_samples) = audio_mod.wav_info(wav_filename)
+    if args.no_cache:
+        pipeline = None
+    else:
+        pipeline = encoding_cache_mod.EncodingPipeline(
+            wav_filename, encoding_cache_mod.StageCache(args.cache_dir),
+            normalisation=args.normalisation,
+            block_seconds=args.block_seconds)
+    matrix = audio_mod.input_matrix(samplerate, args.bands, args.n_bands,
+                                    args.min_freq, args.max_freq)
+    if args.drop_silent is not None:
+        print("Finding silent inputs...")
+        if pipeline is None:
+            matrix = audio_mod.drop_silent_inputs(
+                wav_filename, int(args.block_seconds * samplerate), matrix,
+                args.drop_silent)
+        else:
+            matrix = pipeline.drop_silent_inputs(matrix, args.drop_silent)
+        print("done!")
+    if matrix is None:
+        n_inputs = audio_mod.NFFT//2 + 1
+    else:
+        n_inputs = matrix.shape[1]
+    print("%d inputs" % n_inputs)
+
+    metadata = encoding_metadata(wav_filename, args)
+    if pipeline is None:
+        writer = spike_file_mod.SpikeFileWriter(
+            spike_filename,
+            n_inputs=n_inputs,
+            dt=audio_mod.DT,
+            metadata=metadata
+        )
+
+        print("Encoding and writing spike file...")
+        for (block_times, block_indices) in audio_mod.encode_wav(
+                wav_filename,
+                normalisation=args.normalisation,
+                block_seconds=args.block_seconds,
+                frames_callback=frames_callback,
+                matrix=matrix,
+                kernel_len=args.kernel_len,
+                threshold=args.threshold,
+                tc_v=args.tc_v):
+            writer.write_times(block_times, block_indices)
+            if len(block_times) > 0:
+                print("%.1f s encoded" % block_times[-1])
+        writer.close(duration=n_samples/samplerate)
+        source_sha1 = encoding_cache_mod.file_hash(wav_filename)
+    else:
+        print("Encoding...")
+        shutil.copyfile(pipeline.spike_file(matrix, args.kernel_len,
+                                            args.threshold, args.tc_v,
+                                            metadata),
+                        spike_filename)
+        source_sha1 = pipeline.source_sha1
+    print("done!")
+
+    if not args.no_figures:
+        (times, indices) = spike_file_mod.load_spikes(spike_filename)
+        if pipeline is None:
+            spectral_power = np.concatenate(spectral_power).T
+            spectral_input = np.concatenate(spectral_input).T
+        else:
+            spectral_power = 10 * np.log10(pipeline.stft()).T
+            spectral_input = np.asarray(pipeline.thresholded(
+                matrix, args.kernel_len, args.threshold)).T
+        extent = [0, n_samples / samplerate, 0, samplerate / 2]
+
+        plt.figure()
+        plt.imshow(spectral_power, aspect='auto', origin='lower',
+                   extent=extent)
+        plt.savefig('figures/%s_spectrogram.png' % name)
+
+        plt.figure()
+        plt.imshow(spectral_input, aspect='auto', origin='lower')
+        plt.savefig('figures/%s_spectral_input.png' % name)
+
+        plt.figure()
+        plt.plot(times, indices, 'k.', markersize=1)
+        plt.ylim([0, n_inputs])
+        plt.savefig('figures/spectrogram_%s_spikes.png' % name)
+
+        if not args.interactive:
+            plt.close('all')
+
+    spike_file = spike_file_mod.SpikeFile(spike_filename)
+    return {'source': wav_filename,
+            'source_sha1': source_sha1,
+            'n_inputs': spike_file.n_inputs,
+            'n_spikes': len(spike_file),
+            'duration': spike_file.duration,
+            'metadata': metadata}
+
+def encode_job(job):
+    """
+    Encode one file in a pool worker, returning (spike filename, manifest
+    entry or None, error).
+    """
+    (wav_filename, spike_filename, args) = job
+    try:
+        entry = encode_file(wav_filename, spike_filename, args)
+        return (spike_filename, entry, '')
+    except Exception as e:
+        traceback.print_exc()
+        return (spike_filename, None, repr(e))
+
+def update_manifest(output_dir, entries):
+    """
+    Add entries ({spike file name: entry}) to the manifest in output_dir.
+    """
+    filename = os.path.join(output_dir, MANIFEST_FILENAME)
+    if os.path.exists(filename):
+        with open(filename) as f:
+            manifest = json.load(f)
+    else:
+        manifest = {}
+    manifest.update(entries)
+    with open(filename + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(filename + '.tmp', filename)
+
+def main():
+    args = get_args()
+    wav_files = wav_filenames(args.wav_files)
+    if len(wav_files) == 0:
+        raise ValueError("No .wav files to encode")
+    if args.output is not None and len(wav_files) > 1:
+        raise ValueError("--output can only be used with a single .wav file")
+    if args.interactive:
+        if len(wav_files) > 1:
+            raise ValueError("--interactive can only be used with a single "
+                             ".wav file")
+        plt.ion()
+
+    if args.output is not None:
+        encode_file(wav_files[0], args.output, args)
+        return
+
+    if not os.path.isdir(args.output_dir):
+        os.makedirs(args.output_dir)
+    jobs = [(wav_filename,
+             os.path.join(args.output_dir, input_name(wav_filename) +
+                          spike_file_mod.FILE_EXTENSION),
+             args)
+            for wav_filename in wav_files]
+
+    if len(jobs) == 1 or args.processes == 1:
+        results = [(spike_filename,
+                    encode_file(wav_filename, spike_filename, args), '')
+                   for (wav_filename, spike_filename, _) in jobs]
+    else:
+        print("Encoding %d files in %d processes..." %
+              (len(jobs), args.processes))
+        results = []
+        pool = multiprocessing.Pool(args.processes)
+        for result in pool.imap_unordered(encode_job, jobs):
+            results.append(result)
+            (spike_filename, entry, error) = result
+            if error:
+                status = "failed (%s)" % error
+            else:
+                status = "%d spikes" % entry['n_spikes']
+            print("%d/%d: %s %s" %
+                  (len(results), len(jobs), spike_filename, status))
+        pool.close()
+        pool.join()
+
+    update_manifest(args.output_dir, dict(
+        (os.path.basename(spike_filename), entry)
+        for (spike_filename, entry, error) in results if not error))
+    failed = [spike_filename for (spike_filename, _, error) in results
+              if error]
+    if len(failed) > 0:
+        print("Failed to encode %d files: %s" %
+              (len(failed), ', '.join(failed)))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+"""
+Run a trained network (saved by stdp_sounds.py --save_model) on any number
+of spike files, with learning turned off, and collect how selectively the
+output neurons respond to the notes of each into one table:
+
+$ ./infer.py results/model_two_notes_0.5_s.pickle test_inputs/*.spikes
+
+The files are run back to back through a single network (see
+modules/inference.py), so the network is only built and compiled once.
+With --prune_below and/or --top_k, the network only has the strongest of the
+trained input synapses.
+"""
+
+from __future__ import print_function, division
+import os
+import csv
+import time
+import argparse
+import numpy as np
+import brian2 as b2
+
+import stdp_sounds
+import sweep
+import modules.utils as utils_mod
+import modules.inference as inference_mod
+import modules.spike_file as spike_file_mod
+
+RESULT_FIELDS = ['input', 'duration', 'n_output_spikes',
+                 'n_selective_neurons', 'n_notes_learnt', 'accuracy']
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('model')
+    parser.add_argument('spike_files', nargs='+')
+    # seconds of silence between one input and the next
+    parser.add_argument('--rest', type=float, default=1.0)
+    parser.add_argument('--backend', choices=['brian', 'numpy'],
+                        default='brian')
+    parser.add_argument('--no_standalone', action='store_true')
+    # prune the input-layer1e synapses to those with weights of at least
+    # this and/or to the top k onto each output neuron (see
+    # inference_mod.prune_model)
+    parser.add_argument('--prune_below', type=float)
+    parser.add_argument('--top_k', type=int)
+    # (otherwise guessed from the name of each spike file)
+    parser.add_argument('--note_separation', type=float)
+    parser.add_argument('--n_notes', type=int)
+    parser.add_argument('--output_dir')
+    # also save the output spikes for each input to <output_dir>/<input>.npz
+    parser.add_argument('--save_spikes', action='store_true')
+    return parser.parse_args()
+
+def analyse_input(spike_indices, spike_times, duration, note_length,
+                  n_notes):
+    """
+    Analyse the note responses of the output neurons over a whole input, as
+    sweep.analyse_run does over the second half of a training run.
+    """
+    result = {'n_output_spikes': len(spike_indices)}
+    if len(spike_indices) == 0 or note_length is None or n_notes is None:
+        return result
+
+    favourite_notes = utils_mod.analyse_note_responses(
+        spike_indices=spike_indices,
+        spike_times=spike_times,
+        note_length=note_length,
+        n_notes=n_notes,
+        from_time=0,
+        to_time=duration
+    )
+    result['n_selective_neurons'] = len(favourite_notes)
+    result['n_notes_learnt'] = len(set(favourite_notes.values()))
+    result['accuracy'] = utils_mod.note_response_accuracy(
+        spike_indices=spike_indices,
+        spike_times=spike_times,
+        favourite_notes=favourite_notes,
+        note_length=note_length,
+        n_notes=n_notes,
+        from_time=0,
+        to_time=duration
+    )
+    return result
+
+def main():
+    args = get_args()
+
+    model = inference_mod.load_model(args.model)
+    if args.prune_below is not None or args.top_k is not None:
+        n_synapses = len(model['weights'])
+        model = inference_mod.prune_model(model, args.prune_below,
+                                          args.top_k)
+        print("Pruned to %d of %d synapses" %
+              (len(model['weights']), n_synapses))
+    model_name = os.path.splitext(os.path.basename(args.model))[0]
+    if args.output_dir is not None:
+        output_dir = args.output_dir
+    else:
+        output_dir = 'results/inference_%s_%s' % \
+            (model_name, time.strftime('%Y%m%d-%H%M%S'))
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    for filename in args.spike_files:
+        if spike_file_mod.n_inputs(filename) != model['n_inputs']:
+            raise ValueError("%s has %d inputs, but the model has %d" %
+                             (filename, spike_file_mod.n_inputs(filename),
+                              model['n_inputs']))
+
+    print("Loading inputs...")
+    (times, indices, offsets, durations) = inference_mod.concatenate_inputs(
+        args.spike_files, args.rest)
+    input_spikes = {'indices': indices, 'times': times * b2.second,
+                    'n_inputs': model['n_inputs']}
+    run_params = {
+        'backend': args.backend,
+        'no_standalone': args.no_standalone,
+        'run_time': (offsets[-1] + durations[-1]) * b2.second
+    }
+    print("done!")
+
+    print("Running %d inputs (%.1f s)..." %
+          (len(args.spike_files), run_params['run_time'] / b2.second))
+    start_time = time.time()
+    (_, _, monitors, _) = stdp_sounds.simulate_inference(
+        model, run_params, input_spikes, model_name)
+    sim_time = time.time() - start_time
+    print("done in %.1f s!" % sim_time)
+
+    spike_monitor = monitors['spikes']['layer1e']
+    split = inference_mod.split_spikes(
+        spike_monitor.i, spike_monitor.t_, offsets, durations)
+
+    results = []
+    for (filename, duration, (spike_indices, spike_times)) in \
+            zip(args.spike_files, durations, split):
+        (note_length, n_notes) = sweep.guess_note_structure(filename)
+        if args.note_separation is not None:
+            note_length = args.note_separation
+        if args.n_notes is not None:
+            n_notes = args.n_notes
+        result = analyse_input(spike_indices, spike_times, duration,
+                               note_length, n_notes)
+        result['input'] = filename
+        result['duration'] = duration
+        results.append(result)
+        if args.save_spikes:
+            name = os.path.splitext(os.path.basename(filename))[0]
+            np.savez(os.path.join(output_dir, name + '.npz'),
+                     t=spike_times, i=spike_indices)
+
+    table_filename = os.path.join(output_dir, 'inference.csv')
+    with open(table_filename, 'w') as table_file:
+        writer = csv.DictWriter(table_file, fieldnames=RESULT_FIELDS)
+        writer.writeheader()
+        for result in results:
+            writer.writerow(result)
+    sweep.print_table(results, RESULT_FIELDS)
+    print("Results saved in %s" % table_filename)
+
+    return results
+
+if __name__ == '__main__':
+    results = main()
@@ -0,0 +1,473 @@
+"""
+Streaming conversion of audio into input spikes, one block of audio at a time.
+
+This does the same thing as the original whole-file version of
+gen_audio_spikes.py:
+* the power spectrum of the audio is calculated in frames of NFFT samples
+  (as by pylab.specgram), in decibels, normalised to between 0 and 1
+  (optionally after mapping the NFFT/2 + 1 frequency bins into fewer inputs;
+  see input_matrix)
+* components extending horizontally in time are emphasised by convolving with
+  a (1, KERNEL_LEN) kernel of ones (as by ndimage.convolve), and everything
+  below THRESHOLD * KERNEL_LEN is zeroed (both can be changed)
+* each frequency then drives a leaky integrate-and-fire neuron
+  (dv/dt = (I - v)/TC_V, spiking and resetting to 0 when v > 1) with the value
+  of its frame, as a Brian TimedArray would
+but only ever holds one block of audio (plus a few frames) in memory, and
+integrates the neurons in closed form over each frame rather than with Brian.
+
+With 'global' normalisation (as in the original) the audio is read twice, once
+to find the range of the power spectrum and once to encode it; with 'running'
+normalisation each block is normalised by the range of everything up to and
+including that block, which only needs one pass.
+"""
+
+from __future__ import print_function, division
+import wave
+import numpy as np
+import matplotlib.mlab as mlab
+
+NFFT = 1024
+NOVERLAP = 128
+KERNEL_LEN = 4
+THRESHOLD = 0.7
+DT = 0.1e-3
+TC_V = 10e-3
+
+def wav_info(filename):
+    """
+    Get the sample rate and the number of samples of a .wav file.
+    """
+    wav_file = wave.open(filename, 'rb')
+    info = (wav_file.getframerate(), wav_file.getnframes())
+    wav_file.close()
+    return info
+
+def read_wav(filename, block_size):
+    """
+    Yield blocks of up to block_size samples of the first channel of a .wav
+    file, scaled to between -1 and 1.
+    """
+    wav_file = wave.open(filename, 'rb')
+    n_channels = wav_file.getnchannels()
+    sample_width = wav_file.getsampwidth()
+    if sample_width == 1:
+        dtype = np.uint8
+    elif sample_width == 2:
+        dtype = np.int16
+    elif sample_width == 4:
+        dtype = np.int32
+    else:
+        raise Exception("Unsupported sample width: %d bytes" % sample_width)
+
+    try:
+        while True:
+            data = wav_file.readframes(block_size)
+            if len(data) == 0:
+                break
+            samples = np.frombuffer(data, dtype=dtype)[::n_channels]
+            samples = samples.astype(float)
+            if sample_width == 1:
+                samples -= 128
+            yield samples / 2**(8 * sample_width - 1)
+    finally:
+        wav_file.close()
+
+def stft_frames(blocks, samplerate):
+    """
+    Yield the power spectra (shape (n_frames, NFFT/2 + 1)) of the frames
+    which are complete after each block of samples, as pylab.specgram with
+    its default settings would calculate them.
+    """
+    hop = NFFT - NOVERLAP
+    buffered = np.zeros(0)
+    for block in blocks:
+        buffered = np.concatenate([buffered, block])
+        n_frames = (len(buffered) - NOVERLAP) // hop
+        if n_frames <= 0:
+            continue
+        used = (n_frames - 1) * hop + NFFT
+        (pxx, _, _) = mlab.specgram(x=buffered[:used], NFFT=NFFT,
+                                    Fs=samplerate, noverlap=NOVERLAP)
+        yield pxx.T
+        buffered = buffered[n_frames * hop:]
+
+def input_frames(frames, matrix):
+    """
+    Map a stream of power spectra into inputs with an input_matrix (or leave
+    them alone if it's None).
+    """
+    for pxx in frames:
+        if matrix is None:
+            yield pxx
+        else:
+            yield np.dot(pxx, matrix)
+
+def _hz_to_scale(freqs, scale):
+    if scale == 'mel':
+        return 2595 * np.log10(1 + freqs / 700)
+    return np.log(freqs)
+
+def _scale_to_hz(values, scale):
+    if scale == 'mel':
+        return 700 * (10**(values / 2595) - 1)
+    return np.exp(values)
+
+def band_matrix(scale, n_bands, samplerate, min_freq=0.0, max_freq=None):
+    """
+    Weights mapping the NFFT/2 + 1 bins of a power spectrum into n_bands
+    overlapping triangular bands with centres evenly spaced between min_freq
+    and max_freq (by default, the Nyquist frequency) on a 'log' or 'mel'
+    scale, as an array of shape (NFFT/2 + 1, n_bands). Bands narrower than
+    the spacing of the bins just take the bin nearest their centre.
+    """
+    freqs = np.fft.rfftfreq(NFFT, 1 / samplerate)
+    if max_freq is None:
+        max_freq = samplerate / 2
+    if scale == 'log':
+        # (there's no log of 0 Hz)
+        min_freq = max(min_freq, freqs[1])
+    edges = _scale_to_hz(np.linspace(_hz_to_scale(min_freq, scale),
+                                     _hz_to_scale(max_freq, scale),
+                                     n_bands + 2), scale)
+
+    matrix = np.zeros((len(freqs), n_bands))
+    for band in range(n_bands):
+        (lower, centre, upper) = edges[band:band + 3]
+        rising = (freqs - lower) / (centre - lower)
+        falling = (upper - freqs) / (upper - centre)
+        matrix[:, band] = np.maximum(0, np.minimum(rising, falling))
+        if not np.any(matrix[:, band] > 0):
+            matrix[np.argmin(np.abs(freqs - centre)), band] = 1
+    return matrix
+
+def input_matrix(samplerate, scale='linear', n_bands=None, min_freq=0.0,
+                 max_freq=None):
+    """
+    Matrix mapping power spectra into the inputs of the network: for the
+    'linear' scale, the bins between min_freq and max_freq (None if that's
+    all of them), or for 'log' and 'mel', n_bands bands (see band_matrix).
+    """
+    if scale != 'linear':
+        return band_matrix(scale, n_bands, samplerate, min_freq, max_freq)
+    freqs = np.fft.rfftfreq(NFFT, 1 / samplerate)
+    if max_freq is None:
+        max_freq = samplerate / 2
+    keep = (freqs >= min_freq) & (freqs <= max_freq)
+    if np.all(keep):
+        return None
+    return np.eye(len(freqs))[:, keep]
+
+def input_peaks(frames):
+    """
+    Peak power of each input over a stream of frames (None if there are no
+    frames).
+    """
+    peak = None
+    for inputs in frames:
+        frame_peak = np.amax(inputs, axis=0)
+        if peak is None:
+            peak = frame_peak
+        else:
+            peak = np.maximum(peak, frame_peak)
+    return peak
+
+def drop_quiet_columns(matrix, peak, threshold_db):
+    """
+    Drop the columns of an input_matrix (or bins if it's None) whose peak
+    power is more than threshold_db below the loudest peak.
+    """
+    if matrix is None:
+        matrix = np.eye(NFFT // 2 + 1)
+    if peak is None:
+        return matrix
+    with np.errstate(divide='ignore'):
+        peak_db = 10 * np.log10(peak)
+    return matrix[:, peak_db >= np.amax(peak_db) - threshold_db]
+
+def drop_silent_inputs(filename, block_size, matrix, threshold_db):
+    """
+    Drop the inputs (columns of an input_matrix, or bins if it's None) whose
+    peak power over the whole of a file is more than threshold_db below the
+    peak of the loudest input, reading the file once.
+    """
+    (samplerate, _) = wav_info(filename)
+    frames = stft_frames(read_wav(filename, block_size), samplerate)
+    peaks = input_peaks(input_frames(frames, matrix))
+    return drop_quiet_columns(matrix, peaks, threshold_db)
+
+def frame_dt(samplerate):
+    # calculated as the difference between the times of successive frames
+    # returned by pylab.specgram, as in the original version
+    hop = NFFT - NOVERLAP
+    return (NFFT / 2 + hop) / samplerate - (NFFT / 2) / samplerate
+
+def frames_power_range(frames):
+    """
+    Range of a stream of power spectra, in decibels.
+    """
+    min_power = np.inf
+    max_power = -np.inf
+    for pxx in frames:
+        power = 10 * np.log10(pxx)
+        finite = power[np.isfinite(power)]
+        if len(finite) > 0:
+            min_power = min(min_power, np.amin(finite))
+            max_power = max(max_power, np.amax(finite))
+    return (min_power, max_power)
+
+def power_range(filename, block_size, matrix=None):
+    """
+    First pass for global normalisation: find the range of the power
+    spectrum (in decibels, mapped by matrix if given) of the whole file.
+    """
+    (samplerate, _) = wav_info(filename)
+    frames = stft_frames(read_wav(filename, block_size), samplerate)
+    return frames_power_range(input_frames(frames, matrix))
+
+def normalised_frames(frames, power_range=None):
+    """
+    Convert power spectra to decibels and normalise them, either by the given
+    (min, max) range or by the range of everything seen so far.
+    """
+    if power_range is not None:
+        (min_power, max_power) = power_range
+    else:
+        min_power = np.inf
+        max_power = -np.inf
+    for pxx in frames:
+        power = 10 * np.log10(pxx)
+        if power_range is None:
+            finite = power[np.isfinite(power)]
+            if len(finite) > 0:
+                min_power = min(min_power, np.amin(finite))
+                max_power = max(max_power, np.amax(finite))
+        # (silent frames go to 0)
+        yield np.clip((power - min_power) / (max_power - min_power), 0, 1)
+
+def smoothed_frames(frames, kernel_len=KERNEL_LEN):
+    """
+    Convolve a stream of frames in time with a kernel of kernel_len ones, as
+    ndimage.convolve does (with the kernel offset one frame back for even
+    lengths, and reflecting the input at both ends).
+    """
+    lookback = (kernel_len - 1) // 2
+    lookahead = kernel_len - 1 - lookback
+    buffered = None
+    for chunk in frames:
+        if buffered is None:
+            buffered = np.pad(chunk, ((lookback, 0), (0, 0)),
+                              mode='symmetric')
+        else:
+            buffered = np.concatenate([buffered, chunk])
+        n_out = len(buffered) - lookback - lookahead
+        if n_out <= 0:
+            continue
+        yield _smooth(buffered, n_out, kernel_len)
+        buffered = buffered[n_out:]
+    if buffered is None:
+        return
+    # reflect the last frames for the final outputs
+    buffered = np.pad(buffered, ((0, lookahead), (0, 0)), mode='symmetric')
+    yield _smooth(buffered, len(buffered) - lookback - lookahead, kernel_len)
+
+def _smooth(buffered, n_out, kernel_len):
+    smoothed = np.zeros((n_out, buffered.shape[1]))
+    for k in range(kernel_len):
+        smoothed += buffered[k:k+n_out]
+    return smoothed
+
+def thresholded_frames(frames, threshold):
+    """
+    Zero everything below threshold in a stream of frames.
+    """
+    for frame in frames:
+        frame = np.array(frame)
+        frame[frame < threshold] = 0
+        yield frame
+
+def n_timesteps(duration, dt):
+    """
+    Number of timesteps Brian would simulate for a run of the given duration.
+    """
+    n_steps = int(np.round(duration / dt))
+    if abs(n_steps * dt - duration) / dt > 1e-4:
+        n_steps = int(np.ceil(duration / dt))
+    return n_steps
+
+class LIFEncoder(object):
+    """
+    Leaky integrate-and-fire neurons driven by a stream of frames, each
+    applying from the timesteps at which a Brian TimedArray would switch to
+    it, integrated with the forward Euler method (as Brian would do) but
+    solved in closed form over each frame.
+
+    Feed frames with encode(); the last frame applies until n_steps.
+    """
+
+    def __init__(self, n_neurons, frame_dt, n_steps, dt=DT, tc_v=TC_V):
+        self.frame_dt = frame_dt
+        self.n_steps = n_steps
+        self.dt = dt
+        # v -> v + (I - v) * dt/tc_v each timestep
+        self.decay = 1 - dt / tc_v
+        self.v = np.zeros(n_neurons)
+        self.n_frames = 0
+        # TimedArray upsamples time by this factor to avoid rounding errors
+        self.timed_array_k = max(
+            int(2**np.ceil(np.log2(8 / dt * frame_dt))), 1)
+
+    def frame_index(self, steps):
+        """
+        The frame which applies at each timestep, as a TimedArray in C++
+        would calculate it (before clipping to the number of frames).
+        """
+        epsilon = self.frame_dt / self.timed_array_k
+        t = steps * self.dt
+        return ((t / epsilon + 0.5) / self.timed_array_k).astype(np.int64)
+
+    def first_step(self, frame):
+        """
+        The first timestep at which the given frame applies.
+        """
+        step = int(frame * self.frame_dt / self.dt)
+        # correct for rounding
+        steps = np.arange(max(step - 2, 0), step + 3)
+        return int(steps[np.searchsorted(self.frame_index(steps), frame)])
+
+    def encode(self, frames, final=False):
+        """
+        Integrate the neurons over the given frames (an array of shape
+        (n_frames, n_neurons)). Returns the timesteps and indices of the
+        spikes, ordered by time and then by index.
+        """
+        all_steps = []
+        all_indices = []
+        for (k, frame) in enumerate(frames):
+            frame_n = self.n_frames + k
+            from_step = self.first_step(frame_n)
+            if final and k == len(frames) - 1:
+                to_step = self.n_steps
+            else:
+                to_step = min(self.first_step(frame_n + 1), self.n_steps)
+            if to_step <= from_step:
+                continue
+            (steps, indices) = self._integrate(frame, to_step - from_step)
+            all_steps.append(steps + from_step)
+            all_indices.append(indices)
+        self.n_frames += len(frames)
+
+        if len(all_steps) == 0:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32))
+        steps = np.concatenate(all_steps)
+        indices = np.concatenate(all_indices)
+        order = np.lexsort((indices, steps))
+        return (steps[order], indices[order].astype(np.int32))
+
+    def _integrate(self, current, n_steps):
+        """
+        Advance all neurons by n_steps with a constant input current,
+        returning the steps (from 0) and indices of the spikes.
+        """
+        v = self.v
+        log_decay = np.log(self.decay)
+        v_end = current + (v - current) * self.decay**n_steps
+
+        # neurons only spike if they're driven above threshold; after m
+        # steps v = I + (v0 - I) * decay^m, which first exceeds 1 after
+        # first_spike steps and then again every period steps after a reset
+        driven = np.nonzero(current > 1)[0]
+        current = current[driven]
+        first_spike = np.floor(np.log((current - 1) / (current - v[driven])) /
+                               log_decay).astype(np.int64) + 1
+        period = np.floor(np.log((current - 1) / current) /
+                          log_decay).astype(np.int64) + 1
+        n_spikes = np.maximum((n_steps - first_spike) // period + 1, 0)
+
+        spiking = n_spikes > 0
+        last_spike = first_spike[spiking] + (n_spikes[spiking] - 1) * \
+            period[spiking]
+        v_end[driven[spiking]] = current[spiking] * \
+            (1 - self.decay**(n_steps - last_spike))
+        self.v = v_end
+
+        # the nth spike of each neuron happens at first_spike + n * period
+        # (counting steps from 1)
+        indices = np.repeat(driven, n_spikes)
+        nth = np.arange(len(indices)) - \
+            np.repeat(np.cumsum(n_spikes) - n_spikes, n_spikes)
+        steps = np.repeat(first_spike - 1, n_spikes) + \
+            nth * np.repeat(period, n_spikes)
+
+        return (steps, indices)
+
+def encoded_blocks(frames, samplerate, n_samples, tc_v=TC_V,
+                   block_callback=None):
+    """
+    Yield the (times, indices) of the spikes encoding a stream of (smoothed
+    and thresholded) input frames from a file of n_samples samples, one block
+    of frames at a time, calling block_callback (if given) with each block
+    before it's encoded.
+    """
+    encoder = None
+    n_steps = n_timesteps(n_samples / samplerate, DT)
+    # look one block ahead so that we know which block is the last
+    previous = None
+    for spectral_input in frames:
+        if previous is not None:
+            yield _encode_block(encoder, previous, False, block_callback)
+        if encoder is None:
+            encoder = LIFEncoder(spectral_input.shape[1],
+                                 frame_dt(samplerate), n_steps, tc_v=tc_v)
+        previous = spectral_input
+    if previous is not None:
+        yield _encode_block(encoder, previous, True, block_callback)
+
+def _encode_block(encoder, spectral_input, final, block_callback):
+    if block_callback is not None:
+        block_callback(spectral_input)
+    (steps, indices) = encoder.encode(spectral_input, final)
+    return (steps * encoder.dt, indices)
+
+def encode_wav(filename, normalisation='global', block_seconds=10.0,
+               frames_callback=None, matrix=None, kernel_len=KERNEL_LEN,
+               threshold=THRESHOLD, tc_v=TC_V):
+    """
+    Yield the (times, indices) of the spikes encoding a .wav file, one block
+    at a time, with the power spectra mapped into inputs by matrix (see
+    input_matrix), if given, smoothed with a kernel of length kernel_len and
+    thresholded at threshold * kernel_len. If given, frames_callback is called
+    with each block of power spectra and the corresponding block of
+    (smoothed) input to the neurons.
+    """
+    (samplerate, n_samples) = wav_info(filename)
+    block_size = int(block_seconds * samplerate)
+
+    if normalisation == 'global':
+        range_ = power_range(filename, block_size, matrix)
+    elif normalisation == 'running':
+        range_ = None
+    else:
+        raise Exception("Unknown normalisation: %s" % normalisation)
+
+    spectra = []
+    def keep_spectra(frames):
+        # keep hold of the spectra for frames_callback
+        for pxx in frames:
+            spectra.append(pxx)
+            yield pxx
+
+    def block_callback(spectral_input):
+        n_frames = len(spectral_input)
+        pxx = np.concatenate(spectra)
+        frames_callback(pxx[:n_frames], spectral_input)
+        spectra[:] = [pxx[n_frames:]]
+
+    frames = stft_frames(read_wav(filename, block_size), samplerate)
+    if frames_callback is not None:
+        frames = keep_spectra(frames)
+    frames = normalised_frames(input_frames(frames, matrix), range_)
+    frames = thresholded_frames(smoothed_frames(frames, kernel_len),
+                                threshold * kernel_len)
+    return encoded_blocks(frames, samplerate, n_samples, tc_v,
+                          None if frames_callback is None else block_callback)
@@ -0,0 +1,108 @@
+"""
+Helpers for simulating a batch of independent copies of the network in one
+Brian run (see stdp_sounds.simulate_batch).
+
+Copy k of the network is made up of neurons k*n_neurons to
+(k+1)*n_neurons - 1 of each layer; all copies share the input neurons.
+With all-to-all input-layer1e connections, synapse i*(batch_size*n_neurons)
++ k*n_neurons + j connects input i to neuron j of copy k.
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import brian2 as b2
+
+import modules.records as record_mod
+import modules.numpy_backend as numpy_mod
+
+def copy_of_neurons(batch_size, n_neurons):
+    """
+    Which copy each neuron in a batched layer belongs to.
+    """
+    return np.repeat(np.arange(batch_size), n_neurons)
+
+def tile_weights(weights, n_inputs, batch_size):
+    """
+    Repeat input-layer1e weights for one copy of the network for every copy.
+    """
+    weights = np.asarray(weights).reshape((n_inputs, -1))
+    return np.tile(weights, (1, batch_size)).ravel()
+
+def copy_synapses(n_inputs, batch_size, n_neurons, k):
+    """
+    Indices of the input-layer1e synapses of copy k, in the order of the
+    synapses of a single network.
+    """
+    indices = np.arange(n_inputs * batch_size * n_neurons)
+    indices = indices.reshape((n_inputs, batch_size, n_neurons))
+    return indices[:, k, :].ravel()
+
+def split_spikes(monitor, batch_size, n_neurons):
+    copies = []
+    indices = np.asarray(monitor.i)
+    times = np.asarray(monitor.t / b2.second)
+    for k in range(batch_size):
+        from_copy = (indices // n_neurons) == k
+        record = record_mod.SpikeRecord(n_neurons)
+        record.append(times[from_copy], indices[from_copy] - k * n_neurons)
+        copies.append(record)
+    return copies
+
+def split_states(monitor, element_indices):
+    """
+    Split a StateMonitor recording elements of a batched group into one
+    StateRecord per copy, with element_indices[k] the (sorted) elements of
+    copy k. The elements recorded by each StateRecord are numbered as in a
+    single network.
+    """
+    units = record_mod.state_units(monitor)
+    record = np.asarray(monitor.record)
+    times = np.asarray(monitor.t_)
+    values = dict((var, np.asarray(getattr(monitor, var + '_')).T)
+                  for var in monitor.record_variables)
+    copies = []
+    for indices in element_indices:
+        columns = np.nonzero(np.isin(record, indices))[0]
+        copies.append(record_mod.StateRecord.from_arrays(
+            monitor.record_variables, units,
+            np.searchsorted(indices, record[columns]),
+            times,
+            dict((var, values[var][:, columns]) for var in values)))
+    return copies
+
+def split_results(connections, monitors, batch_size, n_inputs, n_neurons):
+    """
+    Split the connections and monitors of a batched network into a list of
+    (connections, monitors) for each copy, in the form returned by
+    stdp_sounds.simulate (with the input-layer1e connections represented by
+    the final weights only).
+    """
+    neuron_indices = [np.arange(k * n_neurons, (k + 1) * n_neurons)
+                      for k in range(batch_size)]
+    synapse_indices = [copy_synapses(n_inputs, batch_size, n_neurons, k)
+                       for k in range(batch_size)]
+
+    copies = [({}, {'spikes': {}, 'neurons': {}, 'connections': {}})
+              for _ in range(batch_size)]
+
+    weights = np.asarray(connections['input-layer1e'].w)
+    for (k, (copy_connections, _)) in enumerate(copies):
+        copy_connections['input-layer1e'] = numpy_mod.SynapseState(
+            n_inputs, n_neurons, weights[synapse_indices[k]])
+
+    for (layer, monitor) in monitors['spikes'].items():
+        if layer == 'input':
+            split = [monitor] * batch_size
+        else:
+            split = split_spikes(monitor, batch_size, n_neurons)
+        for (k, (_, copy_monitors)) in enumerate(copies):
+            copy_monitors['spikes'][layer] = split[k]
+
+    for (group_type, element_indices) in [('neurons', neuron_indices),
+                                          ('connections', synapse_indices)]:
+        for (group, monitor) in monitors[group_type].items():
+            split = split_states(monitor, element_indices)
+            for (k, (_, copy_monitors)) in enumerate(copies):
+                copy_monitors[group_type][group] = split[k]
+
+    return copies
@@ -0,0 +1,236 @@
+"""
+Infrastructure for benchmark.py: synthetic inputs of a given size, timing of
+the phases of a benchmark case, and comparison of results with a stored
+baseline.
+
+A size is a dictionary of 'duration' (seconds of input), 'n_inputs' and
+'layer_n_neurons'. Each case is run in a fresh process (so that Brian's device
+and caches, and the peak memory use, belong to that case alone) and returns
+the wall time of each of its phases, in seconds, and any counts worth
+reporting alongside. Results are saved as JSON:
+
+{"machine": {...}, "results": [{"case": ..., "size": {...},
+  "timings": {phase: seconds}, "counts": {...}, "peak_rss_mb": ...,
+  "error": null}, ...]}
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import wave
+import platform
+import multiprocessing
+import numpy as np
+
+import modules.spike_file as spike_file_mod
+import modules.profiling as profiling_mod
+
+# rate of the synthetic input spikes, per input (about that of the encoded
+# test sequences)
+INPUT_RATE = 15.0
+# rate of the synthetic output spikes, per neuron
+OUTPUT_RATE = 20.0
+# frequencies of the notes of the synthetic audio, each NOTE_LENGTH long
+NOTE_FREQS = [440.0, 659.3]
+NOTE_LENGTH = 0.5
+SAMPLERATE = 44100
+
+# timings shorter than this (in seconds) are too noisy to compare
+MIN_COMPARED_SECONDS = 0.05
+
+def size_name(size):
+    return '%gs_%dx%d' % (size['duration'], size['n_inputs'],
+                          size['layer_n_neurons'])
+
+def write_tones_wav(filename, duration, samplerate=SAMPLERATE):
+    """
+    Write a mono 16-bit .wav file of duration seconds of notes alternating
+    between NOTE_FREQS.
+    """
+    t = np.arange(int(duration * samplerate)) / samplerate
+    note = np.floor(t / NOTE_LENGTH).astype(int) % len(NOTE_FREQS)
+    freqs = np.asarray(NOTE_FREQS)[note]
+    samples = (0.5 * np.sin(2 * np.pi * freqs * t) * 2**15).astype(np.int16)
+    wav_file = wave.open(filename, 'wb')
+    wav_file.setnchannels(1)
+    wav_file.setsampwidth(2)
+    wav_file.setframerate(samplerate)
+    wav_file.writeframes(samples.tobytes())
+    wav_file.close()
+
+def random_spikes(duration, n_neurons, rate, dt=spike_file_mod.DEFAULT_DT,
+                  seed=0):
+    """
+    (times, indices) of Poisson spikes of n_neurons firing at rate for
+    duration seconds, in time order, with times on a grid of dt (and at most
+    one spike per neuron per timestep, as SpikeGeneratorGroup requires).
+    """
+    rng = np.random.RandomState(seed)
+    n_spikes = rng.poisson(rate * duration * n_neurons)
+    n_steps = max(int(duration / dt), 1)
+    spikes = np.unique(rng.randint(0, n_steps, n_spikes).astype(np.int64) *
+                       n_neurons + rng.randint(0, n_neurons, n_spikes))
+    return ((spikes // n_neurons) * dt, spikes % n_neurons)
+
+def write_input_spikes(filename, size):
+    """
+    Write a spike file of random input spikes of the given size.
+    """
+    (times, indices) = random_spikes(size['duration'], size['n_inputs'],
+                                     INPUT_RATE)
+    spike_file_mod.write_spikes(filename, times, indices, size['n_inputs'],
+                                duration=size['duration'])
+    return len(times)
+
+class Timings(object):
+    """
+    Wall time of named phases, e.g.:
+
+    with timings.phase('run'):
+        net.run(...)
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.counts = {}
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+class _Phase(object):
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.timings[self.name] = time.time() - self.start
+        return False
+
+def _run_job(job):
+    (name, case, size, work_dir) = job
+    os.chdir(work_dir)
+    timings = Timings()
+    result = {'case': name, 'size': size, 'error': None}
+    # (what the case prints goes to <work_dir>/<case>.log)
+    stdout = sys.stdout
+    sys.stdout = open('%s.log' % name, 'a')
+    try:
+        case(size, timings)
+    except Exception as e:
+        result['error'] = '%s: %s' % (type(e).__name__, e)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    result['timings'] = timings.timings
+    result['counts'] = timings.counts
+    result['peak_rss_mb'] = profiling_mod.peak_rss_mb()
+    return result
+
+def run_case(name, case, size, work_dir):
+    """
+    Run case(size, timings) in a new process in work_dir, returning its
+    result.
+    """
+    pool = multiprocessing.Pool(1)
+    try:
+        return pool.apply(_run_job, [(name, case, size, work_dir)])
+    finally:
+        pool.close()
+        pool.join()
+
+def best_of(results):
+    """
+    Combine the results of repeats of the same case and size: the shortest
+    time of each phase and the highest peak memory use.
+    """
+    best = dict(results[0])
+    best['timings'] = {}
+    for result in results:
+        if result['error'] is not None:
+            return result
+        for (name, seconds) in result['timings'].items():
+            best['timings'][name] = min(seconds,
+                                        best['timings'].get(name, seconds))
+    rss = [result['peak_rss_mb'] for result in results
+           if result['peak_rss_mb'] is not None]
+    best['peak_rss_mb'] = max(rss) if rss else None
+    best['repeats'] = len(results)
+    return best
+
+def machine_info():
+    import brian2
+    return {'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': multiprocessing.cpu_count(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'brian2': brian2.__version__}
+
+def save_results(filename, results):
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(filename, 'w') as f:
+        json.dump({'machine': machine_info(), 'results': results}, f,
+                  indent=1, sort_keys=True)
+
+def load_results(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def _key(result):
+    return (result['case'], json.dumps(result['size'], sort_keys=True))
+
+def compare(results, baseline, tolerance):
+    """
+    Compare the timings of results with those of the same case, size and
+    phase in a baseline (as saved by save_results). Returns a list of
+    (case, size, phase, baseline seconds, seconds, ratio, regressed), with
+    regressed True for phases over (1 + tolerance) times slower than in the
+    baseline (and slower by at least MIN_COMPARED_SECONDS).
+    """
+    baseline_results = dict((_key(result), result)
+                            for result in baseline['results'])
+    comparisons = []
+    for result in results:
+        old = baseline_results.get(_key(result))
+        if old is None or old['error'] is not None or \
+                result['error'] is not None:
+            continue
+        for (name, seconds) in sorted(result['timings'].items()):
+            if name not in old['timings']:
+                continue
+            old_seconds = old['timings'][name]
+            ratio = seconds / max(old_seconds, 1e-9)
+            regressed = (ratio > 1 + tolerance and
+                         seconds - old_seconds >= MIN_COMPARED_SECONDS)
+            comparisons.append((result['case'], result['size'], name,
+                                old_seconds, seconds, ratio, regressed))
+    return comparisons
+
+def print_results(results):
+    for result in results:
+        print("%s %s:" % (result['case'], size_name(result['size'])))
+        if result['error'] is not None:
+            print("  failed: %s" % result['error'])
+            continue
+        for (name, seconds) in sorted(result['timings'].items()):
+            print("  %-20s %9.3f s" % (name, seconds))
+        for (name, count) in sorted(result['counts'].items()):
+            print("  %-20s %9g" % (name, count))
+        if result['peak_rss_mb'] is not None:
+            print("  %-20s %9.1f MB" % ('peak RSS', result['peak_rss_mb']))
+
+def print_comparisons(comparisons):
+    for (case, size, name, old_seconds, seconds, ratio, regressed) in \
+            comparisons:
+        print("%s %s %-20s %9.3f s -> %9.3f s (x%.2f)%s" %
+              (case, size_name(size), name, old_seconds, seconds, ratio,
+               '  REGRESSION' if regressed else ''))
@@ -0,0 +1,124 @@
+"""
+On-disk cache of compiled standalone projects.
+
+Entries are keyed by a hash of everything which ends up in the generated code
+(the structure of the network, the monitors, the run time and any parameters
+which are still namespace constants), so that runs which differ only in
+parameters passed as run-time arguments can reuse a compiled project.
+
+Each run works in its own copy of a cached project, so that concurrent runs
+never write to the same directory; Brian only rewrites source files whose
+contents have changed, so 'make' finds nothing to recompile in the copy.
+The least recently used entries are evicted once there are more than
+max_entries of them.
+"""
+
+from __future__ import print_function, division
+import os
+import shutil
+import hashlib
+import brian2 as b2
+
+def default_cache_dir():
+    if os.name == 'nt':
+        return 'C:\\temp\\stdp_sounds_build_cache'
+    else:
+        return '/tmp/stdp_sounds_build_cache'
+
+def structure_key(structure):
+    """
+    Hash a dictionary describing the structure of a network.
+    """
+    structure = dict(structure)
+    structure['brian_version'] = b2.__version__
+    description = repr(sorted((key, repr(value))
+                              for (key, value) in structure.items()))
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+def checkout(cache_dir, key, build_dir):
+    """
+    Copy the cached project with the given key (if there is one) to build_dir.
+    Returns whether the project was found in the cache.
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return False
+
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    try:
+        shutil.copytree(entry_dir, build_dir, symlinks=True)
+    except (OSError, shutil.Error):
+        # evicted while we were copying it
+        shutil.rmtree(build_dir, ignore_errors=True)
+        return False
+    # mark as recently used
+    os.utime(entry_dir, None)
+
+    return True
+
+def restore_reordered_sources(cache_dir, key, build_dir):
+    """
+    Put back the cached version of any source file which Brian has just
+    regenerated with the same lines in a different order.
+
+    (Brian initialises the clocks in main.cpp in the iteration order of a set
+    of clocks, which changes from process to process; the order doesn't
+    matter, but without this 'make' would recompile main.cpp every time.)
+    """
+    entry_dir = os.path.join(cache_dir, key)
+    if not os.path.isdir(entry_dir):
+        return
+    for name in os.listdir(build_dir):
+        if not name.endswith(('.cpp', '.h')):
+            continue
+        cached_filename = os.path.join(entry_dir, name)
+        filename = os.path.join(build_dir, name)
+        if not os.path.exists(cached_filename):
+            continue
+        with open(filename) as source_file:
+            lines = source_file.readlines()
+        with open(cached_filename) as source_file:
+            cached_lines = source_file.readlines()
+        if lines != cached_lines and sorted(lines) == sorted(cached_lines):
+            shutil.copy2(cached_filename, filename)
+
+def store(cache_dir, key, build_dir, max_entries):
+    """
+    Add the compiled project in build_dir to the cache under the given key,
+    evicting the least recently used entries if necessary.
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    entry_dir = os.path.join(cache_dir, key)
+    if os.path.isdir(entry_dir):
+        return
+
+    # copy to a temporary directory first and then rename, so that other
+    # processes never see an incomplete entry
+    tmp_dir = '%s.tmp%d' % (entry_dir, os.getpid())
+    shutil.copytree(build_dir, tmp_dir, symlinks=True,
+                    ignore=shutil.ignore_patterns('results*'))
+    try:
+        os.rename(tmp_dir, entry_dir)
+    except OSError:
+        # another process stored the same project first
+        shutil.rmtree(tmp_dir)
+
+    evict(cache_dir, max_entries)
+
+def evict(cache_dir, max_entries):
+    """
+    Remove all but the max_entries most recently used entries.
+    """
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir)
+               if '.' not in name]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for entry_dir in entries[max_entries:]:
+        # rename first, so that nobody starts copying a half-deleted entry
+        doomed_dir = '%s.evicted%d' % (entry_dir, os.getpid())
+        try:
+            os.rename(entry_dir, doomed_dir)
+        except OSError:
+            continue
+        shutil.rmtree(doomed_dir, ignore_errors=True)
@@ -0,0 +1,99 @@
+"""
+Checkpointing a run so that it can be continued later from where it got to,
+with exactly the same results as if it hadn't been interrupted.
+
+A checkpoint is a pickle file in the format of Brian's Network.store (which
+the NumPy backend's Network.store follows), holding:
+* NETWORK_STATE: everything stored by the network's store(): all state
+  variables of the neurons and synapses (including the pre/post traces and
+  last spike times), the input spikes and how far through them the input
+  group has got, what the monitors have recorded, and the simulation time
+* CHECKPOINT_INFO: the time of the checkpoint, the parameters which have to
+  be the same for the run to be resumed (see RUN_PARAMS), and the state of
+  the other segment listeners (e.g. a selectivity_mod.SelectivityTracker)
+Each checkpoint is written to a temporary file which then replaces the last
+one, so a run interrupted while writing still leaves the last checkpoint.
+"""
+
+from __future__ import print_function, division
+import os
+import pickle
+import brian2 as b2
+
+NETWORK_STATE = 'network'
+CHECKPOINT_INFO = 'checkpoint'
+# run parameters which have to match those of the checkpointed run
+RUN_PARAMS = ['input_spikes_filename', 'layer_n_neurons', 'run_time',
+              'input_window', 'backend']
+
+def checkpoint_filename(run_id):
+    return 'results/checkpoint_%s.pickle' % run_id
+
+def run_info(run_params):
+    return dict((name, run_params.get(name)) for name in RUN_PARAMS)
+
+class Checkpointer(object):
+    """
+    Save the state of net, and of the listeners which have a
+    checkpoint_state() method, to filename every period seconds of
+    simulation time (see stdp_sounds.run_windows).
+    """
+
+    def __init__(self, filename, net, period, run_params, listeners=()):
+        self.filename = filename
+        self.net = net
+        self.period = period
+        self.run_info = run_info(run_params)
+        self.listeners = listeners
+        self.stopped_at = None
+
+    def segment_done(self, end):
+        """
+        Called by stdp_sounds.run_windows every period; saves a checkpoint.
+        """
+        self.save(end)
+        return False
+
+    def save(self, end):
+        info = {
+            't': float(end),
+            'run': self.run_info,
+            'listeners': [listener.checkpoint_state()
+                          for listener in self.listeners
+                          if hasattr(listener, 'checkpoint_state')]
+        }
+        temp_filename = self.filename + '.tmp'
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        with open(temp_filename, 'wb') as f:
+            pickle.dump({CHECKPOINT_INFO: info}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        self.net.store(NETWORK_STATE, filename=temp_filename)
+        os.replace(temp_filename, self.filename)
+        print("Saved checkpoint at %.1f s to %s" % (end, self.filename))
+
+def resume(filename, net, run_params, listeners=()):
+    """
+    Restore net and listeners (the same listeners, in the same order, as
+    were given to the Checkpointer) from the checkpoint in filename.
+    Returns the time the run got to.
+    """
+    with open(filename, 'rb') as f:
+        info = pickle.load(f)[CHECKPOINT_INFO]
+    for (name, value) in sorted(run_info(run_params).items()):
+        saved = info['run'][name]
+        if (saved is None) != (value is None) or \
+                (value is not None and saved != value):
+            raise ValueError("Can't resume from %s: %s was %s, not %s" %
+                             (filename, name, saved, value))
+
+    net.restore(NETWORK_STATE, filename=filename)
+    listeners = [listener for listener in listeners
+                 if hasattr(listener, 'checkpoint_state')]
+    if len(listeners) != len(info['listeners']):
+        raise ValueError("Can't resume from %s: it was checkpointed with "
+                         "different tracking options" % filename)
+    for (listener, state) in zip(listeners, info['listeners']):
+        listener.restore_state(state)
+    print("Resuming from %.1f s (%s)" % (info['t'], filename))
+    return info['t'] * b2.second
@@ -0,0 +1,139 @@
+"""
+Stopping a run once learning has converged, rather than always running until
+the end of the input.
+
+Every period seconds of simulation time (see stdp_sounds.run_windows),
+ConvergenceMonitor compares the input-layer1e weights with those at the last
+check, and which output neurons won (fired) during which notes with the last
+period. Once both have changed by less than the thresholds for patience
+checks in a row, the run is stopped. The output spikes are counted at the
+end of every segment, before a DiskRecorder can empty the monitor.
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import brian2 as b2
+
+import modules.utils as utils_mod
+import modules.selectivity as selectivity_mod
+
+class ConvergenceMonitor(object):
+    """
+    Stop the run once the weights of synapses and the winners among the
+    neurons recorded by spike_monitor have stopped changing:
+    * the weight change is the mean absolute change of a weight since the
+      last check, as a fraction of max_weight
+    * the winner change is how much the share of the period's spikes fired
+      by each neuron during each note changed since the last period (the
+      total variation distance, from 0 for the same winners to 1 for
+      completely different ones); with n_notes 1 (the note structure
+      unknown), just which neurons fired
+    """
+
+    def __init__(self, synapses, spike_monitor, n_neurons, period,
+                 max_weight, max_weight_change, max_winner_change, patience,
+                 note_length=None, n_notes=1):
+        self.synapses = synapses
+        self.spike_monitor = spike_monitor
+        self.n_neurons = n_neurons
+        self.period = period
+        self.max_weight = max_weight
+        self.max_weight_change = max_weight_change
+        self.max_winner_change = max_winner_change
+        self.patience = patience
+        if note_length is None:
+            self.note_length = float(period)
+            self.n_notes = 1
+        else:
+            self.note_length = float(note_length)
+            self.n_notes = n_notes
+        # spike counts since the last check, counted up to counted_to
+        self.counted_to = 0.0
+        self.counts = np.zeros((n_neurons, self.n_notes), dtype=int)
+        self.last_weights = self._weights()
+        self.last_shares = None
+        self.n_converged = 0
+        # (end, weight change, winner change) at each check
+        self.history = []
+        self.stopped_at = None
+        self.final_weights = None
+
+    def _weights(self):
+        return np.array(self.synapses.w, dtype=float)
+
+    def _shares(self):
+        n_spikes = np.sum(self.counts)
+        if n_spikes == 0:
+            return None
+        return self.counts / n_spikes
+
+    def count_segment(self, end):
+        """
+        Count the spikes since they were last counted, up to end.
+        """
+        end = float(end)
+        (indices, times) = selectivity_mod.spikes_between(
+            self.spike_monitor, self.counted_to, end)
+        self.counts += utils_mod.count_note_responses(
+            indices, times, self.note_length, self.n_notes, self.n_neurons)
+        self.counted_to = end
+
+    def segment_done(self, end):
+        """
+        Measure the changes since the last check, up to end. Returns True if
+        the run should be stopped.
+        """
+        end = float(end)
+        if end > self.counted_to:
+            self.count_segment(end)
+        weights = self._weights()
+        weight_change = np.mean(np.abs(weights - self.last_weights)) / \
+            self.max_weight
+        shares = self._shares()
+        if shares is None or self.last_shares is None:
+            # (no winners to compare)
+            winner_change = 1.0
+        else:
+            winner_change = 0.5 * np.sum(np.abs(shares - self.last_shares))
+        self.counts = np.zeros((self.n_neurons, self.n_notes), dtype=int)
+        self.last_weights = weights
+        self.last_shares = shares
+        self.history.append((end, weight_change, winner_change))
+
+        if weight_change < self.max_weight_change and \
+                winner_change < self.max_winner_change:
+            self.n_converged += 1
+        else:
+            self.n_converged = 0
+        print("%.1f s: weight change %.2g, winner change %.2g (%d/%d)" %
+              (end, weight_change, winner_change, self.n_converged,
+               self.patience))
+
+        if self.n_converged >= self.patience:
+            print("Stopping: converged after %.1f s" % end)
+            self.stopped_at = end * b2.second
+            self.final_weights = weights
+            return True
+        return False
+
+    def checkpoint_state(self):
+        """
+        What has to be saved to continue from a checkpoint (see
+        checkpoint_mod).
+        """
+        return {
+            'counted_to': self.counted_to,
+            'counts': self.counts,
+            'last_weights': self.last_weights,
+            'last_shares': self.last_shares,
+            'n_converged': self.n_converged,
+            'history': self.history
+        }
+
+    def restore_state(self, state):
+        self.counted_to = state['counted_to']
+        self.counts = state['counts']
+        self.last_weights = state['last_weights']
+        self.last_shares = state['last_shares']
+        self.n_converged = state['n_converged']
+        self.history = state['history']
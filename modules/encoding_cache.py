@@ -0,0 +1,290 @@
+"""
+On-disk cache of each stage of the conversion of audio into input spikes
+(see modules/audio.py):
+* 'stft': the power spectra of the frames of the audio, keyed by the contents
+  of the .wav file
+* 'normalised': mapped into inputs by an input matrix, in decibels and
+  normalised
+* 'smoothed': convolved in time with a kernel of ones
+* 'thresholded': with everything below the threshold zeroed
+* 'spikes': the spike file encoding the thresholded input
+Each stage is keyed by a hash of the key of the stage before it and its own
+parameters, so that changing the parameters of a later stage (say, the
+threshold) reuses the earlier stages rather than recomputing them.
+
+Spectra are stored as .npy files, written and read a block of frames at a
+time, so memory use is bounded as with audio_mod.encode_wav; the stages are
+still streamed through the same functions in blocks of the same sizes, so the
+spikes are exactly the same as encode_wav gives.
+"""
+
+from __future__ import print_function, division
+import os
+import json
+import hashlib
+import numpy as np
+
+import modules.audio as audio_mod
+import modules.spike_file as spike_file_mod
+
+def default_cache_dir():
+    if os.name == 'nt':
+        return 'C:\\temp\\stdp_sounds_encoding_cache'
+    else:
+        return '/tmp/stdp_sounds_encoding_cache'
+
+def file_hash(filename, block_size=2**20):
+    """
+    SHA-1 of the contents of a file.
+    """
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) == 0:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+def array_hash(array):
+    """
+    SHA-1 of an array (or None).
+    """
+    if array is None:
+        return None
+    array = np.ascontiguousarray(array)
+    sha1 = hashlib.sha1(repr((array.dtype.str, array.shape)).encode('utf-8'))
+    sha1.update(array.tobytes())
+    return sha1.hexdigest()
+
+def stage_key(parent_key, stage, params):
+    """
+    Key of a stage with the given parameters (a JSON-serialisable dict) run
+    on the output of the stage with key parent_key.
+    """
+    description = json.dumps([parent_key, stage, params], sort_keys=True)
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+class StageCache(object):
+    """
+    Outputs of pipeline stages stored in a directory, as
+    <stage>.<key><extension> plus a <stage>.<key><extension>.json file
+    holding information about it, which is only written once the output is
+    complete.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # (another process may have just made it)
+            if not os.path.isdir(directory):
+                raise
+
+    def filename(self, stage, key, extension='.npy'):
+        return os.path.join(self.directory,
+                            '%s.%s%s' % (stage, key, extension))
+
+    def get(self, stage, key, compute, extension='.npy'):
+        """
+        Get (filename, info) of the output of a stage, first calling
+        compute(filename) to write it to filename (returning
+        JSON-serialisable info about it) if it isn't cached.
+        """
+        filename = self.filename(stage, key, extension)
+        info_filename = filename + '.json'
+        if os.path.exists(info_filename):
+            with open(info_filename) as f:
+                return (filename, json.load(f))
+
+        print("Computing %s..." % stage)
+        # (write to temporary files first, so that concurrent runs never see
+        # half-written outputs)
+        tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        info = compute(tmp_filename)
+        os.replace(tmp_filename, filename)
+        with open(info_filename + '.tmp%d' % os.getpid(), 'w') as f:
+            json.dump(info, f, sort_keys=True)
+        os.replace(info_filename + '.tmp%d' % os.getpid(), info_filename)
+        return (filename, info)
+
+def _write_frames(filename, frames, shape):
+    """
+    Write a stream of frames to a .npy file of the given shape.
+    """
+    out = np.lib.format.open_memmap(filename, mode='w+', dtype=np.float64,
+                                    shape=shape)
+    start = 0
+    for chunk in frames:
+        out[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    if start != shape[0]:
+        raise ValueError("Expected %d frames, got %d" % (shape[0], start))
+    out.flush()
+    del out
+
+def _blocks(frames, block_frames):
+    """
+    Yield a (memory-mapped) array of frames in blocks of the given sizes.
+    """
+    start = 0
+    for n_frames in block_frames:
+        yield np.asarray(frames[start:start + n_frames])
+        start += n_frames
+
+class EncodingPipeline(object):
+    """
+    Encode a .wav file as audio_mod.encode_wav would, caching each stage in a
+    StageCache.
+    """
+
+    def __init__(self, filename, cache, normalisation='global',
+                 block_seconds=10.0):
+        if normalisation not in ['global', 'running']:
+            raise Exception("Unknown normalisation: %s" % normalisation)
+        self.filename = filename
+        self.cache = cache
+        self.normalisation = normalisation
+        (self.samplerate, self.n_samples) = audio_mod.wav_info(filename)
+        self.block_size = int(block_seconds * self.samplerate)
+        self.source_sha1 = file_hash(filename)
+        self.source_key = stage_key(None, 'wav', self.source_sha1)
+
+    def _load(self, filename):
+        return np.load(filename, mmap_mode='r')
+
+    def _stft(self):
+        hop = audio_mod.NFFT - audio_mod.NOVERLAP
+        n_frames = max((self.n_samples - audio_mod.NOVERLAP) // hop, 0)
+        # (the block size decides how the frames are split into blocks, which
+        # running normalisation depends on)
+        key = stage_key(self.source_key, 'stft', {
+            'nfft': audio_mod.NFFT,
+            'noverlap': audio_mod.NOVERLAP,
+            'block_size': self.block_size
+        })
+
+        def compute(filename):
+            block_frames = []
+            def count(frames):
+                for pxx in frames:
+                    block_frames.append(len(pxx))
+                    yield pxx
+            frames = audio_mod.stft_frames(
+                audio_mod.read_wav(self.filename, self.block_size),
+                self.samplerate)
+            _write_frames(filename, count(frames),
+                          (n_frames, audio_mod.NFFT // 2 + 1))
+            return {'block_frames': block_frames}
+
+        (filename, info) = self.cache.get('stft', key, compute)
+        return (key, self._load(filename), info['block_frames'])
+
+    def stft(self):
+        """
+        The power spectra of the frames of the audio, as an array of shape
+        (n_frames, NFFT/2 + 1).
+        """
+        return self._stft()[1]
+
+    def drop_silent_inputs(self, matrix, threshold_db):
+        """
+        As audio_mod.drop_silent_inputs, but from the cached spectra.
+        """
+        (_, pxx, block_frames) = self._stft()
+        frames = audio_mod.input_frames(_blocks(pxx, block_frames), matrix)
+        return audio_mod.drop_quiet_columns(
+            matrix, audio_mod.input_peaks(frames), threshold_db)
+
+    def _n_inputs(self, matrix):
+        if matrix is None:
+            return audio_mod.NFFT // 2 + 1
+        return matrix.shape[1]
+
+    def _stage(self, stage, parent, params, process):
+        """
+        Run process (a function of a stream of blocks of frames, giving a
+        stream of frames) on the output of a parent stage (key, frames,
+        block_frames).
+        """
+        (parent_key, parent_frames, block_frames) = parent
+        key = stage_key(parent_key, stage, params)
+
+        def compute(filename):
+            frames = process(_blocks(parent_frames, block_frames))
+            _write_frames(filename, frames,
+                          (len(parent_frames), params['n_inputs']))
+            return {}
+
+        (filename, _) = self.cache.get(stage, key, compute)
+        return (key, self._load(filename), block_frames)
+
+    def _normalised(self, matrix):
+        (stft_key, pxx, block_frames) = self._stft()
+        params = {'normalisation': self.normalisation,
+                  'matrix': array_hash(matrix),
+                  'n_inputs': self._n_inputs(matrix)}
+
+        def process(blocks):
+            # (global normalisation needs a pass over all the frames first,
+            # which is only made if the stage isn't cached)
+            if self.normalisation == 'global':
+                range_ = audio_mod.frames_power_range(audio_mod.input_frames(
+                    _blocks(pxx, block_frames), matrix))
+            else:
+                range_ = None
+            return audio_mod.normalised_frames(
+                audio_mod.input_frames(blocks, matrix), range_)
+
+        return self._stage('normalised', (stft_key, pxx, block_frames),
+                           params, process)
+
+    def _smoothed(self, matrix, kernel_len):
+        return self._stage(
+            'smoothed', self._normalised(matrix),
+            {'kernel_len': kernel_len, 'n_inputs': self._n_inputs(matrix)},
+            lambda blocks: audio_mod.smoothed_frames(blocks, kernel_len))
+
+    def _thresholded(self, matrix, kernel_len, threshold):
+        return self._stage(
+            'thresholded', self._smoothed(matrix, kernel_len),
+            {'threshold': threshold, 'n_inputs': self._n_inputs(matrix)},
+            lambda blocks: audio_mod.thresholded_frames(
+                blocks, threshold * kernel_len))
+
+    def thresholded(self, matrix=None, kernel_len=audio_mod.KERNEL_LEN,
+                    threshold=audio_mod.THRESHOLD):
+        """
+        The input to the neurons (normalised, smoothed and thresholded) as an
+        array of shape (n_frames, n_inputs).
+        """
+        return self._thresholded(matrix, kernel_len, threshold)[1]
+
+    def spike_file(self, matrix=None, kernel_len=audio_mod.KERNEL_LEN,
+                   threshold=audio_mod.THRESHOLD, tc_v=audio_mod.TC_V,
+                   metadata=None):
+        """
+        Filename of the cached spike file encoding the audio, with the given
+        metadata.
+        """
+        parent = self._thresholded(matrix, kernel_len, threshold)
+        key = stage_key(parent[0], 'spikes', {
+            'dt': audio_mod.DT,
+            'tc_v': tc_v,
+            'metadata': metadata
+        })
+
+        def compute(filename):
+            writer = spike_file_mod.SpikeFileWriter(
+                filename, n_inputs=self._n_inputs(matrix), dt=audio_mod.DT,
+                metadata=metadata)
+            for (times, indices) in audio_mod.encoded_blocks(
+                    _blocks(parent[1], parent[2]), self.samplerate,
+                    self.n_samples, tc_v):
+                writer.write_times(times, indices)
+            writer.close(duration=self.n_samples/self.samplerate)
+            return {}
+
+        return self.cache.get('spikes', key, compute,
+                              spike_file_mod.FILE_EXTENSION)[0]
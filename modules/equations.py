@@ -1,3 +1,5 @@
+import re
+
 reset_e = '''
 v = v_reset_e
 theta = theta + theta_coef * (max_theta - theta)
@@ -16,15 +18,25 @@ dgi/dt = -gi / tc_gi     : siemens
 # 1. 'v_rest - v' pulls v towards v_rest
 # 2. 'ge * (0 - v)' pulls v towards 0, proportionally to ge
 # 3. 'ge * (-100 - v)' pulls v towards -100, proportionally to gi
-neuron_eqs_e = neuron_eqs + '''
+neuron_eqs_e_common = neuron_eqs + '''
 dv/dt = ((v_rest - v) + (I_synE + I_synI) * 1 * ohm) / tc_v : volt (unless refractory)
-dtheta/dt = -theta / (tc_theta)                             : volt
 theta_mod                                                   : 1
 max_ge                                                      : siemens
 x                                                           : 1
 y                                                           : 1
 '''
 
+neuron_eqs_e = neuron_eqs_e_common + '''
+dtheta/dt = -theta / (tc_theta)                             : volt
+'''
+
+# for inference with a trained network (see stdp_sounds.simulate_inference):
+# the adaptive thresholds are fixed at their trained values
+neuron_eqs_e_frozen = neuron_eqs_e_common + '''
+theta                                                       : volt (constant)
+'''
+reset_e_frozen = 'v = v_reset_e'
+
 reset_i = 'v = v_reset_i'
 thresh_i = 'v > v_thresh_i'
 
@@ -48,3 +60,34 @@ eqs_stdp_post_ee = '''
 post = 1
 w = clip(w + nu_ee_post * pre, 0, wmax_ee)
 '''
+
+# parameters which can be made variables of their group rather than constants
+# in its namespace, mapped to the names and units of those variables
+# ('_pre' and '_post' suffixes are reserved for synaptic variables,
+# so the STDP learning rates have to be renamed)
+variable_params_e = {
+    'theta_coef': ('theta_coef', '1'),
+    'max_theta': ('max_theta', 'volt')
+}
+variable_params_stdp_ee = {
+    'nu_ee_pre': ('nu_ee_depress', '1'),
+    'nu_ee_post': ('nu_ee_potentiate', '1'),
+    'pre_w_decrease': ('pre_w_decrease', '1')
+}
+
+def variable_params_eqs(variable_params, flags):
+    """
+    Equations declaring the given parameters as variables with the given flags
+    (e.g. 'shared, constant').
+    """
+    return ''.join('%s : %s (%s)\n' % (variable_params[name] + (flags,))
+                   for name in sorted(variable_params))
+
+def rename_variable_params(code, variable_params):
+    """
+    Replace the names of the given parameters in code by the names of the
+    variables declared for them.
+    """
+    for (name, (var_name, _)) in variable_params.items():
+        code = re.sub(r'\b%s\b' % name, var_name, code)
+    return code
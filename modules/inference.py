@@ -0,0 +1,130 @@
+"""
+Running a trained network on new inputs, with learning turned off.
+
+A model holds the input-layer1e weights and layer1e adaptive thresholds
+(theta) at the end of a training run (stdp_sounds.py --save_model), along
+with the neuron and connection parameters it was trained with. infer.py then
+runs any number of spike files through one network built from the model
+(stdp_sounds.simulate_inference): the files are played one after the other,
+with a rest between them for the network to settle back to rest, so that
+the network only has to be built (and compiled) once.
+
+Since most of the input-layer1e weights of a trained network end up close to
+zero, a model can be pruned (prune_model) to the strongest weights onto each
+output neuron, so that the network is built with only those synapses.
+"""
+
+from __future__ import print_function, division
+import pickle
+import numpy as np
+
+import modules.spike_file as spike_file_mod
+
+MODEL_VERSION = 1
+
+def model_filename(run_id):
+    return 'results/model_%s.pickle' % run_id
+
+def save_model(filename, weights, theta, neuron_params, connection_params):
+    """
+    Save a trained network: weights in the order of Brian's all-to-all
+    synapses (input-major) and theta in volts, both unitless.
+    """
+    weights = np.array(weights, dtype=float)
+    theta = np.array(theta, dtype=float)
+    model = {
+        'version': MODEL_VERSION,
+        'n_inputs': len(weights) // len(theta),
+        'layer_n_neurons': len(theta),
+        'weights': weights,
+        'theta': theta,
+        'neuron_params': neuron_params,
+        'connection_params': connection_params
+    }
+    with open(filename, 'wb') as model_file:
+        pickle.dump(model, model_file, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_model(filename):
+    with open(filename, 'rb') as model_file:
+        model = pickle.load(model_file)
+    if model.get('version') != MODEL_VERSION:
+        raise ValueError("%s isn't a model file (version %d)" %
+                         (filename, MODEL_VERSION))
+    return model
+
+def model_synapses(model):
+    """
+    (i, j) of each of the weights of a model: all-to-all, in the order of
+    Brian's all-to-all synapses, unless it's been pruned.
+    """
+    if 'i' in model:
+        return (model['i'], model['j'])
+    n_inputs = model['n_inputs']
+    n_neurons = model['layer_n_neurons']
+    return (np.repeat(np.arange(n_inputs), n_neurons),
+            np.tile(np.arange(n_neurons), n_inputs))
+
+def prune_model(model, threshold=None, top_k=None):
+    """
+    A copy of a model with only the input-layer1e synapses with weights of
+    at least threshold and/or among the top_k strongest onto each output
+    neuron.
+    """
+    (i, j) = model_synapses(model)
+    weights = model['weights']
+    keep = np.ones(len(weights), dtype=bool)
+    if threshold is not None:
+        keep &= weights >= threshold
+    if top_k is not None:
+        # rank of each weight among those onto the same neuron, strongest
+        # first (stable, so ties go to the lower input index)
+        order = np.lexsort((-weights, j))
+        rank = np.empty(len(weights), dtype=int)
+        starts = np.searchsorted(j[order], j[order])
+        rank[order] = np.arange(len(weights)) - starts
+        keep &= rank < top_k
+
+    pruned = dict(model)
+    pruned['i'] = i[keep]
+    pruned['j'] = j[keep]
+    pruned['weights'] = weights[keep]
+    return pruned
+
+def concatenate_inputs(spike_filenames, rest):
+    """
+    Load the spikes of each spike file and play them one after the other,
+    each starting a whole number of seconds after the last spike of the one
+    before plus rest seconds.
+    Returns (times, indices, offsets, durations), with the offsets and
+    durations of the files in seconds.
+    """
+    all_times = []
+    all_indices = []
+    offsets = []
+    durations = []
+    offset = 0.0
+    for filename in spike_filenames:
+        (times, indices) = spike_file_mod.load_spikes(filename)
+        duration = float(np.ceil(spike_file_mod.last_spike_time(filename)))
+        all_times.append(np.asarray(times) + offset)
+        all_indices.append(np.asarray(indices))
+        offsets.append(offset)
+        durations.append(duration)
+        offset += duration + rest
+    return (np.concatenate(all_times), np.concatenate(all_indices),
+            offsets, durations)
+
+def split_spikes(indices, times, offsets, durations):
+    """
+    Split spikes (times in seconds) from a run of concatenated inputs by
+    input, as a list of (indices, times relative to the start of the input)
+    for each one.
+    """
+    indices = np.asarray(indices)
+    times = np.asarray(times)
+    split = []
+    for (offset, duration) in zip(offsets, durations):
+        from_n = np.searchsorted(times, offset - 1e-9)
+        to_n = np.searchsorted(times, offset + duration - 1e-9)
+        split.append((indices[from_n:to_n], times[from_n:to_n] - offset))
+    return split
@@ -0,0 +1,192 @@
+"""
+Monitoring policies: which state variables are recorded, from which elements
+and how often.
+
+A policy (monitor_params['monitor_policy']) maps '<group>.<variable>' (e.g.
+'layer1e.v' or 'input-layer1e.w') to a mode, optionally followed by
+'@<dt in ms>' to record it at a different interval to --monitors_dt:
+* 'all': every element
+* 'firing': every element while running, but afterwards only the neurons
+  which fired (or, for synapses, the synapses onto them) are kept. Which
+  neurons fire isn't known until the end, so this only shrinks what's saved:
+  the memory used during the run is the same as for 'all'
+* 'ends': every element, but only at the start and end of the run
+* 'off': not recorded at all
+Variables which aren't in the policy are recorded with 'all'.
+
+Variables of a group recorded in the same way share a monitor. The first of
+these monitors (in the order of STATE_VARIABLES) is keyed by the name of the
+group, as before; the others by '<group>.<first variable>'. Use
+state_monitor() to find the monitor recording a variable.
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import brian2 as b2
+
+import modules.records as record_mod
+
+# (group type, group, variables) of everything which can be monitored
+STATE_VARIABLES = [
+    ('neurons', 'layer1e', ['v', 'ge', 'max_ge', 'theta']),
+    ('neurons', 'layer1vis', ['v']),
+    ('connections', 'input-layer1e', ['w', 'post', 'pre'])
+]
+MODES = ['all', 'firing', 'ends', 'off']
+
+def group_variables(group):
+    for (_, name, variables) in STATE_VARIABLES:
+        if name == group:
+            return variables
+    raise ValueError("Unknown group to monitor: %s" % group)
+
+def parse_setting(setting):
+    """
+    Parse a 'MODE[@DT]' setting into (mode, dt), with dt None if not given.
+    """
+    (mode, _, dt) = setting.partition('@')
+    if mode not in MODES:
+        raise ValueError("Unknown monitoring mode '%s' (should be one of %s)" %
+                         (mode, ', '.join(MODES)))
+    if dt == '':
+        return (mode, None)
+    return (mode, float(dt) * b2.ms)
+
+def parse_policy(specs):
+    """
+    Parse a list of 'VAR=MODE[@DT]' strings from the command line into a
+    policy, where VAR is '<group>.<variable>' or just '<group>' for all of the
+    group's variables. Later settings override earlier ones.
+    """
+    policy = {}
+    for spec in specs:
+        (name, _, setting) = spec.partition('=')
+        parse_setting(setting)
+        (group, _, var) = name.partition('.')
+        variables = group_variables(group)
+        if var == '':
+            names = ['%s.%s' % (group, v) for v in variables]
+        elif var in variables:
+            names = [name]
+        else:
+            raise ValueError("%s has no variable '%s' to monitor" %
+                             (group, var))
+        for name in names:
+            policy[name] = setting
+    return policy
+
+def monitor_plan(group, default_dt, monitor_params, run_time):
+    """
+    Work out the state monitors needed for a group under the policy in
+    monitor_params: a list of (key, variables, mode, dt), with dt None for
+    every timestep. 'ends' variables are recorded every run_time (i.e. only
+    at the start; see finish_monitors for the end).
+    """
+    policy = monitor_params.get('monitor_policy', {})
+    settings = []
+    for var in group_variables(group):
+        (mode, dt) = parse_setting(policy.get('%s.%s' % (group, var), 'all'))
+        if mode == 'off':
+            continue
+        if mode == 'ends':
+            dt = run_time
+        elif dt is None:
+            dt = default_dt
+        settings.append((var, mode, dt))
+
+    plan = []
+    for (var, mode, dt) in settings:
+        for (_, variables, plan_mode, plan_dt) in plan:
+            if plan_mode == mode and _same_dt(plan_dt, dt):
+                variables.append(var)
+                break
+        else:
+            if len(plan) == 0:
+                key = group
+            else:
+                key = '%s.%s' % (group, var)
+            plan.append((key, [var], mode, dt))
+    return plan
+
+def monitor_plans(monitor_params, run_time, vis):
+    """
+    monitor_plan for each (group_type, group) in the network, where vis says
+    whether the network has a layer1vis group.
+    """
+    if 'monitors_dt' in monitor_params:
+        default_dt = monitor_params['monitors_dt']
+    else:
+        default_dt = None
+
+    plans = {}
+    for (group_type, group, _) in STATE_VARIABLES:
+        if group == 'layer1vis':
+            if not vis:
+                continue
+            # (for the 60 fps visualisation)
+            group_dt = b2.second/60
+        else:
+            group_dt = default_dt
+        plans[(group_type, group)] = monitor_plan(group, group_dt,
+                                                  monitor_params, run_time)
+    return plans
+
+def _same_dt(dt1, dt2):
+    if dt1 is None or dt2 is None:
+        return dt1 is None and dt2 is None
+    return float(dt1) == float(dt2)
+
+def state_monitor(monitors, group_type, group, var):
+    """
+    The monitor recording the given variable of a group, or None if it isn't
+    recorded.
+    """
+    for (key, monitor) in monitors[group_type].items():
+        if key != group and not key.startswith(group + '.'):
+            continue
+        if var in monitor.record_variables:
+            return monitor
+    return None
+
+def finish_monitors(monitors, plans, end_time, group_state, firing_neurons,
+                    post_neurons):
+    """
+    Apply the 'ends' and 'firing' modes once the run is over, replacing the
+    monitors concerned by StateRecords:
+    * 'ends' monitors get a second sample at end_time, from
+      group_state(group_type, group), which should give the (unitless)
+      values of the group's variables for all elements
+    * 'firing' monitors only keep the neurons in firing_neurons, or the
+      synapses onto them (post_neurons giving the neuron each synapse of the
+      input-layer1e connections is onto)
+    plans maps (group_type, group) to the group's monitor_plan.
+    """
+    for ((group_type, group), plan) in plans.items():
+        for (key, variables, mode, _) in plan:
+            if mode not in ['ends', 'firing']:
+                continue
+            monitor = monitors[group_type][key]
+            units = record_mod.state_units(monitor)
+            record = np.asarray(monitor.record)
+            t = np.asarray(monitor.t_)
+            values = dict((var, np.asarray(getattr(monitor, var + '_')).T)
+                          for var in variables)
+
+            if mode == 'ends':
+                state = group_state(group_type, group)
+                t = np.concatenate([t, [float(end_time)]])
+                for var in variables:
+                    values[var] = np.vstack(
+                        [values[var], np.asarray(state[var])[record]])
+            else:
+                if group_type == 'connections':
+                    neurons = np.asarray(post_neurons)[record]
+                else:
+                    neurons = record
+                keep = np.isin(neurons, list(firing_neurons))
+                record = record[keep]
+                for var in variables:
+                    values[var] = values[var][:, keep]
+
+            monitors[group_type][key] = record_mod.StateRecord.from_arrays(
+                variables, units, record, t, values)
@@ -0,0 +1,342 @@
+"""
+Rendering the animations of write_movie.py: the input spikes scrolling past
+at the top, and below them the change in the input weights and the membrane
+potential of each neuron which learnt a note, at FPS frames per second.
+
+The variables are saved by stdp_sounds.save_visualisation (see
+save_vis_vars) with every array frame-major, and memory-mapped, so only the
+frames being drawn are read and memory use doesn't depend on the length of
+the run. Everything which doesn't change from frame to frame is worked out
+once: which weights are onto each neuron, the range of the potentials and
+the initial weights; the input spikes are in time order, so the spikes in a
+window can be found by binary search. Each frame is drawn by blitting only
+the artists which change onto a copy of the static background.
+
+Batches of frames can be rendered by a pool of processes; either way, the
+raw RGBA frames are piped in order into a single ffmpeg process, which can
+mux in the audio at the same time, so the movie is encoded once with nothing
+written to disk in between (see write_movie).
+"""
+
+from __future__ import print_function, division
+import pickle
+import subprocess
+import collections
+import multiprocessing
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.gridspec import GridSpec
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import modules.results_file as results_file_mod
+
+FPS = 60
+# how many rows of the grid the input spike raster takes up
+N_SPIKE_ROWS = 4
+# how many seconds of input spikes the raster shows
+RASTER_SECONDS = 1.0
+# how many frames each worker process renders at a time
+BATCH_FRAMES = 30
+
+# how many frames of state variables to read at a time when scanning them
+BLOCK_FRAMES = 1024
+
+def vis_vars_filename(run_id):
+    return 'results/vis_vars_%s%s' % (run_id, results_file_mod.FILE_EXTENSION)
+
+def save_vis_vars(filename, potential, weights, weight_targets,
+                  input_spike_times, input_spike_indices, output_spike_times,
+                  output_spike_indices):
+    """
+    Save the variables for a movie to a results file (see
+    modules/results_file.py) with every array frame-major: potential is the
+    layer1vis membrane potential shaped (n_frames, n_neurons), in volts, and
+    weights the input-layer1e weights shaped (n_frames, n_synapses), onto
+    neurons weight_targets.
+    """
+    results_file_mod.write_results(
+        filename, {}, metadata={'contents': 'vis_vars'},
+        arrays={'potential': potential,
+                'weights': weights,
+                'weight_targets': weight_targets,
+                'input_spike_times': input_spike_times,
+                'input_spike_indices': input_spike_indices,
+                'output_spike_times': output_spike_times,
+                'output_spike_indices': output_spike_indices})
+
+def load_vis_vars(filename):
+    """
+    Load the variables saved by save_vis_vars (memory-mapped), as a
+    dictionary of arrays, or from a .pickle written by older versions of
+    stdp_sounds.pickle_visualisation (which has to be loaded whole, and is
+    transposed to the same layout).
+    """
+    if not filename.endswith('.pickle'):
+        results = results_file_mod.ResultsFile(filename)
+        return dict((name, results.other_array(name))
+                    for name in results.footer['arrays'])
+
+    with open(filename, 'rb') as f:
+        (potential, weights, weight_targets, input_spike_times,
+         input_spike_indices, output_spike_times, output_spike_indices) = \
+            pickle.load(f)
+    return {'potential': np.asarray(potential).T,
+            'weights': np.asarray(weights).T,
+            'weight_targets': np.asarray(weight_targets),
+            'input_spike_times': np.asarray(input_spike_times),
+            'input_spike_indices': np.asarray(input_spike_indices),
+            'output_spike_times': np.asarray(output_spike_times),
+            'output_spike_indices': np.asarray(output_spike_indices)}
+
+def _range(frames):
+    """
+    (min, max) of an array, reading BLOCK_FRAMES frames at a time.
+    """
+    min_value = np.inf
+    max_value = -np.inf
+    for start in range(0, len(frames), BLOCK_FRAMES):
+        block = np.asarray(frames[start:start + BLOCK_FRAMES])
+        min_value = min(min_value, np.amin(block))
+        max_value = max(max_value, np.amax(block))
+    return (min_value, max_value)
+
+class MovieData(object):
+    """
+    What's drawn in the movie, read a frame at a time from the (possibly
+    memory-mapped) arrays of load_vis_vars, for the given neurons in order.
+    """
+
+    def __init__(self, vis_vars, neurons):
+        self.potential = vis_vars['potential']
+        self.weights = vis_vars['weights']
+        self.n_frames = len(self.potential)
+        self.neurons = np.asarray(neurons, dtype=int)
+        (self.min_pot, self.max_pot) = _range(self.potential)
+
+        weight_targets = np.asarray(vis_vars['weight_targets'])
+        self.weight_rows = [np.nonzero(weight_targets == neuron_n)[0]
+                            for neuron_n in self.neurons]
+        self.initial_weights = np.array(self.weights[0])
+        final_diff = np.asarray(self.weights[len(self.weights) - 1]) - \
+            self.initial_weights
+        self.diff_range = (np.amin(final_diff), np.amax(final_diff))
+
+        self.input_spike_times = vis_vars['input_spike_times']
+        self.input_spike_indices = vis_vars['input_spike_indices']
+        if np.any(np.diff(self.input_spike_times) < 0):
+            # (spikes from monitors are already in time order)
+            order = np.argsort(self.input_spike_times, kind='mergesort')
+            self.input_spike_times = np.asarray(self.input_spike_times)[order]
+            self.input_spike_indices = \
+                np.asarray(self.input_spike_indices)[order]
+        n_afferents = len(weight_targets) // self.potential.shape[1]
+        if len(self.input_spike_indices) > 0:
+            max_index = int(np.amax(self.input_spike_indices))
+        else:
+            max_index = 0
+        self.max_afferent_shown = max(n_afferents, max_index)
+
+    def potentials(self, frame_n):
+        """
+        Membrane potential of each neuron shown in the given frame, normalised
+        to between 0 and 1 over the whole movie.
+        """
+        potential = np.asarray(self.potential[frame_n])[self.neurons]
+        return (potential - self.min_pot) / (self.max_pot - self.min_pot)
+
+    def weight_diffs(self, frame_n):
+        """
+        Change in the weights onto each neuron shown, up to the given frame.
+        """
+        frame_n = min(frame_n, len(self.weights) - 1)
+        diff = np.asarray(self.weights[frame_n]) - self.initial_weights
+        return [diff[rows] for rows in self.weight_rows]
+
+    def input_spikes(self, start, end):
+        """
+        (times, indices) of the input spikes with start <= time <= end.
+        """
+        from_n = np.searchsorted(self.input_spike_times, start, 'left')
+        to_n = np.searchsorted(self.input_spike_times, end, 'right')
+        return (np.asarray(self.input_spike_times[from_n:to_n]),
+                np.asarray(self.input_spike_indices[from_n:to_n]))
+
+class FrameRenderer(object):
+    """
+    Draw frames of the movie on an Agg canvas.
+    """
+
+    def __init__(self, data, figsize=None, dpi=100):
+        self.data = data
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        n_rows = len(data.neurons) + N_SPIKE_ROWS
+        grid = GridSpec(n_rows, 5, figure=self.fig)
+
+        # input spike raster at the top
+        ax = self.fig.add_subplot(grid[0:N_SPIKE_ROWS, 0:-1])
+        (self.input_spike_raster,) = ax.plot([], [], 'k.', markersize=1,
+                                             animated=True)
+        ax.set_xlim([0, data.max_afferent_shown])
+        ax.set_ylim([0, RASTER_SECONDS])
+        ax.set_xticks([])
+        ax.set_yticks([])
+
+        (min_diff, max_diff) = data.diff_range
+        weight_diffs = data.weight_diffs(0)
+        potentials = data.potentials(0)
+        self.weight_lines = []
+        self.potential_ims = []
+        for i in range(len(data.neurons)):
+            # weights down the left
+            ax = self.fig.add_subplot(grid[i + N_SPIKE_ROWS, 0:-1])
+            (line,) = ax.plot(weight_diffs[i], 'k', animated=True)
+            self.weight_lines.append(line)
+            ax.set_xlim([0, data.max_afferent_shown])
+            ax.set_xticks([])
+            ax.set_yticks([])
+            ax.set_ylim([min_diff * 1.05, max_diff * 1.05])
+
+            # membrane potential on the right
+            ax = self.fig.add_subplot(grid[i + N_SPIKE_ROWS, -1])
+            im = ax.imshow(X=potentials[i:i + 1, np.newaxis],
+                           interpolation='none', animated=True)
+            im.set_clim([0, 1])
+            self.potential_ims.append(im)
+            ax.set_xticks([])
+            ax.set_yticks([])
+
+        self.fig.tight_layout(pad=0)
+        # (the animated artists aren't drawn into the background)
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+    def size(self):
+        """
+        (width, height) of the frames, in pixels.
+        """
+        return self.canvas.get_width_height()
+
+    def render(self, frame_n):
+        """
+        Draw a frame, returning it as RGBA bytes.
+        """
+        data = self.data
+        self.canvas.restore_region(self.background)
+
+        cur_time = frame_n / FPS
+        (times, indices) = data.input_spikes(cur_time,
+                                             cur_time + RASTER_SECONDS)
+        self.input_spike_raster.set_data(indices, times - cur_time)
+        artists = [self.input_spike_raster]
+
+        weight_diffs = data.weight_diffs(frame_n)
+        potentials = data.potentials(frame_n)
+        for i in range(len(data.neurons)):
+            self.weight_lines[i].set_ydata(weight_diffs[i])
+            self.potential_ims[i].set_data(potentials[i:i + 1, np.newaxis])
+            artists.extend([self.weight_lines[i], self.potential_ims[i]])
+
+        for artist in artists:
+            artist.axes.draw_artist(artist)
+        return bytes(self.canvas.buffer_rgba())
+
+def load_movie_data(filename, neurons):
+    """
+    MovieData for the given neurons from a file of variables saved by
+    save_vis_vars (or an old .pickle).
+    """
+    return MovieData(load_vis_vars(filename), neurons)
+
+def frame_size(figsize=None, dpi=100):
+    """
+    (width, height) in pixels of the frames drawn by a FrameRenderer.
+    """
+    return FigureCanvasAgg(Figure(figsize=figsize, dpi=dpi)).get_width_height()
+
+def ffmpeg_command(filename, size, fps=FPS, audio_filename=None):
+    """
+    ffmpeg command line encoding raw RGBA frames of the given (width, height)
+    read from stdin into filename with h264, along with the audio in
+    audio_filename (if given) until whichever ends first.
+    """
+    command = ['ffmpeg', '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgba',
+               '-s', '%dx%d' % size, '-r', str(fps), '-i', '-']
+    if audio_filename is not None:
+        command += ['-i', audio_filename, '-map', '0:v', '-map', '1:a',
+                    '-c:a', 'aac', '-shortest']
+    # (h264 needs even dimensions)
+    command += ['-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+                '-vcodec', 'h264', '-pix_fmt', 'yuv420p', filename]
+    return command
+
+# FrameRenderer of each worker process
+_worker_renderer = None
+
+def _init_worker(filename, neurons, figsize, dpi):
+    global _worker_renderer
+    _worker_renderer = FrameRenderer(load_movie_data(filename, neurons),
+                                     figsize, dpi)
+
+def _render_batch(frame_range):
+    return b''.join(_worker_renderer.render(frame_n)
+                    for frame_n in range(*frame_range))
+
+def rendered_frames(filename, neurons, n_frames, processes=1, figsize=None,
+                    dpi=100):
+    """
+    Yield the frames of the movie of the variables in filename in order, as
+    RGBA bytes of one or more frames at a time, rendered by a pool of
+    processes if processes > 1 (each loading the variables itself). At most a
+    couple of batches per process are rendered ahead of what's been used.
+    """
+    if processes <= 1:
+        renderer = FrameRenderer(load_movie_data(filename, neurons), figsize,
+                                 dpi)
+        for frame_n in range(n_frames):
+            yield renderer.render(frame_n)
+        return
+
+    batches = [(start, min(start + BATCH_FRAMES, n_frames))
+               for start in range(0, n_frames, BATCH_FRAMES)]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(filename, neurons, figsize, dpi))
+    pending = collections.deque()
+    try:
+        for batch in batches:
+            pending.append(pool.apply_async(_render_batch, (batch,)))
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while len(pending) > 0:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def write_movie(filename, neurons, n_frames, movie_filename,
+                audio_filename=None, processes=1, figsize=None, dpi=100):
+    """
+    Render the movie of the variables in filename (see rendered_frames),
+    piping the frames into a single ffmpeg process which encodes them (and
+    the audio in audio_filename, if given) straight into movie_filename.
+    """
+    size = frame_size(figsize, dpi)
+    frame_bytes = size[0] * size[1] * 4
+    command = ffmpeg_command(movie_filename, size,
+                             audio_filename=audio_filename)
+    ffmpeg = subprocess.Popen(command, stdin=subprocess.PIPE)
+    n_done = 0
+    try:
+        for frames in rendered_frames(filename, neurons, n_frames, processes,
+                                      figsize, dpi):
+            ffmpeg.stdin.write(frames)
+            n_before = n_done
+            n_done += len(frames) // frame_bytes
+            # (every 10 s of movie)
+            if n_done // (10 * FPS) > n_before // (10 * FPS):
+                print("%d s rendered" % (n_done // FPS))
+    finally:
+        ffmpeg.stdin.close()
+    if ffmpeg.wait() != 0:
+        raise Exception("ffmpeg failed writing %s" % movie_filename)
@@ -7,7 +7,15 @@ def prespecified_spike_neurons(n_neurons, spike_indices, spike_times):
         N=n_neurons, indices=spike_indices, times=spike_times)
     return neurons
 
-def excitatory_neurons(n_neurons, params):
+def excitatory_neurons(n_neurons, params, variable_params=None,
+                       frozen=False):
+    """
+    If variable_params is given, the parameters in eqs.variable_params_e are
+    declared as variables with those flags instead of being put in the
+    namespace, and it's up to the caller to set their values.
+    If frozen, theta is a constant for the caller to set (e.g. to trained
+    values), with no adaptation.
+    """
     neuron_params = {
         'v_thresh_e': params['v_thresh_e'],
         'v_reset_e': params['v_reset_e'],
@@ -23,10 +31,22 @@ def excitatory_neurons(n_neurons, params):
         'min_theta': params['min_theta'],
         'offset': params['offset']
     }
+    if frozen:
+        model = eqs.neuron_eqs_e_frozen
+        reset = eqs.reset_e_frozen
+    else:
+        model = eqs.neuron_eqs_e
+        reset = eqs.reset_e
+    if variable_params is not None:
+        model += eqs.variable_params_eqs(eqs.variable_params_e,
+                                         variable_params)
+        reset = eqs.rename_variable_params(reset, eqs.variable_params_e)
+        for name in eqs.variable_params_e:
+            del neuron_params[name]
     neurons = b2.NeuronGroup(
         N=n_neurons,
-        model=eqs.neuron_eqs_e, threshold=eqs.thresh_e,
-        refractory=params['refrac_e'], reset=eqs.reset_e,
+        model=model, threshold=eqs.thresh_e,
+        refractory=params['refrac_e'], reset=reset,
         namespace=neuron_params,
         method='euler' # automatically suggested by Brian
     )
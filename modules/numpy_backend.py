@@ -0,0 +1,526 @@
+"""
+A pure-NumPy, time-stepped implementation of the network built by
+stdp_sounds.init_neurons/init_connections, for use instead of Brian when
+compile time or Brian's per-timestep overhead dominates (e.g. small networks
+in parameter sweeps).
+
+The dynamics are those of modules/equations.py, integrated with the same
+forward Euler scheme and the same default schedule (state updates,
+thresholds, synaptic propagation, resets) that Brian uses:
+* input spikes are binned into timesteps as by a SpikeGeneratorGroup
+* layer1e: neuron_eqs_e with refractoriness, adaptive threshold and reset_e
+* layer1i: neuron_eqs_i, connected one-to-one from layer1e and all-but-self
+  back to layer1e
+* input-layer1e: eqs_stdp_ee, with the event-driven pre/post traces evaluated
+  in closed form from the time of the last pre/postsynaptic spike (and
+  recorded, like Brian's, as last updated by a spike of the synapse)
+Weights are stored as an (n_inputs, n_neurons) matrix, which when flattened
+has the same synapse ordering as Brian's all-to-all Synapses.
+
+To keep the per-timestep overhead down, the excitatory and inhibitory layers
+share one set of state arrays (excitatory neurons first), and every variable
+which just decays exponentially is updated as part of a single array.
+All updates are done in place, so the per-group arrays are views which stay
+valid for the lifetime of the network.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import time
+import pickle
+import numpy as np
+import brian2 as b2
+
+import modules.records as record_mod
+import modules.monitoring as monitoring_mod
+
+# Brian shifts spike times by this fraction of dt before binning them,
+# so that spikes at exact multiples of dt don't land in the preceding bin
+TIMESTEP_SHIFT = 1e-3
+# lastspike value for neurons which haven't spiked yet
+NEVER = -10**9
+
+def timestep(t, dt):
+    """
+    Convert time(s) in seconds to integer timesteps, as Brian does.
+    """
+    return np.asarray((np.asarray(t) + TIMESTEP_SHIFT * dt) / dt,
+                      dtype=np.int64)
+
+class NeuronState(object):
+    """
+    State variables (unitless, in SI units) of a group of neurons, given as
+    a dictionary mapping variable names to arrays.
+    """
+
+    def __init__(self, variables):
+        self.variables = variables
+        for (var, values) in variables.items():
+            setattr(self, var, values)
+        self.n_neurons = len(variables['v'])
+
+    def __len__(self):
+        return self.n_neurons
+
+class SynapseState(object):
+    """
+    Weights and traces of the plastic input-layer1e connections, presented
+    with the 'i', 'j' and 'w' attributes of a Brian Synapses.
+    """
+
+    def __init__(self, n_inputs, n_neurons, weights):
+        self.n_inputs = n_inputs
+        self.n_neurons = n_neurons
+        self.weights = np.array(weights, dtype=float).reshape(
+            (n_inputs, n_neurons))
+        # step of the last spike of each input/output neuron,
+        # from which the pre/post traces are computed
+        self.pre_lastspike = np.ones(n_inputs, dtype=np.int64) * NEVER
+        self.post_lastspike = np.ones(n_neurons, dtype=np.int64) * NEVER
+        self.i = np.repeat(np.arange(n_inputs), n_neurons)
+        self.j = np.tile(np.arange(n_neurons), n_inputs)
+
+    @property
+    def w(self):
+        return self.weights.ravel()
+
+    def __len__(self):
+        return self.n_inputs * self.n_neurons
+
+class Network(object):
+    """
+    The full network, with the run()/t interface of a Brian Network.
+
+    The neurons, connections and monitors attributes are dictionaries keyed
+    in the same way as those built in stdp_sounds.py.
+    """
+
+    def __init__(self, input_spikes, n_inputs, layer_n_neurons,
+                 neuron_params, connection_params, monitor_params,
+                 initial_weights, run_time=None, dt=0.1*b2.ms):
+        self.dt = float(dt)
+        self.t_step = 0
+        self.n_inputs = n_inputs
+        self.n_neurons = layer_n_neurons
+        self.plastic = True
+        self._set_params(neuron_params, connection_params)
+        self._init_state(neuron_params['vis'])
+        self.synapses = SynapseState(n_inputs, layer_n_neurons,
+                                     initial_weights)
+
+        self.set_spikes(input_spikes['indices'], input_spikes['times'])
+
+        self.neurons = {
+            'layer1e': self.layer1e,
+            'layer1i': self.layer1i
+        }
+        if self.layer1vis is not None:
+            self.neurons['layer1vis'] = self.layer1vis
+        self.connections = {'input-layer1e': self.synapses}
+        self._init_monitors(monitor_params, run_time)
+
+    def _set_params(self, neuron_params, connection_params):
+        names = ['v_rest_e', 'v_rest_i', 'v_reset_e', 'v_reset_i',
+                 'v_thresh_e', 'v_thresh_i', 'tc_v_ex', 'tc_v_in', 'tc_ge',
+                 'tc_gi', 'e_ex_ex', 'e_in_ex', 'e_ex_in', 'e_in_in',
+                 'tc_theta', 'offset', 'theta_coef', 'max_theta']
+        self.p = dict((name, float(neuron_params[name])) for name in names)
+        names = ['tc_pre_ee', 'tc_post_ee', 'nu_ee_pre', 'nu_ee_post',
+                 'wmax_ee', 'pre_w_decrease', 'ex-in-w', 'in-ex-w']
+        for name in names:
+            self.p[name] = float(connection_params[name])
+        self.p['tc_v_vis'] = float(100 * b2.ms)
+        self.p['refrac_e'] = int(timestep(float(neuron_params['refrac_e']),
+                                          self.dt))
+        self.p['refrac_i'] = int(timestep(float(neuron_params['refrac_i']),
+                                          self.dt))
+
+    def _init_state(self, vis):
+        p = self.p
+        n = self.n_neurons
+
+        def per_layer(value_e, value_i):
+            return np.concatenate([np.ones(n) * value_e, np.ones(n) * value_i])
+
+        # per-neuron constants for the combined excitatory/inhibitory layers
+        self._v_rest = per_layer(p['v_rest_e'], p['v_rest_i'])
+        self._e_ex = per_layer(p['e_ex_ex'], p['e_ex_in'])
+        self._e_in = per_layer(p['e_in_ex'], p['e_in_in'])
+        self._tc_v = per_layer(p['tc_v_ex'], p['tc_v_in'])
+        self._refrac = per_layer(p['refrac_e'], p['refrac_i']).astype(np.int64)
+        # only excitatory neurons hold v during the refractory period
+        self._integrate_when_refractory = per_layer(False, True).astype(bool)
+        self._thresh = per_layer(0, p['v_thresh_i'])
+
+        self._v = per_layer(p['v_rest_e'], p['v_rest_i'])
+        self._lastspike = np.ones(2 * n, dtype=np.int64) * NEVER
+        # first step at which each neuron is no longer refractory
+        self._ready = self._lastspike + self._refrac
+        # ge and gi of both layers and theta, all decaying exponentially
+        self._decaying = np.zeros(5 * n)
+        self._tc_decaying = np.concatenate([
+            np.ones(2 * n) * p['tc_ge'],
+            np.ones(2 * n) * p['tc_gi'],
+            np.ones(n) * p['tc_theta']
+        ])
+        self._ge = self._decaying[0:2*n]
+        self._gi = self._decaying[2*n:4*n]
+        self._theta = self._decaying[4*n:5*n]
+        self._theta[:] = p['offset']
+
+        self.layer1e = NeuronState({
+            'v': self._v[:n],
+            'ge': self._ge[:n],
+            'gi': self._gi[:n],
+            'theta': self._theta,
+            'max_ge': np.zeros(n),
+            'lastspike': self._lastspike[:n]
+        })
+        self.layer1i = NeuronState({
+            'v': self._v[n:],
+            'ge': self._ge[n:],
+            'gi': self._gi[n:],
+            'lastspike': self._lastspike[n:]
+        })
+        if vis:
+            self.layer1vis = NeuronState({'v': np.ones(n) * p['v_rest_e']})
+        else:
+            self.layer1vis = None
+
+    def _init_monitors(self, monitor_params, run_time):
+        self.monitors = {
+            'spikes': {
+                'input': record_mod.SpikeRecord(self.n_inputs),
+                'layer1e': record_mod.SpikeRecord(self.n_neurons)
+            },
+            'neurons': {},
+            'connections': {}
+        }
+        # (monitor, group state getter, dt in seconds or None)
+        self._state_monitors = []
+
+        self.plans = monitoring_mod.monitor_plans(
+            monitor_params, run_time, self.layer1vis is not None)
+        units = {'v': b2.volt, 'ge': b2.siemens, 'max_ge': b2.siemens,
+                 'theta': b2.volt, 'w': 1, 'post': 1, 'pre': 1}
+        for ((group_type, group), plan) in self.plans.items():
+            if group_type == 'neurons':
+                n_elements = self.n_neurons
+            else:
+                n_elements = len(self.synapses)
+            for (key, variables, _, dt) in plan:
+                monitor = record_mod.StateRecord(
+                    variables, dict((var, units[var]) for var in variables),
+                    record=np.arange(n_elements))
+                self.monitors[group_type][key] = monitor
+                if dt is not None:
+                    dt = float(dt)
+                getter = (lambda group_type=group_type, group=group,
+                          variables=variables:
+                          self.group_state(group_type, group, variables))
+                self._state_monitors.append((monitor, getter, dt))
+
+    def group_state(self, group_type, group, variables=None):
+        """
+        Current (unitless) values of the state variables of a group, as
+        {variable: array of values for all elements}.
+        """
+        if group == 'input-layer1e':
+            return self._synapse_state(variables)
+        return self.neurons[group].variables
+
+    def _synapse_state(self, variables=None):
+        syn = self.synapses
+        if variables is None:
+            variables = ['w', 'post', 'pre']
+        state = {}
+        if 'w' in variables:
+            state['w'] = syn.w
+        # (the traces are only worked out if they're needed)
+        if 'pre' in variables:
+            state['pre'] = self._stored_trace(
+                syn.pre_lastspike[:, np.newaxis], self.p['tc_pre_ee'])
+        if 'post' in variables:
+            state['post'] = self._stored_trace(
+                syn.post_lastspike[np.newaxis, :], self.p['tc_post_ee'])
+        return state
+
+    def _stored_trace(self, lastspike, tc):
+        """
+        Values of an event-driven trace of each synapse as Brian stores them:
+        only brought up to date by a pre or postsynaptic spike, so decayed to
+        the time of the synapse's last spike of either kind rather than to the
+        current timestep. lastspike is the trace's pre_lastspike or
+        post_lastspike, shaped to broadcast over the (n_inputs, n_neurons)
+        synapses; returns the values in Brian's synapse order.
+        """
+        syn = self.synapses
+        last_event = np.maximum(syn.pre_lastspike[:, np.newaxis],
+                                syn.post_lastspike[np.newaxis, :])
+        trace = np.exp(-(last_event - lastspike) * self.dt / tc)
+        trace[np.broadcast_to(lastspike == NEVER, trace.shape)] = 0
+        return trace.ravel()
+
+    def _trace(self, lastspike, tc):
+        """
+        Value at the current timestep of traces set to 1 at the given steps
+        and decaying exponentially with time constant tc.
+        """
+        elapsed = (self.t_step - lastspike) * self.dt
+        trace = np.exp(-elapsed / tc)
+        trace[lastspike == NEVER] = 0
+        return trace
+
+    @property
+    def t_(self):
+        return self.t_step * self.dt
+
+    @property
+    def t(self):
+        return self.t_ * b2.second
+
+    def set_spikes(self, indices, times):
+        """
+        Set the input spikes, as SpikeGeneratorGroup.set_spikes does.
+        Spikes at times already simulated are ignored.
+        """
+        times = np.asarray(times / b2.second)
+        indices = np.asarray(indices)
+        # sorted first by time, then by index, as by a SpikeGeneratorGroup
+        order = np.lexsort((indices, times))
+        self.input_bins = timestep(times[order], self.dt)
+        self.input_indices = indices[order]
+
+    def freeze(self, theta):
+        """
+        Turn learning off: fix the input-layer1e weights and the adaptive
+        thresholds, setting the thresholds to theta (in volts).
+        """
+        self.plastic = False
+        self._theta[:] = theta
+        self._tc_decaying[4*self.n_neurons:] = np.inf
+
+    def _full_state(self):
+        state = {
+            't_step': self.t_step,
+            'plastic': self.plastic,
+            'v': self._v,
+            'lastspike': self._lastspike,
+            'ready': self._ready,
+            'decaying': self._decaying,
+            'max_ge': self.layer1e.max_ge,
+            'weights': self.synapses.weights,
+            'pre_lastspike': self.synapses.pre_lastspike,
+            'post_lastspike': self.synapses.post_lastspike,
+            'input_bins': self.input_bins,
+            'input_indices': self.input_indices,
+            'monitors': {}
+        }
+        if self.layer1vis is not None:
+            state['vis_v'] = self.layer1vis.v
+        for group_type in self.monitors:
+            for (key, monitor) in self.monitors[group_type].items():
+                state['monitors'][(group_type, key)] = \
+                    record_mod.monitor_arrays(group_type, monitor)
+        return state
+
+    def store(self, name='default', filename=None):
+        """
+        Store the state of the network (including what the monitors have
+        recorded) in filename, as Brian's Network.store does. (Only storing
+        to a file is supported.)
+        """
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                stored = pickle.load(f)
+        else:
+            stored = {}
+        stored[name] = self._full_state()
+        with open(filename, 'wb') as f:
+            pickle.dump(stored, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, name='default', filename=None):
+        """
+        Restore the state stored by store(name, filename).
+        """
+        with open(filename, 'rb') as f:
+            state = pickle.load(f)[name]
+        self.t_step = state['t_step']
+        self.plastic = state['plastic']
+        # (in place, since the per-group state arrays are views of these)
+        for (array, saved) in [
+                (self._v, state['v']),
+                (self._lastspike, state['lastspike']),
+                (self._ready, state['ready']),
+                (self._decaying, state['decaying']),
+                (self.layer1e.max_ge, state['max_ge']),
+                (self.synapses.weights, state['weights']),
+                (self.synapses.pre_lastspike, state['pre_lastspike']),
+                (self.synapses.post_lastspike, state['post_lastspike'])]:
+            array[...] = saved
+        if self.layer1vis is not None:
+            self.layer1vis.v[...] = state['vis_v']
+        self.input_bins = state['input_bins']
+        self.input_indices = state['input_indices']
+        for ((group_type, key), arrays) in state['monitors'].items():
+            monitor = self.monitors[group_type][key]
+            monitor.resize(0)
+            if group_type == 'spikes':
+                monitor.append(arrays['t'], arrays['i'])
+            else:
+                # (state monitors record every element until the run is over)
+                monitor.extend(arrays['t'], arrays)
+
+    def _record_steps(self, monitor_dt, start_step, end_step):
+        """
+        Timesteps in [start_step, end_step) at which a monitor with the given
+        dt records (at the start of the step, as Brian's monitors do), along
+        with the corresponding recording times.
+        """
+        if monitor_dt is None:
+            steps = np.arange(start_step, end_step)
+            return steps, steps * self.dt
+        first = int(np.ceil(start_step * self.dt / monitor_dt - 1e-4))
+        last = int(np.ceil(end_step * self.dt / monitor_dt - 1e-4))
+        record_times = np.arange(first, last) * monitor_dt
+        steps = np.ceil(record_times / self.dt - 1e-4).astype(np.int64)
+        return steps, record_times
+
+    def run(self, duration, report=None, report_period=10*b2.second):
+        """
+        Advance the network by the given duration.
+        """
+        start_step = self.t_step
+        end_step = start_step + int(timestep(float(duration), self.dt))
+
+        # recording steps of each state monitor, as {step: [(monitor,
+        # getter, time), ...]}
+        recordings = {}
+        for (monitor, getter, monitor_dt) in self._state_monitors:
+            steps, record_times = self._record_steps(monitor_dt, start_step,
+                                                     end_step)
+            for (step, record_time) in zip(steps, record_times):
+                recordings.setdefault(step, []).append(
+                    (monitor, getter, record_time))
+
+        # input spikes emitted at each step are
+        # input_indices[input_bounds[k]:input_bounds[k+1]]
+        input_bounds = np.searchsorted(
+            self.input_bins, np.arange(start_step - 1, end_step),
+            side='right').tolist()
+
+        start_time = time.time()
+        next_report = start_time + float(report_period)
+        for step in range(start_step, end_step):
+            self.t_step = step
+            if step in recordings:
+                for (monitor, getter, record_time) in recordings[step]:
+                    monitor.append(record_time, getter())
+            k = step - start_step
+            self._step(step, input_bounds[k], input_bounds[k+1])
+            if report is not None and time.time() > next_report:
+                self._report(start_step, step, end_step, start_time)
+                next_report += float(report_period)
+        self.t_step = end_step
+
+        input_slice = slice(input_bounds[0], input_bounds[-1])
+        self.monitors['spikes']['input'].append(
+            self.input_bins[input_slice] * self.dt,
+            self.input_indices[input_slice])
+
+        if report is not None:
+            self._report(start_step, end_step, end_step, start_time)
+
+    def _report(self, start_step, step, end_step, start_time):
+        elapsed = time.time() - start_time
+        fraction = (step - start_step) / max(end_step - start_step, 1)
+        print("%s simulated (%d%%) in %.1f s" %
+              (step * self.dt * b2.second, fraction * 100, elapsed))
+        sys.stdout.flush()
+
+    def _step(self, step, input_from, input_to):
+        p = self.p
+        dt = self.dt
+        n = self.n_neurons
+        v = self._v
+        syn = self.synapses
+
+        # state updates (forward Euler, as chosen by Brian for these equations)
+        not_refractory = self._ready <= step
+        integrate = not_refractory | self._integrate_when_refractory
+        dv = self._v_rest - v
+        current_e = self._e_ex - v
+        current_e *= self._ge
+        current_i = self._e_in - v
+        current_i *= self._gi
+        current_e += current_i
+        dv += current_e
+        dv /= self._tc_v
+        dv *= dt
+        dv *= integrate
+        v += dv
+        decay = -self._decaying
+        decay /= self._tc_decaying
+        decay *= dt
+        self._decaying += decay
+
+        vis = self.layer1vis
+        if vis is not None:
+            vis.v += dt * ((p['v_rest_e'] - vis.v) / p['tc_v_vis'])
+
+        # thresholds
+        thresh = self._thresh
+        thresh[:n] = self._theta - p['offset'] + p['v_thresh_e']
+        spikes = ((v > thresh) & not_refractory).nonzero()[0]
+        if len(spikes) > 0:
+            self._lastspike[spikes] = step
+            self._ready[spikes] = step + self._refrac[spikes]
+            n_e_spikes = np.searchsorted(spikes, n)
+            e_spikes = spikes[:n_e_spikes]
+            i_spikes = spikes[n_e_spikes:] - n
+            self.monitors['spikes']['layer1e'].append(step * dt, e_spikes)
+        else:
+            e_spikes = i_spikes = spikes
+
+        # synaptic propagation: presynaptic pathways, then postsynaptic
+        if input_to > input_from:
+            input_spikes = self.input_indices[input_from:input_to]
+            weights = syn.weights[input_spikes]
+            # accumulate one presynaptic spike at a time, in order,
+            # so that rounding matches Brian's
+            self._ge[:n] = np.concatenate(
+                [self._ge[np.newaxis, :n], weights]).sum(axis=0)
+            if self.plastic:
+                post = self._trace(syn.post_lastspike, p['tc_post_ee'])
+                syn.weights[input_spikes] = np.clip(
+                    weights - p['nu_ee_pre'] * post - p['pre_w_decrease'],
+                    0, p['wmax_ee'])
+            syn.pre_lastspike[input_spikes] = step
+        if len(spikes) == 0:
+            return
+        if len(e_spikes) > 0:
+            self._ge[n + e_spikes] += p['ex-in-w']
+            if vis is not None:
+                vis.v[e_spikes] += float(1 * b2.mV)
+            syn.post_lastspike[e_spikes] = step
+            if self.plastic:
+                pre = self._trace(syn.pre_lastspike, p['tc_pre_ee'])
+                syn.weights[:, e_spikes] = np.clip(
+                    syn.weights[:, e_spikes]
+                    + p['nu_ee_post'] * pre[:, np.newaxis],
+                    0, p['wmax_ee'])
+        if len(i_spikes) > 0:
+            inhibition = np.ones(n) * len(i_spikes)
+            inhibition[i_spikes] -= 1
+            self._gi[:n] += p['in-ex-w'] * inhibition
+
+        # resets
+        if len(e_spikes) > 0:
+            v[e_spikes] = p['v_reset_e']
+            if self.plastic:
+                theta = self._theta
+                theta[e_spikes] = theta[e_spikes] + \
+                    p['theta_coef'] * (p['max_theta'] - theta[e_spikes])
+        if len(i_spikes) > 0:
+            v[n + i_spikes] = p['v_reset_i']
@@ -5,9 +5,12 @@ import argparse
 import brian2 as b2
 from IPython.core.debugger import Tracer
 
-def get_params():
+import modules.monitoring as monitoring_mod
+
+def get_params(argv=None):
     """
-    Collect parameters for the simulation.
+    Collect parameters for the simulation from the command line
+    (or from the list of arguments argv, if given).
     """
 
     parser = argparse.ArgumentParser()
@@ -22,27 +25,92 @@ def get_params():
     group.add_argument('--test_neurons', action='store_true')
     group.add_argument('--test_stdp_curve', action='store_true')
     group.add_argument('--test_competition', action='store_true')
+    # check the NumPy backend against Brian (with --input_spikes_file)
+    parser.add_argument('--test_numpy_backend', action='store_true')
+    # check that the selectivity tracker and convergence monitor count the
+    # same spikes with and without --record_to_disk (with
+    # --input_spikes_file)
+    parser.add_argument('--test_segment_listeners', action='store_true')
 
     parser.add_argument('--theta_coef', type=float, default=0.02)
     parser.add_argument('--nu_ee_post', type=float, default=0.02)
     parser.add_argument('--max_theta', type=float, default=60)
     parser.add_argument('--run_time')
+    # only load this many seconds of input spikes at a time,
+    # running the simulation one window after another
+    parser.add_argument('--input_window', type=float)
     # set monitors time step for 60 fps by default,
     # for generation of 60 fps visualisation
     parser.add_argument('--monitors_dt', type=float, default=1000/60.0)
     parser.add_argument('--monitor_all_time', action='store_true')
+    # how to record each state variable, as <group>.<variable>=MODE[@DT]
+    # (e.g. --monitor input-layer1e.w=all@1000 --monitor input-layer1e.pre=off
+    # --monitor layer1e.v=firing), with MODE one of all, firing, ends or off
+    # and DT in ms (see modules/monitoring.py); firing still records every
+    # element during the run, so it only shrinks the saved results, not the
+    # memory used while running
+    parser.add_argument('--monitor', action='append', default=[],
+                        metavar='VAR=MODE[@DT]')
+    # write what the monitors record to disk every record_chunk seconds
+    # during the run instead of keeping it all in memory (see
+    # modules/recorder.py; not in standalone mode)
+    parser.add_argument('--record_to_disk', action='store_true')
+    parser.add_argument('--record_chunk', type=float, default=10.0)
+    # report how selective the output neurons are to the notes (given by
+    # --note_separation and --n_notes) every this many seconds during the
+    # run, and stop the run if the accuracy is still below --abort_below
+    # after --abort_after seconds (not in standalone mode)
+    parser.add_argument('--track_selectivity', type=float)
+    parser.add_argument('--abort_after', type=float, default=0)
+    parser.add_argument('--abort_below', type=float)
+    # every this many seconds during the run, check whether the
+    # input-layer1e weights (mean change as a fraction of the maximum
+    # weight) and which neurons win during which notes (see
+    # modules/convergence.py) have stopped changing, and stop the run once
+    # both have changed by less than the thresholds for
+    # --convergence_patience checks in a row (not in standalone mode)
+    parser.add_argument('--stop_on_convergence', type=float)
+    parser.add_argument('--max_weight_change', type=float, default=0.001)
+    parser.add_argument('--max_winner_change', type=float, default=0.1)
+    parser.add_argument('--convergence_patience', type=int, default=3)
+    # save the full state of the simulation to results/checkpoint_<run
+    # id>.pickle every this many seconds of simulation time, and/or continue
+    # the run from there (with the same arguments) instead of starting again
+    # (see modules/checkpoint.py; not in standalone mode)
+    parser.add_argument('--checkpoint', type=float)
+    parser.add_argument('--resume', action='store_true')
     parser.add_argument('--layer_n_neurons', type=int, default=16)
     parser.add_argument('--save_results', action='store_true')
+    # save the trained weights and thresholds for infer.py
+    parser.add_argument('--save_model', action='store_true')
     parser.add_argument('--save_figs', action='store_true')
     parser.add_argument('--note_separation', type=float)
     parser.add_argument('--n_notes', type=int)
     parser.add_argument('--no_standalone', action='store_true')
+    parser.add_argument('--backend', choices=['brian', 'numpy'],
+                        default='brian')
+    # reuse compiled standalone projects for runs differing only in
+    # the tunable parameters (see stdp_sounds.TUNABLE_PARAMS)
+    parser.add_argument('--build_cache', action='store_true')
+    parser.add_argument('--build_cache_dir')
+    parser.add_argument('--build_cache_size', type=int, default=8)
+    # also record the time spent in each of Brian's code objects for the
+    # profile of the run written to results/profile_<run id>.txt (the time
+    # and memory use of each phase of the run are always recorded); this
+    # slows the run down a little and changes the generated code
+    parser.add_argument('--profile', action='store_true')
     parser.add_argument('--vis', action='store_true')
     parser.add_argument('--pre_w_decrease', type=float, default=0.00025)
     parser.add_argument('--ex_in_w', type=float, default=10.4)
     parser.add_argument('--in_ex_w', type=float, default=17.0)
     parser.add_argument('--spikes_only', action='store_true')
-    args = parser.parse_args()
+    # don't plot anything after the run (figures can be made later from the
+    # results saved with --save_results by report.py)
+    parser.add_argument('--no_plots', action='store_true')
+    # seed for NumPy's random number generator
+    # (used for the initial weights, if they haven't been cached yet)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
 
     if args.parameters_file is not None:
         (neuron_params, connection_params, monitor_params, run_params,
@@ -158,12 +226,36 @@ def run_params_from_args(args):
     run_params['layer_n_neurons'] = args.layer_n_neurons
     run_params['input_spikes_filename'] = args.input_spikes_file
     run_params['no_standalone'] = args.no_standalone
+    run_params['seed'] = args.seed
+    run_params['backend'] = args.backend
+    run_params['build_cache'] = args.build_cache
+    run_params['build_cache_dir'] = args.build_cache_dir
+    run_params['build_cache_size'] = args.build_cache_size
+    run_params['profile'] = args.profile
     if args.run_time is not None:
         run_params['run_time'] = float(args.run_time) * b2.second
+    if args.input_window is not None:
+        run_params['input_window'] = args.input_window * b2.second
+    if args.track_selectivity is not None:
+        run_params['track_selectivity'] = args.track_selectivity * b2.second
+    run_params['abort_after'] = args.abort_after * b2.second
+    run_params['abort_below'] = args.abort_below
+    if args.stop_on_convergence is not None:
+        run_params['stop_on_convergence'] = \
+            args.stop_on_convergence * b2.second
+    run_params['max_weight_change'] = args.max_weight_change
+    run_params['max_winner_change'] = args.max_winner_change
+    run_params['convergence_patience'] = args.convergence_patience
+    if args.checkpoint is not None:
+        run_params['checkpoint'] = args.checkpoint * b2.second
+    run_params['resume'] = args.resume
     run_params['save_results'] = args.save_results
+    run_params['save_model'] = args.save_model
     run_params['test_neurons'] = args.test_neurons
     run_params['test_stdp_curve'] = args.test_stdp_curve
     run_params['test_competition'] = args.test_competition
+    run_params['test_numpy_backend'] = args.test_numpy_backend
+    run_params['test_segment_listeners'] = args.test_segment_listeners
 
     return run_params
 
@@ -173,6 +265,10 @@ def monitor_params_from_args(args):
     if not args.monitor_all_time:
         monitor_params['monitors_dt'] = \
             args.monitors_dt * b2.ms
+    monitor_params['monitor_policy'] = \
+        monitoring_mod.parse_policy(args.monitor)
+    monitor_params['record_to_disk'] = args.record_to_disk
+    monitor_params['record_chunk'] = args.record_chunk * b2.second
 
     return monitor_params
 
@@ -181,6 +277,7 @@ def analysis_params_from_args(args):
 
     analysis_params['save_figs'] = args.save_figs
     analysis_params['spikes_only'] = args.spikes_only
+    analysis_params['no_plots'] = args.no_plots
     if args.note_separation is not None:
         analysis_params['note_separation'] = args.note_separation * b2.second
     else:
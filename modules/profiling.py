@@ -0,0 +1,286 @@
+"""
+Profile of a simulation run: the wall time and memory use of each phase of
+the run (loading the input, constructing the network, generating code,
+compiling, running, analysing and saving), and, with --profile, from Brian's
+profiling (net.run(..., profile=True)), the time spent in each code object,
+e.g. the state updates of each group, the STDP updates of each pathway or the
+monitors.
+
+For each phase, peak_rss_mb is the peak resident set size of the process
+during the phase where it can be measured on its own (on Linux, by resetting
+the peak at the start of the phase), and otherwise the peak so far in the
+run; children_peak_rss_mb is the peak of any child process so far (e.g. the
+compiler or a standalone binary).
+
+In runtime mode, the time of each Brian run is also split into preparing the
+run (generating code and compiling it, or loading it from Brian's cache) and
+the simulation loop, as 'run.prepare' and 'run.loop'.
+"""
+
+from __future__ import print_function, division
+import os
+import sys
+import json
+import time
+import brian2 as b2
+from brian2.devices.device import RuntimeDevice
+try:
+    import resource
+except ImportError:
+    # (not on Windows)
+    resource = None
+
+def _proc_status(field):
+    # (e.g. VmRSS or VmHWM from /proc/self/status, in MB; None if unknown)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 2**10
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+def _reset_peak_rss():
+    # (Linux only; see clear_refs in proc(5))
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except (IOError, OSError):
+        return False
+
+def _maxrss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # (in bytes on OS X, in kB elsewhere)
+    if sys.platform == 'darwin':
+        return peak / 2**20
+    return peak / 2**10
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process so far, in MB (or None if
+    unknown).
+    """
+    if resource is None:
+        return None
+    return _maxrss_mb(resource.RUSAGE_SELF)
+
+def children_peak_rss_mb():
+    if resource is None:
+        return None
+    return _maxrss_mb(resource.RUSAGE_CHILDREN)
+
+def object_labels(neurons, connections, monitors):
+    """
+    Map the names of the Brian objects of a network (as returned by
+    stdp_sounds.init_neurons, init_connections and init_monitors) to names
+    like 'neurons.layer1e', 'connections.input-layer1e',
+    'monitors.spikes.layer1e' or 'monitors.connections.input-layer1e'.
+    """
+    labels = {}
+    for (name, group) in neurons.items():
+        labels[group.name] = 'neurons.' + name
+    for (name, connection) in connections.items():
+        labels[connection.name] = 'connections.' + name
+    for group_type in monitors:
+        for (name, monitor) in monitors[group_type].items():
+            if hasattr(monitor, 'name'):
+                labels[monitor.name] = 'monitors.%s.%s' % (group_type, name)
+    return labels
+
+def _label(code_object, labels):
+    # (code objects are named after the object they belong to, e.g.
+    # synapses_1_pre or neurongroup_stateupdater_codeobject)
+    best = None
+    for name in labels:
+        if code_object == name or code_object.startswith(name + '_'):
+            if best is None or len(name) > len(best):
+                best = name
+    if best is None:
+        return None
+    return labels[best]
+
+class _Phase(object):
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        # (so that phases are listed in the order they started)
+        self.profile.add_phase(self.name, 0.0)
+        self.own_peak = _reset_peak_rss()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+        if self.own_peak:
+            peak = _proc_status('VmHWM')
+        else:
+            peak = peak_rss_mb()
+        self.profile.add_phase(self.name, seconds, peak)
+        return False
+
+class RunProfile(object):
+    """
+    Collect the profile of a run. With code_objects, Brian runs made with
+    run_network record how long each code object took.
+    """
+
+    def __init__(self, code_objects=False):
+        self.code_objects = code_objects
+        self.phases = []
+        self.code_object_seconds = {}
+        self.labels = {}
+
+    def phase(self, name):
+        """
+        Time a phase of the run, e.g.:
+
+        with profile.phase('init_neurons'):
+            ...
+        """
+        return _Phase(self, name)
+
+    def add_phase(self, name, seconds, peak_rss=None):
+        """
+        Add the time of a phase to the profile (or to the time already
+        recorded for it, for phases which happen several times).
+        """
+        for phase in self.phases:
+            if phase['name'] == name:
+                phase['seconds'] += seconds
+                break
+        else:
+            phase = {'name': name, 'seconds': seconds}
+            self.phases.append(phase)
+        if peak_rss is not None:
+            phase['peak_rss_mb'] = max(phase.get('peak_rss_mb', 0), peak_rss)
+        phase['rss_mb'] = _proc_status('VmRSS')
+        phase['children_peak_rss_mb'] = children_peak_rss_mb()
+
+    def name_objects(self, neurons, connections, monitors):
+        """
+        Label code objects with the names of the groups they belong to (see
+        object_labels).
+        """
+        self.labels.update(object_labels(neurons, connections, monitors))
+
+    def run_network(self, net, duration, report='text'):
+        """
+        Run a network (Brian or NumPy backend) for duration, recording
+        Brian's profiling of it.
+        """
+        if not isinstance(net, b2.Network):
+            net.run(duration, report=report)
+            return
+        start = time.time()
+        net.run(duration, report=report, profile=self.code_objects)
+        device = b2.get_device()
+        if not isinstance(device, RuntimeDevice):
+            # (in standalone mode, this only records the run; the profiling
+            # information is read with add_code_objects after running it)
+            return
+        seconds = time.time() - start
+        loop_seconds = device._last_run_time
+        self.add_phase('run.prepare', seconds - loop_seconds)
+        self.add_phase('run.loop', loop_seconds)
+        if self.code_objects:
+            self.add_code_objects(net)
+
+    def add_code_objects(self, net):
+        """
+        Add the profiling information of a Brian run to the time of each
+        code object.
+        """
+        if not self.code_objects:
+            return
+        for (name, seconds) in net.profiling_info:
+            self.code_object_seconds[name] = \
+                self.code_object_seconds.get(name, 0.0) + float(seconds)
+
+    def code_object_table(self):
+        """
+        [(code object, group, seconds, fraction of the time in all code
+        objects)], slowest first.
+        """
+        total = sum(self.code_object_seconds.values())
+        return [(name, _label(name, self.labels), seconds,
+                 seconds / total if total > 0 else 0.0)
+                for (name, seconds) in sorted(
+                    self.code_object_seconds.items(),
+                    key=lambda item: item[1], reverse=True)]
+
+    def group_table(self):
+        """
+        [(group, seconds, fraction)] of the time in code objects, by group.
+        """
+        seconds = {}
+        total = 0.0
+        for (_, group, object_seconds, _) in self.code_object_table():
+            seconds[group] = seconds.get(group, 0.0) + object_seconds
+            total += object_seconds
+        return [(group, group_seconds,
+                 group_seconds / total if total > 0 else 0.0)
+                for (group, group_seconds) in sorted(
+                    seconds.items(), key=lambda item: item[1], reverse=True)]
+
+    def as_dict(self):
+        return {'phases': self.phases,
+                'code_objects': [
+                    {'name': name, 'group': group, 'seconds': seconds,
+                     'fraction': fraction}
+                    for (name, group, seconds, fraction) in
+                    self.code_object_table()]}
+
+    def format(self):
+        """
+        The profile as text tables.
+        """
+        lines = ['%-28s %10s %14s %14s %14s' %
+                 ('Phase', 'Time (s)', 'Peak RSS (MB)', 'RSS (MB)',
+                  'Child peak (MB)')]
+        for phase in self.phases:
+            lines.append('%-28s %10.3f %14s %14s %14s' % (
+                phase['name'], phase['seconds'],
+                _mb(phase.get('peak_rss_mb')), _mb(phase.get('rss_mb')),
+                _mb(phase.get('children_peak_rss_mb'))))
+        if self.code_object_seconds:
+            lines.append('')
+            lines.append('%-44s %-36s %10s %7s' %
+                         ('Code object', 'Group', 'Time (s)', '%'))
+            for (name, group, seconds, fraction) in self.code_object_table():
+                lines.append('%-44s %-36s %10.3f %7.2f' %
+                             (name, group or '-', seconds, fraction * 100))
+            lines.append('')
+            lines.append('%-44s %10s %7s' % ('Group', 'Time (s)', '%'))
+            for (group, seconds, fraction) in self.group_table():
+                lines.append('%-44s %10.3f %7.2f' %
+                             (group or '-', seconds, fraction * 100))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, filename_base, info=None):
+        """
+        Save the profile to <filename_base>.json, along with any other
+        information given (a JSON-serialisable dict), and as tables to
+        <filename_base>.txt.
+        """
+        directory = os.path.dirname(filename_base)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        profile = dict(info or {})
+        profile.update(self.as_dict())
+        with open(filename_base + '.json', 'w') as f:
+            json.dump(profile, f, indent=1, sort_keys=True)
+        with open(filename_base + '.txt', 'w') as f:
+            f.write(self.format())
+
+def _mb(value):
+    if value is None:
+        return '-'
+    return '%.1f' % value
+
+def profile_filename_base(run_id):
+    return 'results/profile_%s' % run_id
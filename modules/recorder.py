@@ -0,0 +1,177 @@
+"""
+Recording monitors to disk during a run, rather than holding everything they
+record in memory until the end.
+
+The run is split into chunks (see stdp_sounds.run_windows); after each chunk,
+DiskRecorder.flush appends what each monitor recorded to .npy segment files
+and empties the monitor, so memory use is bounded by what's recorded in one
+chunk. When the run is over, close() joins the segments of each array into
+a single time-major .npy file:
+* <group_type>.<group>.t.npy and <group_type>.<group>.i.npy for spikes
+* <group_type>.<group>.t.npy and <group_type>.<group>.<var>.npy, shaped
+  (n_times, n_recorded), for state variables
+with index.json describing what's in the directory. load_monitors then gives
+SpikeRecords and StateRecords backed by memory-mapped arrays, which can be
+used in place of the original monitors.
+
+Monitors can only be emptied between runs in runtime mode (or with the NumPy
+backend), not in standalone mode.
+"""
+
+from __future__ import print_function, division
+import os
+import json
+import shutil
+import numpy as np
+
+import modules.records as record_mod
+
+INDEX_FILENAME = 'index.json'
+
+def _monitors(monitors):
+    for group_type in sorted(monitors):
+        for group in sorted(monitors[group_type]):
+            yield (group_type, group, monitors[group_type][group])
+
+def _array_filename(directory, group_type, group, name, segment=None):
+    if segment is None:
+        filename = '%s.%s.%s.npy' % (group_type, group, name)
+    else:
+        filename = '%s.%s.%s.%05d.npy' % (group_type, group, name, segment)
+    return os.path.join(directory, filename)
+
+def _clear(monitor, group_type):
+    monitor.resize(0)
+    if group_type == 'spikes' and hasattr(monitor, 'variables'):
+        # (SpikeMonitor.resize leaves the number of spikes alone)
+        monitor.variables['N'].set_value(0)
+
+class DiskRecorder(object):
+    """
+    Move the contents of a set of monitors (in the form returned by
+    stdp_sounds.init_monitors) into a directory of .npy files, every chunk
+    seconds of simulation time.
+    """
+
+    def __init__(self, directory, monitors, chunk):
+        self.directory = directory
+        self.monitors = monitors
+        self.period = chunk
+        self.n_segments = 0
+        # arrays stored for each monitor, as
+        # {(group_type, group): {name: (dtype, shape of one sample)}}
+        self.arrays = {}
+        self.index = {'complete': False, 'monitors': {}}
+
+        if os.path.exists(os.path.join(directory, INDEX_FILENAME)):
+            shutil.rmtree(directory)
+        elif os.path.isdir(directory) and os.listdir(directory):
+            raise ValueError("%s isn't empty" % directory)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        for (group_type, group, monitor) in _monitors(monitors):
+            info = record_mod.monitor_info(group_type, monitor)
+            self.index['monitors']['%s.%s' % (group_type, group)] = info
+            if info['type'] == 'spikes':
+                self.arrays[(group_type, group)] = {
+                    't': (np.float64, ()),
+                    'i': (np.int64, ())
+                }
+            else:
+                arrays = {'t': (np.float64, ())}
+                for var in info['variables']:
+                    arrays[var] = (np.float64, (len(info['record']),))
+                self.arrays[(group_type, group)] = arrays
+        self._write_index()
+
+    def _write_index(self):
+        with open(os.path.join(self.directory, INDEX_FILENAME), 'w') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+
+    def segment_done(self, end):
+        """
+        Called by stdp_sounds.run_windows after each chunk.
+        """
+        self.flush()
+        return False
+
+    def flush(self):
+        """
+        Write out everything recorded since the last flush and empty the
+        monitors.
+        """
+        for (group_type, group, monitor) in _monitors(self.monitors):
+            values = record_mod.monitor_arrays(group_type, monitor)
+            if len(values['t']) > 0:
+                for (name, (dtype, _)) in \
+                        self.arrays[(group_type, group)].items():
+                    np.save(_array_filename(self.directory, group_type, group,
+                                            name, self.n_segments),
+                            np.ascontiguousarray(values[name], dtype=dtype))
+            _clear(monitor, group_type)
+        self.n_segments += 1
+
+    def close(self):
+        """
+        Flush the monitors and join the segments of each array into one file.
+        Returns the recorded monitors, as loaded by load_monitors.
+        """
+        self.flush()
+        for ((group_type, group), arrays) in sorted(self.arrays.items()):
+            for (name, (dtype, sample_shape)) in sorted(arrays.items()):
+                self._join_segments(group_type, group, name, dtype,
+                                    sample_shape)
+        self.index['complete'] = True
+        self._write_index()
+        return load_monitors(self.directory)
+
+    def _join_segments(self, group_type, group, name, dtype, sample_shape):
+        segments = [_array_filename(self.directory, group_type, group, name,
+                                    k)
+                    for k in range(self.n_segments)]
+        segments = [filename for filename in segments
+                    if os.path.exists(filename)]
+        lengths = [len(np.load(filename, mmap_mode='r'))
+                   for filename in segments]
+        filename = _array_filename(self.directory, group_type, group, name)
+        joined = np.lib.format.open_memmap(
+            filename, mode='w+', dtype=dtype,
+            shape=(sum(lengths),) + sample_shape)
+        start = 0
+        for (segment, length) in zip(segments, lengths):
+            # (one segment in memory at a time)
+            joined[start:start + length] = np.load(segment, mmap_mode='r')
+            start += length
+            os.remove(segment)
+        joined.flush()
+        del joined
+
+def load_monitors(directory):
+    """
+    Load monitors recorded by DiskRecorder, as SpikeRecords and StateRecords
+    backed by memory-mapped arrays.
+    """
+    with open(os.path.join(directory, INDEX_FILENAME)) as f:
+        index = json.load(f)
+    if not index['complete']:
+        raise ValueError("Recording in %s wasn't finished" % directory)
+
+    def load(group_type, group, name):
+        return np.load(_array_filename(directory, group_type, group, name),
+                       mmap_mode='r')
+
+    monitors = {}
+    for (key, info) in index['monitors'].items():
+        (group_type, group) = key.split('.', 1)
+        if info['type'] == 'spikes':
+            names = ['t', 'i']
+        else:
+            names = ['t'] + info['variables']
+        arrays = dict((name, load(group_type, group, name))
+                      for name in names)
+        monitors.setdefault(group_type, {})[group] = \
+            record_mod.record_from_info(info, arrays)
+    for group_type in ['spikes', 'neurons', 'connections']:
+        monitors.setdefault(group_type, {})
+    return monitors
@@ -0,0 +1,240 @@
+"""
+Stand-ins for Brian's SpikeMonitor and StateMonitor, used to hold recordings
+which weren't made by Brian itself (e.g. by the NumPy backend), so that the
+analysis and saving code can treat them the same way as the real thing.
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import brian2 as b2
+from brian2.units.fundamentalunits import get_or_create_dimension
+
+class SpikeRecord(object):
+    """
+    Spikes recorded from a group of neurons, accessible through the same
+    't', 'i', 'count' and 'num_spikes' attributes as a Brian SpikeMonitor.
+    """
+
+    def __init__(self, n_neurons):
+        self.n_neurons = n_neurons
+        self._t_chunks = []
+        self._i_chunks = []
+        self._t = np.zeros(0)
+        self._i = np.zeros(0, dtype=int)
+
+    @classmethod
+    def from_arrays(cls, n_neurons, t, indices):
+        """
+        Make a record of already-recorded spikes (times in seconds), without
+        copying the arrays.
+        """
+        record = cls(n_neurons)
+        record._t = t
+        record._i = indices
+        return record
+
+    def append(self, t, indices):
+        """
+        Record spikes from the given neuron indices at time(s) t (in seconds,
+        either one time for all of them or an array of times).
+        """
+        if len(indices) == 0:
+            return
+        self._t_chunks.append(np.ones(len(indices)) * t)
+        self._i_chunks.append(np.asarray(indices))
+
+    def _collect(self):
+        if len(self._t_chunks) == 0:
+            return
+        self._t = np.concatenate([self._t] + self._t_chunks)
+        self._i = np.concatenate([self._i] + self._i_chunks).astype(int)
+        self._t_chunks = []
+        self._i_chunks = []
+
+    def resize(self, new_size):
+        """
+        Drop all but the first new_size spikes, as SpikeMonitor.resize does.
+        """
+        self._collect()
+        self._t = self._t[:new_size]
+        self._i = self._i[:new_size]
+
+    @property
+    def t_(self):
+        self._collect()
+        return self._t
+
+    @property
+    def t(self):
+        return self.t_ * b2.second
+
+    @property
+    def i(self):
+        self._collect()
+        return self._i
+
+    @property
+    def num_spikes(self):
+        self._collect()
+        return len(self._i)
+
+    @property
+    def count(self):
+        return np.bincount(self.i, minlength=self.n_neurons)
+
+    def __len__(self):
+        return self.num_spikes
+
+class StateRecord(object):
+    """
+    State variables recorded from a group, accessible through the same
+    attributes as a Brian StateMonitor: 't' for the recording times and
+    '<var>' (with units) or '<var>_' (without) for each variable, shaped
+    (n_recorded, n_times).
+    """
+
+    def __init__(self, variables, units, record):
+        self.record_variables = list(variables)
+        self.needed_variables = list(variables)
+        self.units = units
+        self.record = np.asarray(record)
+        self._t_rows = []
+        self._rows = dict((var, []) for var in variables)
+        self._t = np.zeros(0)
+        self._values = dict(
+            (var, np.zeros((0, len(self.record)))) for var in variables)
+
+    @classmethod
+    def from_arrays(cls, variables, units, record, t, values):
+        """
+        Make a record of already-recorded samples, without copying the arrays:
+        t is an array of times (in seconds) and values maps each variable to
+        an array of shape (n_times, n_recorded).
+        """
+        state_record = cls(variables, units, record)
+        state_record._t = t
+        state_record._values = dict(values)
+        return state_record
+
+    def append(self, t, values):
+        """
+        Record one sample at time t (in seconds); values maps each variable to
+        an array of (unitless) values for all elements of the group.
+        """
+        self._t_rows.append(t)
+        for var in self.record_variables:
+            self._rows[var].append(np.array(values[var][self.record]))
+
+    def extend(self, t, values):
+        """
+        Record many samples at once: t is an array of times (in seconds) and
+        values maps each variable to an array of shape (n_times, n_elements).
+        """
+        self._collect()
+        self._t = np.concatenate([self._t, t])
+        for var in self.record_variables:
+            self._values[var] = np.vstack(
+                [self._values[var], np.asarray(values[var])[:, self.record]])
+
+    def _collect(self):
+        if len(self._t_rows) == 0:
+            return
+        self._t = np.concatenate([self._t, self._t_rows])
+        for var in self.record_variables:
+            self._values[var] = np.vstack(
+                [self._values[var]] + self._rows[var])
+            self._rows[var] = []
+        self._t_rows = []
+
+    def resize(self, new_size):
+        """
+        Drop all but the first new_size samples, as StateMonitor.resize does.
+        """
+        self._collect()
+        self._t = self._t[:new_size]
+        for var in self.record_variables:
+            self._values[var] = self._values[var][:new_size]
+
+    @property
+    def t_(self):
+        self._collect()
+        return self._t
+
+    @property
+    def t(self):
+        return self.t_ * b2.second
+
+    def __len__(self):
+        return len(self.t_)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name.endswith('_') and name[:-1] in self.record_variables:
+            self._collect()
+            return self._values[name[:-1]].T
+        if name in self.record_variables:
+            self._collect()
+            return self._values[name].T * self.units[name]
+        raise AttributeError("No recorded variable '%s'" % name)
+
+def state_units(monitor):
+    """
+    The unit of each variable recorded by a StateMonitor or StateRecord.
+    """
+    if isinstance(monitor, StateRecord):
+        return dict(monitor.units)
+    return dict((var, b2.get_unit(monitor.variables[var].dim))
+                for var in monitor.record_variables)
+
+def monitor_info(group_type, monitor):
+    """
+    Describe a monitor (or record) of the given group type ('spikes',
+    'neurons' or 'connections') for saving what it recorded, in a form which
+    can be stored as JSON (see monitor_arrays and record_from_info).
+    """
+    if group_type == 'spikes':
+        if hasattr(monitor, 'source'):
+            n_neurons = len(monitor.source)
+        else:
+            n_neurons = monitor.n_neurons
+        return {'type': 'spikes', 'n_neurons': int(n_neurons)}
+
+    units = state_units(monitor)
+    return {
+        'type': 'state',
+        'record': [int(i) for i in np.asarray(monitor.record)],
+        'variables': list(monitor.record_variables),
+        'dimensions': dict(
+            (var, [float(d) for d in b2.get_dimensions(units[var])._dims])
+            for var in monitor.record_variables)
+    }
+
+def monitor_arrays(group_type, monitor):
+    """
+    What a monitor recorded, as unitless arrays: 't' (in seconds) and 'i'
+    for spikes, or 't' and each variable shaped (n_times, n_recorded) for
+    state variables. These are views of the monitor's data where possible.
+    """
+    arrays = {'t': np.asarray(monitor.t_)}
+    if group_type == 'spikes':
+        arrays['i'] = np.asarray(monitor.i)
+    else:
+        for var in monitor.record_variables:
+            arrays[var] = np.asarray(getattr(monitor, var + '_')).T
+    return arrays
+
+def record_from_info(info, arrays):
+    """
+    Make a SpikeRecord or StateRecord from the description of a monitor given
+    by monitor_info and the arrays given by monitor_arrays (or loaded from
+    where they were saved), without copying them.
+    """
+    if info['type'] == 'spikes':
+        return SpikeRecord.from_arrays(info['n_neurons'], arrays['t'],
+                                       arrays['i'])
+    units = dict((var, b2.get_unit(get_or_create_dimension(dims)))
+                 for (var, dims) in info['dimensions'].items())
+    return StateRecord.from_arrays(
+        info['variables'], units, np.asarray(info['record']), arrays['t'],
+        dict((var, arrays[var]) for var in info['variables']))
@@ -0,0 +1,280 @@
+"""
+Figures of a simulation rendered from its results file (see
+stdp_sounds.save_results) rather than from the live monitors, without pyplot
+or a display: each figure is drawn on its own Agg canvas, so figures can be
+rendered in parallel by a pool of processes.
+
+Everything is drawn at a bounded resolution whatever the length of the run:
+spike rasters with more than max_points spikes become images of spike counts
+in time bins, and state variables are drawn as images (a row per neuron) of
+their mean over at most max_columns bins of time, read from the memory-mapped
+arrays a block at a time, rather than as a subplot per neuron.
+
+The figures are:
+* 'spikes': input and output spike rasters
+* 'notes': output spikes of the neurons selective to a note in the second half
+  of the run, ordered by note (if the note structure is known)
+* 'state.<var>': each recorded layer1e state variable of the neurons which
+  fired
+* 'weights': change in input-layer1e weights over the run and final weights,
+  as images of input by neuron
+"""
+
+from __future__ import print_function, division
+import os
+import multiprocessing
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+import modules.results_file as results_file_mod
+import modules.utils as utils_mod
+
+# how many spikes or samples to read at a time
+BLOCK_SIZE = 2**20
+
+def figure_names(results):
+    """
+    The figures which can be made from a ResultsFile.
+    """
+    names = ['spikes']
+    if results.metadata and results.metadata.get('note_separation'):
+        names.append('notes')
+    for var in ['ge', 'theta', 'v']:
+        if _state_key(results, 'neurons', 'layer1e', var) is not None:
+            names.append('state.' + var)
+    if _state_key(results, 'connections', 'input-layer1e', 'w') is not None \
+            and results.other_array('input-layer1e.j') is not None:
+        names.append('weights')
+    return names
+
+def _state_key(results, group_type, group, var):
+    # (as monitoring.state_monitor, but for the monitors in a results file)
+    for (key, info) in sorted(results.footer['monitors'].items()):
+        (key_type, name) = key.split('.', 1)
+        if key_type != group_type:
+            continue
+        if name != group and not name.startswith(group + '.'):
+            continue
+        if var in info.get('variables', []):
+            return key
+    return None
+
+def _end_time(results):
+    end_time = 0.0
+    for key in results.footer['monitors']:
+        t = results.array(key, 't')
+        if len(t) > 0:
+            end_time = max(end_time, float(t[-1]))
+    return end_time
+
+def draw_raster(ax, times, indices, n_neurons, end_time, max_points=100000,
+                n_bins=2000):
+    """
+    Draw a spike raster, as points if there are at most max_points spikes or
+    otherwise as an image of the number of spikes of each neuron in each of
+    n_bins bins of time.
+    """
+    if len(times) <= max_points:
+        ax.plot(np.asarray(times), np.asarray(indices), 'k.', markersize=2)
+        ax.set_ylim([-1, n_neurons])
+        ax.set_xlim([0, end_time])
+        return
+    counts = np.zeros(n_neurons * n_bins, dtype=np.int64)
+    for start in range(0, len(times), BLOCK_SIZE):
+        t = np.asarray(times[start:start + BLOCK_SIZE])
+        i = np.asarray(indices[start:start + BLOCK_SIZE], dtype=np.int64)
+        bins = np.minimum((t / end_time * n_bins).astype(np.int64),
+                          n_bins - 1)
+        counts += np.bincount(i * n_bins + bins, minlength=len(counts))
+    ax.imshow(counts.reshape((n_neurons, n_bins)), aspect='auto',
+              origin='lower', cmap='gray_r', interpolation='nearest',
+              extent=[0, end_time, -0.5, n_neurons - 0.5])
+
+def time_binned(values, columns, max_bins):
+    """
+    Mean of the given columns of a (n_times, n_recorded) array over at most
+    max_bins equal bins of time, as an array of shape (len(columns), n_bins),
+    along with the number of samples per bin.
+    """
+    n_times = len(values)
+    per_bin = max(int(np.ceil(n_times / max_bins)), 1)
+    n_bins = int(np.ceil(n_times / per_bin))
+    binned = np.zeros((n_bins, len(columns)))
+    # (a whole number of bins at a time)
+    block = max(BLOCK_SIZE // max(len(columns), 1) // per_bin, 1) * per_bin
+    for start in range(0, n_times, block):
+        chunk = np.asarray(values[start:start + block])[:, columns]
+        first_bin = start // per_bin
+        n_full = len(chunk) // per_bin
+        if n_full > 0:
+            binned[first_bin:first_bin + n_full] = \
+                chunk[:n_full * per_bin].reshape(
+                    (n_full, per_bin, len(columns))).mean(axis=1)
+        if len(chunk) > n_full * per_bin:
+            binned[first_bin + n_full] = chunk[n_full * per_bin:].mean(axis=0)
+    return (binned.T, per_bin)
+
+def plot_spikes(fig, results, options):
+    monitors = results.footer['monitors']
+    end_time = _end_time(results)
+    for (n, group, title) in [(1, 'input', "Input spikes"),
+                              (2, 'layer1e', "Output spikes")]:
+        ax = fig.add_subplot(2, 1, n)
+        ax.set_title(title)
+        key = 'spikes.' + group
+        draw_raster(ax, results.array(key, 't'), results.array(key, 'i'),
+                    monitors[key]['n_neurons'], end_time,
+                    options['max_points'], options['max_columns'])
+        ax.set_ylabel("Neuron no.")
+        ax.grid()
+    ax.set_xlabel("Time (seconds)")
+
+def plot_notes(fig, results, options):
+    note_length = results.metadata['note_separation']
+    n_notes = results.metadata['n_notes']
+    times = np.asarray(results.array('spikes.layer1e', 't'))
+    indices = np.asarray(results.array('spikes.layer1e', 'i'))
+    end_time = _end_time(results)
+    counts = utils_mod.note_response_counts(indices, times, note_length,
+                                            n_notes, end_time/2, end_time)
+    favourite_notes = utils_mod.favourite_notes_from_counts(counts)
+    ax = fig.add_subplot(1, 1, 1)
+    ax.set_title("Output spikes of selective neurons, ordered by note")
+    (relevant_times, positions, neurons) = utils_mod.order_spikes_by_note(
+        indices, times, favourite_notes)
+    draw_raster(ax, relevant_times, positions, len(neurons), end_time,
+                options['max_points'], options['max_columns'])
+    ax.set_yticks(range(len(neurons)))
+    ax.set_yticklabels(["%d (note %d)" % (n, favourite_notes[n])
+                        for n in neurons])
+    ax.set_xlabel("Time (seconds)")
+
+def plot_state(fig, results, var, options):
+    key = _state_key(results, 'neurons', 'layer1e', var)
+    record = results.footer['monitors'][key]['record']
+    firing = set(np.unique(results.array('spikes.layer1e', 'i')).tolist())
+    rows = [row for (row, neuron_n) in enumerate(record) if neuron_n in firing]
+    if len(rows) == 0:
+        rows = list(range(len(record)))
+    t = results.array(key, 't')
+    (binned, per_bin) = time_binned(results.array(key, var), rows,
+                                    options['max_columns'])
+    ax = fig.add_subplot(1, 1, 1)
+    if len(t) > 0:
+        extent = [float(t[0]), float(t[-1]), -0.5, len(rows) - 0.5]
+    else:
+        extent = None
+    image = ax.imshow(binned, aspect='auto', origin='lower',
+                      interpolation='nearest', extent=extent)
+    fig.colorbar(image, ax=ax)
+    ax.set_title("layer1e %s of neurons which fired (mean over %d samples)" %
+                 (var, per_bin))
+    if len(rows) <= 32:
+        ax.set_yticks(range(len(rows)))
+        ax.set_yticklabels([str(record[row]) for row in rows])
+    ax.set_ylabel("Neuron no.")
+    ax.set_xlabel("Time (seconds)")
+
+def plot_weights(fig, results, options):
+    key = _state_key(results, 'connections', 'input-layer1e', 'w')
+    record = np.asarray(results.footer['monitors'][key]['record'])
+    pre = np.asarray(results.other_array('input-layer1e.i'))[record]
+    post = np.asarray(results.other_array('input-layer1e.j'))[record]
+    w = results.array(key, 'w')
+    n_pre = int(np.amax(pre)) + 1
+    n_post = int(np.amax(post)) + 1
+    start = np.asarray(w[0])
+    end = np.asarray(w[len(w) - 1])
+    for (n, values, title, cmap) in [
+            (1, end - start, "Weight change over the run", 'RdBu_r'),
+            (2, end, "Final weights", 'viridis')]:
+        image = np.full((n_post, n_pre), np.nan)
+        image[post, pre] = values
+        ax = fig.add_subplot(2, 1, n)
+        if cmap == 'RdBu_r':
+            limit = max(np.nanmax(np.abs(image)), 1e-12)
+            drawn = ax.imshow(image, aspect='auto', origin='lower',
+                              interpolation='nearest', cmap=cmap,
+                              vmin=-limit, vmax=limit)
+        else:
+            drawn = ax.imshow(image, aspect='auto', origin='lower',
+                              interpolation='nearest', cmap=cmap)
+        fig.colorbar(drawn, ax=ax)
+        ax.set_title(title)
+        ax.set_ylabel("Neuron no.")
+    ax.set_xlabel("Input no.")
+
+def render_figure(results, name, filename, options):
+    """
+    Draw one of the figure_names of a ResultsFile and save it to filename.
+    """
+    fig = Figure(figsize=options['figsize'])
+    FigureCanvasAgg(fig)
+    if name == 'spikes':
+        plot_spikes(fig, results, options)
+    elif name == 'notes':
+        plot_notes(fig, results, options)
+    elif name.startswith('state.'):
+        plot_state(fig, results, name.split('.', 1)[1], options)
+    elif name == 'weights':
+        plot_weights(fig, results, options)
+    else:
+        raise ValueError("Unknown figure: %s" % name)
+    fig.tight_layout()
+    fig.savefig(filename, dpi=options['dpi'])
+
+def _load(results_filename, options):
+    results = results_file_mod.ResultsFile(results_filename)
+    if options.get('metadata') is not None:
+        results.metadata = dict(results.metadata or {})
+        results.metadata.update(options['metadata'])
+    return results
+
+def _render_job(job):
+    (results_filename, name, filename, options) = job
+    render_figure(_load(results_filename, options), name, filename, options)
+    return filename
+
+def default_options():
+    """
+    Options for render_report; 'metadata' overrides what was saved with the
+    results (e.g. to give the note structure).
+    """
+    return {'max_points': 100000, 'max_columns': 2000, 'dpi': 100,
+            'figsize': (10, 6), 'format': 'png', 'metadata': None}
+
+def render_report(results_filename, output_dir, names=None, options=None,
+                  processes=1):
+    """
+    Render figures (by default, all of figure_names) from a results file to
+    <output_dir>/<run id>_<figure>.<format>, using a pool of processes if
+    processes > 1. Returns the filenames of the figures.
+    """
+    all_options = default_options()
+    all_options.update(options or {})
+    results = _load(results_filename, all_options)
+    if names is None:
+        names = figure_names(results)
+    if results.metadata and 'run_id' in results.metadata:
+        run_id = results.metadata['run_id']
+    else:
+        run_id = os.path.splitext(os.path.basename(results_filename))[0]
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    jobs = [(results_filename, name,
+             os.path.join(output_dir, '%s_%s.%s' %
+                          (run_id, name, all_options['format'])),
+             all_options)
+            for name in names]
+
+    if processes > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(processes, len(jobs)))
+        try:
+            filenames = pool.map(_render_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        filenames = [_render_job(job) for job in jobs]
+    return filenames
@@ -0,0 +1,164 @@
+"""
+Single-file archive of everything the monitors of a simulation recorded
+(.results), replacing pickled dictionaries of copied monitor variables.
+
+Layout:
+* MAGIC, then the offset and length of the footer (two uint64s), padded to
+  ALIGNMENT bytes
+* each array recorded by each monitor (see records.monitor_arrays), as raw
+  unitless data starting at a multiple of ALIGNMENT bytes
+* any other arrays to be kept with them (e.g. the indices of the synapses
+  whose weights were recorded), in the same way
+* a JSON footer describing each monitor (records.monitor_info, which
+  includes the units of state variables) and the dtype, shape and offset of
+  each of its arrays and of the other arrays, plus any metadata
+
+Since the size of every array is known before anything is written, the
+arrays are written in parallel, each thread writing blocks of arrays to
+their own parts of the file. Reading just memory-maps the arrays.
+"""
+
+from __future__ import print_function, division
+import json
+import struct
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+import modules.records as record_mod
+
+MAGIC = b'STDPRES\x01'
+ALIGNMENT = 64
+FILE_EXTENSION = '.results'
+# how much of an array to write at a time
+BLOCK_BYTES = 2**24
+
+def _aligned(offset):
+    return offset + (-offset) % ALIGNMENT
+
+def write_results(filename, monitors, metadata=None, n_threads=None,
+                  arrays=None):
+    """
+    Write monitors (in the form returned by stdp_sounds.simulate) to a results
+    file, using n_threads threads (by default, up to 4), along with any other
+    arrays given (as a dictionary of arrays by name).
+    """
+    if n_threads is None:
+        n_threads = min(multiprocessing.cpu_count(), 4)
+
+    footer = {'version': 1, 'monitors': {}, 'arrays': {},
+              'metadata': metadata}
+    # (offset, array, first row, end row) of each block to be written
+    blocks = []
+    offset = [_aligned(len(MAGIC) + 16)]
+
+    def add_array(array):
+        description = {
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+            'offset': offset[0]
+        }
+        row_bytes = max(array[:1].nbytes, 1)
+        rows_per_block = max(BLOCK_BYTES // row_bytes, 1)
+        for start in range(0, len(array), rows_per_block):
+            end = min(start + rows_per_block, len(array))
+            blocks.append((offset[0] + start * row_bytes, array, start, end))
+        offset[0] = _aligned(offset[0] + array.nbytes)
+        return description
+
+    for group_type in sorted(monitors):
+        for group in sorted(monitors[group_type]):
+            monitor = monitors[group_type][group]
+            info = record_mod.monitor_info(group_type, monitor)
+            info['arrays'] = {}
+            monitor_arrays = record_mod.monitor_arrays(group_type, monitor)
+            for (name, array) in sorted(monitor_arrays.items()):
+                info['arrays'][name] = add_array(array)
+            footer['monitors']['%s.%s' % (group_type, group)] = info
+    for (name, array) in sorted((arrays or {}).items()):
+        footer['arrays'][name] = add_array(np.asarray(array))
+    offset = offset[0]
+
+    footer = json.dumps(footer, sort_keys=True).encode('utf-8')
+    with open(filename, 'wb') as results_file:
+        results_file.write(MAGIC)
+        results_file.write(struct.pack('<QQ', offset, len(footer)))
+        results_file.truncate(offset)
+        results_file.seek(offset)
+        results_file.write(footer)
+
+    def write_blocks(thread_n):
+        with open(filename, 'r+b') as results_file:
+            for (block_offset, array, start, end) in \
+                    blocks[thread_n::n_threads]:
+                results_file.seek(block_offset)
+                results_file.write(
+                    np.ascontiguousarray(array[start:end]).tobytes())
+
+    pool = ThreadPool(n_threads)
+    try:
+        pool.map(write_blocks, range(n_threads))
+    finally:
+        pool.close()
+        pool.join()
+
+class ResultsFile(object):
+    """
+    Read-only access to a results file, with the arrays memory-mapped.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as results_file:
+            if results_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a results file" % filename)
+            (footer_offset, footer_length) = struct.unpack(
+                '<QQ', results_file.read(16))
+            results_file.seek(footer_offset)
+            footer = results_file.read(footer_length)
+        self.footer = json.loads(footer.decode('utf-8'))
+        if self.footer['version'] != 1:
+            raise ValueError("Unsupported results file version %d" %
+                             self.footer['version'])
+        self.metadata = self.footer['metadata']
+
+    def array(self, key, name):
+        return self._map(self.footer['monitors'][key]['arrays'][name])
+
+    def other_array(self, name):
+        """
+        One of the other arrays saved with the monitors, or None if there's
+        no such array.
+        """
+        description = self.footer.get('arrays', {}).get(name)
+        if description is None:
+            return None
+        return self._map(description)
+
+    def _map(self, description):
+        shape = tuple(description['shape'])
+        dtype = np.dtype(description['dtype'])
+        if np.prod(shape) == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self.filename, dtype=dtype, mode='r',
+                         offset=description['offset'], shape=shape)
+
+    def monitors(self):
+        """
+        The monitors saved in the file, as SpikeRecords and StateRecords
+        backed by memory-mapped arrays.
+        """
+        monitors = {'spikes': {}, 'neurons': {}, 'connections': {}}
+        for (key, info) in self.footer['monitors'].items():
+            (group_type, group) = key.split('.', 1)
+            arrays = dict((name, self.array(key, name))
+                          for name in info['arrays'])
+            monitors.setdefault(group_type, {})[group] = \
+                record_mod.record_from_info(info, arrays)
+        return monitors
+
+def load_results(filename):
+    """
+    Load the monitors saved in a results file (see ResultsFile.monitors).
+    """
+    return ResultsFile(filename).monitors()
@@ -0,0 +1,126 @@
+"""
+Tracking how selective the output neurons are to the notes of the input while
+the simulation runs, rather than only once it's finished.
+
+The run is split into segments (see stdp_sounds.run_windows);
+SelectivityTracker counts the new output spikes of each neuron during each
+note at the end of every segment (before a DiskRecorder can empty the
+monitor), and every period seconds of simulation time works out the
+favourite notes and accuracy (as utils.analyse_note_responses and
+utils.note_response_accuracy would) over the second half of the simulation
+so far, as the analysis at the end of the run does. Optionally, the run is
+stopped early if the network clearly hasn't learnt anything after a while.
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import brian2 as b2
+
+import modules.utils as utils_mod
+
+def spikes_between(spike_monitor, start, end):
+    """
+    (indices, times in seconds) of the spikes recorded by spike_monitor from
+    start up to (but not including) end, both in seconds.
+    """
+    # (other segment listeners might empty the monitor, so find the spikes
+    # by time rather than by number)
+    times = np.asarray(spike_monitor.t_)
+    indices = np.asarray(spike_monitor.i)
+    from_n = np.searchsorted(times, start - 1e-9)
+    to_n = np.searchsorted(times, end - 1e-9)
+    return (indices[from_n:to_n], times[from_n:to_n])
+
+class SelectivityTracker(object):
+    """
+    Track the note selectivity of the neurons recorded by spike_monitor every
+    period seconds of simulation time. If abort_below is given, the run is
+    stopped at the first check at or after abort_after in which the accuracy
+    is below abort_below (or no neuron is selective at all).
+    """
+
+    def __init__(self, spike_monitor, n_neurons, note_length, n_notes, period,
+                 abort_after=0*b2.second, abort_below=None):
+        self.spike_monitor = spike_monitor
+        self.n_neurons = n_neurons
+        self.note_length = float(note_length)
+        self.n_notes = n_notes
+        self.period = period
+        self.abort_after = float(abort_after)
+        self.abort_below = abort_below
+        # (start, end, spike counts of each neuron during each note) of each
+        # segment so far
+        self.segments = []
+        # (end, favourite notes, accuracy) at each check
+        self.history = []
+        self.stopped_at = None
+        # spike counts since the last check, counted up to counted_to
+        self.counted_to = 0.0
+        self.pending = np.zeros((n_neurons, n_notes), dtype=int)
+
+    def counts(self, from_time=0.0):
+        """
+        Spike counts of each neuron during each note in the segments starting
+        at or after from_time (in seconds).
+        """
+        counts = np.zeros((self.n_neurons, self.n_notes), dtype=int)
+        for (start, _, segment_counts) in self.segments:
+            if start >= from_time:
+                counts += segment_counts
+        return counts
+
+    def count_segment(self, end):
+        """
+        Count the spikes since they were last counted, up to end.
+        """
+        end = float(end)
+        (indices, times) = spikes_between(self.spike_monitor,
+                                          self.counted_to, end)
+        self.pending += utils_mod.count_note_responses(
+            indices, times, self.note_length, self.n_notes, self.n_neurons)
+        self.counted_to = end
+
+    def segment_done(self, end):
+        """
+        Count the spikes since the last check, up to end, and report
+        the selectivity so far. Returns True if the run should be stopped.
+        """
+        end = float(end)
+        if end > self.counted_to:
+            self.count_segment(end)
+        if len(self.segments) > 0:
+            start = self.segments[-1][1]
+        else:
+            start = 0.0
+        self.segments.append((start, end, self.pending))
+        self.pending = np.zeros((self.n_neurons, self.n_notes), dtype=int)
+
+        counts = self.counts(from_time=end/2)
+        favourite_notes = utils_mod.favourite_notes_from_counts(counts)
+        accuracy = utils_mod.accuracy_from_counts(counts, favourite_notes)
+        self.history.append((end, favourite_notes, accuracy))
+        print("%.1f s: %d neurons selective to %d notes, accuracy %.1f%%" %
+              (end, len(favourite_notes), len(set(favourite_notes.values())),
+               accuracy * 100))
+
+        if self.abort_below is not None and end >= self.abort_after - 1e-9:
+            if len(favourite_notes) == 0 or accuracy < self.abort_below:
+                print("Stopping: accuracy below %.1f%% after %.1f s" %
+                      (self.abort_below * 100, end))
+                self.stopped_at = end * b2.second
+                return True
+        return False
+
+    def checkpoint_state(self):
+        """
+        What has to be saved to continue tracking from a checkpoint (see
+        checkpoint_mod).
+        """
+        return {'segments': self.segments, 'history': self.history,
+                'counted_to': self.counted_to, 'pending': self.pending}
+
+    def restore_state(self, state):
+        self.segments = state['segments']
+        self.history = state['history']
+        self.counted_to = state['counted_to']
+        self.pending = state['pending']
@@ -0,0 +1,294 @@
+"""
+Columnar binary file format for input spikes (.spikes), replacing pickled
+(times, indices) tuples.
+
+Layout:
+* MAGIC, then a JSON header padded with spaces to HEADER_SIZE bytes in total
+* the timestep of each spike (uint32), sorted by time
+* the index of each spike (uint16)
+* a time index: the number of the first spike at or after each multiple of
+  index_period_steps timesteps (one second by default), plus a final entry
+  of n_spikes (uint64)
+The offsets of the arrays are given in the header, so that they can be
+memory-mapped, and the time index lets readers go straight to the spikes in
+a window of time without reading the rest.
+
+Times are stored as integer multiples of dt (0.1 ms, Brian's default
+timestep), which the times produced by the encoder in modules/audio.py
+always are; converting timesteps back to times gives exactly the same floats.
+"""
+
+from __future__ import print_function, division
+import os
+import json
+import pickle
+import tempfile
+import numpy as np
+
+MAGIC = b'STDPSPK\x01'
+HEADER_SIZE = 4096
+FILE_EXTENSION = '.spikes'
+DEFAULT_DT = 0.1e-3
+# number of inputs (frequency bins) of spikes pickled by older versions of
+# gen_audio_spikes.py
+LEGACY_N_INPUTS = 513
+
+def is_spike_file(filename):
+    with open(filename, 'rb') as spike_file:
+        return spike_file.read(len(MAGIC)) == MAGIC
+
+class SpikeFileWriter(object):
+    """
+    Write spikes to a spike file a block at a time, with only one block in
+    memory: the timesteps go straight into the file and the indices into a
+    temporary file which is copied after them when the writer is closed.
+    Blocks must be given in time order.
+    """
+
+    def __init__(self, filename, n_inputs, dt=DEFAULT_DT,
+                 index_period=1.0, metadata=None):
+        if n_inputs > np.iinfo(np.uint16).max + 1:
+            raise ValueError("Too many inputs for uint16 indices: %d" %
+                             n_inputs)
+        self.filename = filename
+        self.n_inputs = n_inputs
+        self.dt = dt
+        self.index_period_steps = int(round(index_period / dt))
+        self.metadata = metadata
+        self.n_spikes = 0
+        self.last_step = -1
+        self.period_counts = np.zeros(0, dtype=np.uint64)
+
+        self._file = open(filename, 'wb')
+        self._file.write(b'\0' * HEADER_SIZE)
+        (fd, self._indices_filename) = tempfile.mkstemp(
+            prefix=os.path.basename(filename) + '.',
+            dir=os.path.dirname(os.path.abspath(filename)))
+        self._indices_file = os.fdopen(fd, 'wb')
+
+    def write_times(self, times, indices):
+        """
+        Write spikes with times given in seconds.
+        """
+        timesteps = np.round(np.asarray(times) / self.dt).astype(np.int64)
+        self.write(timesteps, indices)
+
+    def write(self, timesteps, indices):
+        """
+        Write spikes with times given as timesteps.
+        """
+        timesteps = np.asarray(timesteps, dtype=np.int64)
+        indices = np.asarray(indices)
+        if len(timesteps) == 0:
+            return
+        if np.any(np.diff(timesteps) < 0) or timesteps[0] < self.last_step:
+            raise ValueError("Spikes must be written in time order")
+        if timesteps[-1] > np.iinfo(np.uint32).max:
+            raise ValueError("Spike at timestep %d is too late to store" %
+                             timesteps[-1])
+        if np.amin(indices) < 0 or np.amax(indices) >= self.n_inputs:
+            raise ValueError("Spike indices must be between 0 and %d" %
+                             (self.n_inputs - 1))
+
+        self._file.write(timesteps.astype(np.uint32).tobytes())
+        self._indices_file.write(indices.astype(np.uint16).tobytes())
+
+        counts = np.bincount(timesteps // self.index_period_steps)
+        if len(counts) > len(self.period_counts):
+            self.period_counts = np.concatenate([
+                self.period_counts,
+                np.zeros(len(counts) - len(self.period_counts),
+                         dtype=np.uint64)])
+        self.period_counts[:len(counts)] += counts.astype(np.uint64)
+
+        self.n_spikes += len(timesteps)
+        self.last_step = timesteps[-1]
+
+    def close(self, duration=None):
+        """
+        Finish the file. duration (in seconds) defaults to the time of the
+        last spike.
+        """
+        self._indices_file.close()
+        indices_offset = HEADER_SIZE + 4 * self.n_spikes
+        with open(self._indices_filename, 'rb') as indices_file:
+            while True:
+                data = indices_file.read(2**24)
+                if len(data) == 0:
+                    break
+                self._file.write(data)
+        os.remove(self._indices_filename)
+
+        # align the time index to 8 bytes
+        end = indices_offset + 2 * self.n_spikes
+        padding = (-end) % 8
+        self._file.write(b'\0' * padding)
+        time_index_offset = end + padding
+        time_index = np.concatenate([[0], np.cumsum(self.period_counts)])
+        self._file.write(time_index.astype(np.uint64).tobytes())
+
+        if duration is None:
+            duration = max(self.last_step, 0) * self.dt
+        header = {
+            'version': 1,
+            'n_spikes': int(self.n_spikes),
+            'n_inputs': int(self.n_inputs),
+            'dt': self.dt,
+            'duration': float(duration),
+            'index_period_steps': self.index_period_steps,
+            'n_index_entries': len(time_index),
+            'timesteps_offset': HEADER_SIZE,
+            'indices_offset': indices_offset,
+            'time_index_offset': time_index_offset,
+            'metadata': self.metadata
+        }
+        header = json.dumps(header, sort_keys=True).encode('utf-8')
+        if len(MAGIC) + len(header) > HEADER_SIZE:
+            raise ValueError("Spike file header too long")
+        self._file.seek(0)
+        self._file.write(MAGIC)
+        self._file.write(header.ljust(HEADER_SIZE - len(MAGIC), b' '))
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._indices_file.close()
+            os.remove(self._indices_filename)
+
+class SpikeFile(object):
+    """
+    Read-only access to a spike file, with the arrays memory-mapped.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as spike_file:
+            if spike_file.read(len(MAGIC)) != MAGIC:
+                raise ValueError("%s is not a spike file" % filename)
+            header = spike_file.read(HEADER_SIZE - len(MAGIC))
+        self.header = json.loads(header.decode('utf-8'))
+        if self.header['version'] != 1:
+            raise ValueError("Unsupported spike file version %d" %
+                             self.header['version'])
+
+        self.n_spikes = self.header['n_spikes']
+        self.n_inputs = self.header['n_inputs']
+        self.dt = self.header['dt']
+        self.duration = self.header['duration']
+        self.metadata = self.header['metadata']
+        self.index_period_steps = self.header['index_period_steps']
+        self.timesteps = self._map(np.uint32, self.header['timesteps_offset'],
+                                   self.n_spikes)
+        self.indices = self._map(np.uint16, self.header['indices_offset'],
+                                 self.n_spikes)
+        self.time_index = self._map(np.uint64,
+                                    self.header['time_index_offset'],
+                                    self.header['n_index_entries'])
+
+    def _map(self, dtype, offset, length):
+        if length == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.filename, dtype=dtype, mode='r', offset=offset,
+                         shape=(length,))
+
+    def __len__(self):
+        return self.n_spikes
+
+    def step_range(self, from_step, to_step):
+        """
+        Get the range of spike numbers with from_step <= timestep < to_step,
+        using the time index to only search the relevant part of the file.
+        """
+        period = self.index_period_steps
+        n_periods = len(self.time_index) - 1
+
+        def spike_number(step):
+            k = min(max(step // period, 0), n_periods)
+            lo = int(self.time_index[k])
+            hi = int(self.time_index[min(k + 1, n_periods)])
+            if k == n_periods:
+                return lo
+            return lo + int(np.searchsorted(self.timesteps[lo:hi], step))
+
+        return (spike_number(from_step), spike_number(to_step))
+
+    def read(self, start=None, end=None):
+        """
+        Get (times in seconds, indices) of the spikes with start <= time < end
+        (by default, all of them).
+        """
+        if start is None:
+            start_step = 0
+        else:
+            start_step = int(np.ceil(start / self.dt - 1e-6))
+        if end is None:
+            end_step = np.iinfo(np.int64).max
+        else:
+            end_step = int(np.ceil(end / self.dt - 1e-6))
+        (from_n, to_n) = self.step_range(start_step, end_step)
+        times = np.asarray(self.timesteps[from_n:to_n], dtype=np.int64) * \
+            self.dt
+        indices = np.asarray(self.indices[from_n:to_n], dtype=np.int64)
+        return (times, indices)
+
+def write_spikes(filename, times, indices, n_inputs, dt=DEFAULT_DT,
+                 duration=None, metadata=None):
+    """
+    Write a whole set of spikes (sorted by time, with times in seconds).
+    """
+    writer = SpikeFileWriter(filename, n_inputs, dt, metadata=metadata)
+    writer.write_times(times, indices)
+    writer.close(duration)
+
+def load_spikes(filename, start=None, end=None):
+    """
+    Load (times in seconds, indices) of the spikes with start <= time < end
+    (by default, all of them) from either a spike file or a pickled
+    (times, indices) tuple as written by older versions of gen_audio_spikes.py
+    (which has to be loaded whole).
+    """
+    if is_spike_file(filename):
+        return SpikeFile(filename).read(start, end)
+
+    with open(filename, 'rb') as pickle_file:
+        try:
+            (times, indices) = pickle.load(pickle_file)
+        except UnicodeDecodeError:
+            # pickled by Python 2
+            pickle_file.seek(0)
+            (times, indices) = pickle.load(pickle_file, encoding='latin1')
+    if start is None and end is None:
+        return (times, indices)
+    in_window = np.ones(len(times), dtype=bool)
+    if start is not None:
+        in_window &= times >= start
+    if end is not None:
+        in_window &= times < end
+    return (times[in_window], indices[in_window])
+
+def n_inputs(filename):
+    """
+    Number of input neurons in a spike file, or for a pickle (which doesn't
+    record it), LEGACY_N_INPUTS.
+    """
+    if is_spike_file(filename):
+        return SpikeFile(filename).n_inputs
+    return LEGACY_N_INPUTS
+
+def last_spike_time(filename):
+    """
+    Time of the last spike in a spike file or pickle (in seconds).
+    """
+    if is_spike_file(filename):
+        spike_file = SpikeFile(filename)
+        if len(spike_file) == 0:
+            return 0.0
+        return int(spike_file.timesteps[-1]) * spike_file.dt
+    (times, _) = load_spikes(filename)
+    return float(np.amax(times))
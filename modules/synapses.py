@@ -1,7 +1,58 @@
+import os.path
+import pickle
 import brian2 as b2
+import numpy as np
 import modules.equations as eqs
 
-def stdp_ex_synapses(source, target, connectivity, params):
+# cache of the random initial input-layer1e weights, for repeatability
+# (networks of other shapes get their own file; see initial_weights_filename)
+INITIAL_WEIGHTS_FILENAME = 'input-layer1e-weights.pickle'
+INITIAL_WEIGHTS_SHAPE = (513, 16)
+
+def initial_weights_filename(n_inputs, n_neurons):
+    if (n_inputs, n_neurons) == INITIAL_WEIGHTS_SHAPE:
+        return INITIAL_WEIGHTS_FILENAME
+    return INITIAL_WEIGHTS_FILENAME.replace(
+        '.pickle', '_%dx%d.pickle' % (n_inputs, n_neurons))
+
+def load_initial_weights(n_inputs, n_neurons):
+    """
+    Load the cached initial input-layer1e weights, or return None if they
+    haven't been cached yet.
+    """
+    filename = initial_weights_filename(n_inputs, n_neurons)
+    if not os.path.exists(filename):
+        return None
+    with open(filename, 'rb') as pickle_file:
+        return pickle.load(pickle_file)
+
+def save_initial_weights(weights, n_inputs, n_neurons):
+    # write to a temporary file and rename it, so that simulations started
+    # at the same time never read a half-written file
+    filename = initial_weights_filename(n_inputs, n_neurons)
+    tmp_filename = '%s.tmp%d' % (filename, os.getpid())
+    with open(tmp_filename, 'wb') as pickle_file:
+        pickle.dump(weights, pickle_file)
+    os.rename(tmp_filename, filename)
+
+def initial_weights(n_inputs, n_neurons):
+    """
+    Get the initial input-layer1e weights (in the order of Brian's all-to-all
+    synapses, i.e. input-major), generating and caching them if necessary.
+    """
+    weights = load_initial_weights(n_inputs, n_neurons)
+    if weights is None:
+        weights = np.random.rand(n_inputs * n_neurons) * 0.4
+        save_initial_weights(weights, n_inputs, n_neurons)
+    return weights
+
+def stdp_ex_synapses(source, target, connectivity, params,
+                     variable_params=None):
+    """
+    If variable_params is given, the parameters in eqs.variable_params_stdp_ee
+    are declared as variables with those flags instead of being put in the
+    namespace, and it's up to the caller to set their values.
+    """
     syn_params = {
         'tc_pre_ee': params['tc_pre_ee'],
         'tc_post_ee': params['tc_post_ee'],
@@ -14,12 +65,25 @@ def stdp_ex_synapses(source, target, connectivity, params):
         'max_theta': params['max_theta']
     }
 
+    model = eqs.eqs_stdp_ee
+    on_pre = eqs.eqs_stdp_pre_ee
+    on_post = eqs.eqs_stdp_post_ee
+    if variable_params is not None:
+        model += eqs.variable_params_eqs(eqs.variable_params_stdp_ee,
+                                         variable_params)
+        on_pre = eqs.rename_variable_params(on_pre,
+                                            eqs.variable_params_stdp_ee)
+        on_post = eqs.rename_variable_params(on_post,
+                                             eqs.variable_params_stdp_ee)
+        for name in eqs.variable_params_stdp_ee:
+            del syn_params[name]
+
     synapses = b2.Synapses(
         source=source,
         target=target,
-        model=eqs.eqs_stdp_ee,
-        on_pre=eqs.eqs_stdp_pre_ee,
-        on_post=eqs.eqs_stdp_post_ee,
+        model=model,
+        on_pre=on_pre,
+        on_post=on_post,
         namespace=syn_params
     )
 
@@ -28,6 +92,10 @@ def stdp_ex_synapses(source, target, connectivity, params):
     return synapses
 
 def nonplastic_synapses(source, target, connectivity, synapse_type):
+    """
+    connectivity is either a condition for Synapses.connect or an (i, j)
+    tuple of arrays giving each synapse to make.
+    """
     if synapse_type == 'excitatory':
         pre = 'ge_post += w * siemens'
     elif synapse_type == 'inhibitory':
@@ -43,7 +111,11 @@ def nonplastic_synapses(source, target, connectivity, synapse_type):
         model=model, on_pre=pre
     )
 
-    synapses.connect(connectivity)
+    if isinstance(connectivity, tuple):
+        (i, j) = connectivity
+        synapses.connect(i=np.asarray(i), j=np.asarray(j))
+    else:
+        synapses.connect(connectivity)
 
     return synapses
 
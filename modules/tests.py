@@ -1,4 +1,6 @@
 from __future__ import print_function, division
+import copy
+import time
 import numpy as np
 import matplotlib.pyplot as plt
 import brian2 as b2
@@ -260,3 +262,177 @@ def test_stdp_curve(connection_params):
 
     monitors = None
     return (neurons, synapses, monitors, net)
+
+# Largest difference in final weights (as a fraction of the maximum weight)
+# allowed between the backends, for differences in floating-point rounding
+WEIGHT_TOLERANCE = 1e-6
+
+def test_numpy_backend(params, load_input, simulate):
+    """
+    Check the NumPy backend against Brian (in runtime mode) on the input
+    given with --input_spikes_file.
+    * Runs the same network on the same input with both backends
+    * Prints how many output spikes agree exactly (same neuron, same
+      timestep), the time of the first disagreement, the largest difference
+      in final weights and how long each backend took
+    * Plots the output spike rasters of both backends on top of each other
+    * Checks that every output spike agrees and that no final weight differs
+      by more than WEIGHT_TOLERANCE (as a fraction of the maximum weight)
+    """
+    (neuron_params, connection_params, monitor_params, run_params,
+     analysis_params) = params
+    if run_params['input_spikes_filename'] is None:
+        raise ValueError("--test_numpy_backend needs --input_spikes_file")
+    run_params = dict(run_params)
+    run_params['no_standalone'] = True
+
+    input_spikes = load_input(run_params)
+    if 'run_time' not in run_params:
+        run_params['run_time'] = np.ceil(np.amax(input_spikes['times']))
+
+    results = {}
+    for backend in ['brian', 'numpy']:
+        backend_params = copy.deepcopy(run_params)
+        backend_params['backend'] = backend
+        start_time = time.time()
+        results[backend] = simulate(
+            (neuron_params, connection_params, monitor_params,
+             backend_params, analysis_params),
+            input_spikes,
+            'test_numpy_backend'
+        )
+        results[backend] += (time.time() - start_time,)
+
+    (_, brian_connections, brian_monitors, _, brian_time) = results['brian']
+    (_, numpy_connections, numpy_monitors, _, numpy_time) = results['numpy']
+
+    dt = b2.defaultclock.dt
+    brian_spikes = set(zip(
+        np.round(brian_monitors['spikes']['layer1e'].t / dt).astype(int),
+        brian_monitors['spikes']['layer1e'].i))
+    numpy_spikes = set(zip(
+        np.round(numpy_monitors['spikes']['layer1e'].t / dt).astype(int),
+        numpy_monitors['spikes']['layer1e'].i))
+    disagreements = brian_spikes ^ numpy_spikes
+    print("Brian: %d output spikes in %.1f s" %
+          (len(brian_spikes), brian_time))
+    print("NumPy: %d output spikes in %.1f s" %
+          (len(numpy_spikes), numpy_time))
+    print("%d spikes agree, %d disagree" %
+          (len(brian_spikes & numpy_spikes), len(disagreements)))
+    if len(disagreements) > 0:
+        print("First disagreement at %s" % (min(disagreements)[0] * dt))
+    weight_diff = np.abs(np.array(brian_connections['input-layer1e'].w) -
+                         numpy_connections['input-layer1e'].w)
+    print("Largest difference in final weights: %g" % np.amax(weight_diff))
+
+    plt.ion()
+    plt.figure()
+    plt.title("Output spikes (black: Brian, red: NumPy)")
+    plt.plot(
+        brian_monitors['spikes']['layer1e'].t/b2.second,
+        brian_monitors['spikes']['layer1e'].i,
+        'k.',
+        markersize=6
+    )
+    plt.plot(
+        numpy_monitors['spikes']['layer1e'].t/b2.second,
+        numpy_monitors['spikes']['layer1e'].i,
+        'r.',
+        markersize=2
+    )
+    plt.xlabel("Time (seconds)")
+    plt.ylabel("Neuron no.")
+    plt.grid()
+
+    assert len(disagreements) == 0, \
+        "%d output spikes disagree" % len(disagreements)
+    max_weight_diff = np.amax(weight_diff)
+    tolerance = WEIGHT_TOLERANCE * connection_params['wmax_ee']
+    assert max_weight_diff <= tolerance, \
+        "Final weights differ by up to %g (tolerance %g)" % \
+        (max_weight_diff, tolerance)
+    print("Backends agree")
+
+    return results['brian'][:4]
+
+def test_segment_listeners(params, prepare_input, simulate):
+    """
+    Check that the selectivity tracker and convergence monitor count every
+    output spike when the monitors are recorded to disk (which empties them
+    every --record_chunk seconds, whatever the periods of the listeners).
+    * Runs the network on the input given with --input_spikes_file (in
+      runtime mode) tracking selectivity every --track_selectivity seconds
+      and convergence every --stop_on_convergence seconds (both twice
+      --record_chunk by default), without and then with --record_to_disk
+    * Prints the spike counts of each check of both runs, and checks that
+      they're the same, and that they add up to the output spikes recorded
+    * Checks that the winner changes measured by the convergence monitor
+      are the same in both runs
+    """
+    (neuron_params, connection_params, monitor_params, run_params,
+     analysis_params) = params
+    if run_params['input_spikes_filename'] is None:
+        raise ValueError("--test_segment_listeners needs --input_spikes_file")
+    run_params = dict(run_params)
+    run_params['no_standalone'] = True
+    if run_params.get('track_selectivity') is None:
+        run_params['track_selectivity'] = 2 * monitor_params['record_chunk']
+    if run_params.get('stop_on_convergence') is None:
+        run_params['stop_on_convergence'] = \
+            2 * monitor_params['record_chunk']
+
+    input_spikes = prepare_input(run_params)
+
+    results = {}
+    trackers = {}
+    convergences = {}
+    for record_to_disk in [False, True]:
+        run_monitor_params = dict(monitor_params)
+        run_monitor_params['record_to_disk'] = record_to_disk
+        listeners = []
+        np.random.seed(run_params.get('seed', 1))
+        results[record_to_disk] = simulate(
+            (neuron_params, connection_params, run_monitor_params,
+             dict(run_params), analysis_params),
+            input_spikes,
+            'test_segment_listeners',
+            run_listeners=listeners
+        )
+        trackers[record_to_disk] = [
+            listener for listener in listeners
+            if hasattr(listener, 'segments')][0]
+        convergences[record_to_disk] = [
+            listener for listener in listeners
+            if hasattr(listener, 'final_weights')][0]
+
+    for record_to_disk in [False, True]:
+        print("%s:" % ("Recorded to disk" if record_to_disk else "In memory"))
+        for (start, end, counts) in trackers[record_to_disk].segments:
+            print("  %g-%g s: %d spikes" % (start, end, np.sum(counts)))
+        n_counted = sum(np.sum(counts) for (_, _, counts) in
+                        trackers[record_to_disk].segments)
+        n_recorded = len(results[record_to_disk][2]['spikes']['layer1e'].t)
+        assert n_counted == n_recorded, \
+            "%d spikes counted, %d recorded" % (n_counted, n_recorded)
+
+    segments = [trackers[record_to_disk].segments
+                for record_to_disk in [False, True]]
+    assert len(segments[0]) == len(segments[1])
+    for (memory_segment, disk_segment) in zip(*segments):
+        assert memory_segment[:2] == disk_segment[:2]
+        assert np.array_equal(memory_segment[2], disk_segment[2]), \
+            "Different counts in %g-%g s" % memory_segment[:2]
+    print("Spike counts agree")
+
+    histories = [convergences[record_to_disk].history
+                 for record_to_disk in [False, True]]
+    assert len(histories[0]) == len(histories[1])
+    for (memory_check, disk_check) in zip(*histories):
+        print("%g s: winner change %.3g in memory, %.3g recorded to disk" %
+              (memory_check[0], memory_check[2], disk_check[2]))
+        assert np.allclose(memory_check, disk_check), \
+            "Different changes at %g s" % memory_check[0]
+    print("Convergence checks agree")
+
+    return results[True]
@@ -13,7 +13,8 @@ def save_figures(name):
     figs = plt.get_fignums()
     for fig in figs:
         plt.figure(fig)
-        os.system('rm -f figures/%s_fig_%d.pdf' % (name, fig))
+        if os.path.exists('figures/%s_fig_%d.pdf' % (name, fig)):
+            os.remove('figures/%s_fig_%d.pdf' % (name, fig))
         plt.savefig('figures/%s_fig_%d.png' % (name, fig))
     print("done!")
 
@@ -31,9 +32,12 @@ def plot_state_var(monitor, state_vals, firing_neurons, title):
     n_firing_neurons = len(firing_neurons)
     min_val = float('inf')
     max_val = -float('inf')
+    # (the monitor might not record every neuron)
+    rows = dict((neuron_n, row)
+                for (row, neuron_n) in enumerate(monitor.record))
     for i, neuron_n in enumerate(firing_neurons):
         plt.subplot(n_firing_neurons, 1, i+1)
-        neuron_val = state_vals[neuron_n, :]
+        neuron_val = state_vals[rows[neuron_n], :]
         neuron_val_min = np.amin(neuron_val)
         if neuron_val_min < min_val:
             min_val = neuron_val_min
@@ -52,65 +56,139 @@ def plot_state_var(monitor, state_vals, firing_neurons, title):
     plt.subplot(n_firing_neurons, 1, 1)
     plt.title(title)
 
+def _in_seconds(x):
+    # (times can be given either with units or as numbers of seconds)
+    if isinstance(x, b2.Quantity):
+        return np.asarray(x / b2.second)
+    return np.asarray(x)
+
+def note_response_counts(spike_indices, spike_times, note_length, n_notes,
+                         from_time, to_time):
+    """
+    Count the spikes of each neuron between from_time and to_time (exclusive)
+    during each note, assuming the notes repeat every n_notes notes of
+    note_length each. Returns an array of shape (n_neurons, n_notes), with
+    n_neurons one more than the highest index of a neuron which spiked.
+    """
+    spike_indices = np.asarray(spike_indices)
+    spike_times = _in_seconds(spike_times)
+    if len(spike_indices) == 0:
+        return np.zeros((0, n_notes), dtype=int)
+    n_neurons = int(np.amax(spike_indices)) + 1
+
+    # (spikes from monitors are already in time order)
+    if np.any(np.diff(spike_times) < 0):
+        order = np.argsort(spike_times, kind='mergesort')
+        spike_times = spike_times[order]
+        spike_indices = spike_indices[order]
+    from_n = np.searchsorted(spike_times, _in_seconds(from_time), 'right')
+    to_n = np.searchsorted(spike_times, _in_seconds(to_time), 'left')
+    return count_note_responses(spike_indices[from_n:to_n],
+                                spike_times[from_n:to_n],
+                                note_length, n_notes, n_neurons)
+
+def count_note_responses(spike_indices, spike_times, note_length, n_notes,
+                         n_neurons):
+    """
+    Count all the given spikes of each neuron during each note, as an array
+    of shape (n_neurons, n_notes) (see note_response_counts).
+    """
+    indices = np.asarray(spike_indices).astype(int)
+    notes = np.mod(np.floor(_in_seconds(spike_times) /
+                            _in_seconds(note_length)).astype(int),
+                   n_notes)
+    counts = np.bincount(indices * n_notes + notes,
+                         minlength=n_neurons * n_notes)
+    return counts.reshape((n_neurons, n_notes))
+
+def favourite_notes_from_counts(counts):
+    """
+    Given spike counts of each neuron during each note (see
+    note_response_counts), find the note each neuron which fires consistently
+    responds to most. Neurons with fewer than 20% as many spikes as the most
+    active neuron are ignored.
+    Returns a dictionary mapping neuron number to its favourite note.
+    """
+    n_spikes = np.sum(counts, axis=1)
+    if len(n_spikes) == 0 or np.amax(n_spikes) == 0:
+        return {}
+    selective = (n_spikes > 0) & (n_spikes >= 0.2 * np.amax(n_spikes))
+    return dict((int(neuron_n), int(np.argmax(counts[neuron_n])))
+                for neuron_n in np.nonzero(selective)[0])
+
+def accuracy_from_counts(counts, favourite_notes):
+    """
+    Fraction of the spikes counted in counts (see note_response_counts) from
+    the neurons in favourite_notes which were during each neuron's favourite
+    note, as note_response_accuracy.
+    """
+    neurons = np.array(list(favourite_notes.keys()), dtype=int)
+    notes = np.array(list(favourite_notes.values()), dtype=int)
+    # (neurons which didn't spike at all may not be in counts)
+    counted = neurons < len(counts)
+    (neurons, notes) = (neurons[counted], notes[counted])
+    n_spikes = np.sum(counts[neurons])
+    if n_spikes == 0:
+        return float('nan')
+    return float(np.sum(counts[neurons, notes])) / n_spikes
+
 def analyse_note_responses(spike_indices, spike_times,
                            note_length, n_notes, from_time, to_time):
-    max_spikes = 0
-    for neuron_n in set(spike_indices):
-        relevant_spike_times = \
-            spike_times[spike_indices == neuron_n]
-        relevant_spike_times = \
-            [t for t in relevant_spike_times if t > from_time and t < to_time]
-        n_spikes = len(relevant_spike_times)
-        if n_spikes > max_spikes:
-            max_spikes = n_spikes
-
-    favourite_notes = {}
-    for neuron_n in set(spike_indices):
-        relevant_spike_times = \
-            spike_times[spike_indices == neuron_n]
-        relevant_spike_times = \
-            [t for t in relevant_spike_times if t > from_time and t < to_time]
-        relevant_spike_times = np.array(relevant_spike_times)
-        n_spikes = len(relevant_spike_times)
-        if n_spikes == 0 or n_spikes < 0.2 * max_spikes:
-            continue
-
-        note_bin_firings = np.floor(relevant_spike_times / note_length).astype(int)
-        note_responses = np.mod(note_bin_firings, n_notes)
-        most_common_note = np.argmax(np.bincount(note_responses))
-        n_misfirings = sum(note_responses != most_common_note)
-        misfirings_pct = float(n_misfirings) / len(note_responses) * 100
+    """
+    Find the note each neuron which fires consistently between from_time and
+    to_time responds to. Neurons with fewer than 20% as many spikes as the
+    most active neuron are ignored.
+    Returns a dictionary mapping neuron number to its favourite note.
+    """
+    counts = note_response_counts(spike_indices, spike_times, note_length,
+                                  n_notes, from_time, to_time)
+    favourite_notes = favourite_notes_from_counts(counts)
+
+    for (neuron_n, most_common_note) in sorted(favourite_notes.items()):
+        n_spikes = np.sum(counts[neuron_n])
+        n_misfirings = n_spikes - counts[neuron_n, most_common_note]
+        misfirings_pct = float(n_misfirings) / n_spikes * 100
         print("Neuron %d likes note %d, %.1f%% mistakes" \
             % (neuron_n, most_common_note, misfirings_pct))
-        favourite_notes[neuron_n] = most_common_note
 
     return favourite_notes
 
+def note_response_accuracy(spike_indices, spike_times, favourite_notes,
+                           note_length, n_notes, from_time, to_time):
+    """
+    Fraction of the spikes between from_time and to_time from the neurons in
+    favourite_notes (as returned by analyse_note_responses) which happened
+    during each neuron's favourite note.
+    """
+    counts = note_response_counts(spike_indices, spike_times, note_length,
+                                  n_notes, from_time, to_time)
+    return accuracy_from_counts(counts, favourite_notes)
+
 def order_spikes_by_note(spike_indices, spike_times, favourite_notes):
     # favourite_notes is a dictionary mapping neuron number to which
     # note it fires in response to
     # e.g. favourite_notes[3] == 2 => neuron 3 fires in response to note 2
-    # extract spike times of the neurons which actually fire consistently
-    relevant_times = [time
-        for (spike_n, time) in enumerate(spike_times)
-        if spike_indices[spike_n] in favourite_notes
-    ]
-    # extract the neuron indices corresponding to those spike times
-    relevant_indices = [i for i in spike_indices if i in favourite_notes]
-
-    # generate a list of which neuron in favourite_notes
-    # each spike corresponds to, sorted by note order
+    # returns the times of the spikes of the neurons in favourite_notes,
+    # which position in the list of those neurons sorted by note each spike
+    # corresponds to, and that list
     # (we need to do it like this instead of just plotting times against
     #  favourite_notes[spike_index] in case more than one neuron responds to
     #  each note)
-    # first of all we need to sort the list by note order
-    fav_note_neurons = np.array(favourite_notes.keys())
-    fav_note_notes = np.array(favourite_notes.values())
+    spike_indices = np.asarray(spike_indices)
+    fav_note_neurons = np.array(list(favourite_notes.keys()), dtype=int)
+    fav_note_notes = np.array(list(favourite_notes.values()), dtype=int)
     neurons_ordered_by_note = fav_note_neurons[np.argsort(fav_note_notes)]
-    # now we figure out which index of that list each spike corresponds to
-    neurons_ordered_by_note_indices = \
-        [np.argwhere(neurons_ordered_by_note == i)[0][0]
-         for i in relevant_indices]
+
+    # extract the spikes of the neurons which actually fire consistently
+    relevant = np.isin(spike_indices, fav_note_neurons)
+    relevant_times = spike_times[relevant]
+
+    # position of each neuron in neurons_ordered_by_note
+    positions = np.zeros(np.amax(fav_note_neurons, initial=-1) + 1,
+                         dtype=int)
+    positions[neurons_ordered_by_note] = np.arange(
+        len(neurons_ordered_by_note))
+    neurons_ordered_by_note_indices = positions[spike_indices[relevant]]
 
     return (relevant_times, neurons_ordered_by_note_indices,
             neurons_ordered_by_note)
@@ -119,7 +197,7 @@ def order_spikes_by_note(spike_indices, spike_times, favourite_notes):
 def ordered_spike_raster(spike_indices, spike_times, favourite_notes):
     (relevant_times, neurons_ordered_by_note_indices,
      neurons_ordered_by_note) = \
-        order_spikes_by_note(spike_indices, spike_times, favourite_times)
+        order_spikes_by_note(spike_indices, spike_times, favourite_notes)
 
     plt.plot(relevant_times, neurons_ordered_by_note_indices,
              'k.', markersize=2)
@@ -156,9 +234,11 @@ def plot_weight_diff(connections, weight_monitor, from_t=0, to_t=-1, newfig=True
     max_diff = np.max(weight_diffs)
     min_diff = np.min(weight_diffs)
 
+    # (the monitor might not record every synapse)
+    recorded_j = np.asarray(connections.j)[np.asarray(weight_monitor.record)]
     for neuron_n in neurons:
         plt.subplot(n_neurons, 1, neuron_n+1)
-        relevant_weights = connections.j == neuron_n
+        relevant_weights = recorded_j == neuron_n
         diff = weight_diffs[relevant_weights]
         plt.plot(diff)
         plt.ylim([min_diff, max_diff])
@@ -5,10 +5,7 @@ set -o errexit
 
 VARS_FILE=$1
 AUDIO_FILE=$2
-VIDEO_FILE=$(sed 's/.pickle/.video.mp4/g' <<< "$VARS_FILE")
-OUTPUT_FILE=$(sed 's/.pickle/.mp4/g' <<< "$VARS_FILE")
 
-./write_movie.py "$VARS_FILE"
-ffmpeg -y \
-    -i "$VIDEO_FILE" -i "$AUDIO_FILE" \
-    -vcodec h264 -shortest "$OUTPUT_FILE"
+# (renders the frames and muxes in the audio in a single ffmpeg pass, writing
+# the variables file's name with .mp4)
+./write_movie.py "$VARS_FILE" --audio "$AUDIO_FILE"
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+"""
+Render the figures of one or more simulations from their results files
+(results/monitors_<run id>.results, saved by stdp_sounds.py with
+--save_results), without a display (see modules/report.py), e.g.:
+
+$ ./report.py results/monitors_two_notes_0.5_s.results --processes 4
+"""
+
+from __future__ import print_function, division
+import argparse
+import matplotlib
+matplotlib.use('Agg')
+
+import modules.report as report_mod
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('results_files', nargs='+')
+    parser.add_argument('--output_dir', default='figures')
+    # which figures to render (by default, all that can be made from what was
+    # recorded; see modules/report.py)
+    parser.add_argument('--figures', nargs='+')
+    # render this many figures at once
+    parser.add_argument('--processes', type=int, default=1)
+    # spike rasters with more spikes than this are drawn as images
+    parser.add_argument('--max_points', type=int, default=100000)
+    # how many bins of time to draw state variables and large rasters in
+    parser.add_argument('--max_columns', type=int, default=2000)
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--format', default='png')
+    # note structure for the 'notes' figure, if not saved with the results
+    parser.add_argument('--note_separation', type=float)
+    parser.add_argument('--n_notes', type=int)
+    return parser.parse_args()
+
+def main():
+    args = get_args()
+    options = {'max_points': args.max_points,
+               'max_columns': args.max_columns,
+               'dpi': args.dpi,
+               'format': args.format}
+    if args.note_separation is not None and args.n_notes is not None:
+        options['metadata'] = {'note_separation': args.note_separation,
+                               'n_notes': args.n_notes}
+    for results_filename in args.results_files:
+        print("Rendering figures of %s..." % results_filename)
+        for filename in report_mod.render_report(
+                results_filename, args.output_dir, args.figures, options,
+                args.processes):
+            print(filename)
+    print("done!")
+
+if __name__ == '__main__':
+    main()
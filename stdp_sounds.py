@@ -17,40 +17,177 @@ in all but the winning neuron, resulting in a lot of flashing.)
 
 from __future__ import print_function, division
 import os.path
-import pickle
 import brian2 as b2
 import numpy as np
 import matplotlib.pyplot as plt
+from brian2.codegen.cpp_prefs import get_compiler_and_args
 
 import modules.utils as utils_mod
 import modules.synapses as synapse_mod
 import modules.neurons as neuron_mod
 import modules.params as param_mod
 import modules.tests as test_mod
-
-def load_input(run_params):
+import modules.numpy_backend as numpy_mod
+import modules.build_cache as build_cache_mod
+import modules.equations as eqs_mod
+import modules.batch as batch_mod
+import modules.spike_file as spike_file_mod
+import modules.recorder as recorder_mod
+import modules.selectivity as selectivity_mod
+import modules.convergence as convergence_mod
+import modules.checkpoint as checkpoint_mod
+import modules.inference as inference_mod
+import modules.monitoring as monitoring_mod
+import modules.results_file as results_file_mod
+import modules.movie as movie_mod
+import modules.profiling as profiling_mod
+
+# parameters which, when using the build cache, are passed to the compiled
+# standalone binary as run-time arguments instead of being compiled in
+TUNABLE_PARAMS = set(eqs_mod.variable_params_e) | \
+    set(eqs_mod.variable_params_stdp_ee) | set(['ex-in-w', 'in-ex-w'])
+
+def load_input(run_params, start=None, end=None):
     """
     Load spikes to be used for input neuroneuron_mod.
+    If start/end are given, only the spikes with start <= time < end are
+    loaded (which only reads that part of a spike file).
     """
 
-    pickle_filename = run_params['input_spikes_filename']
-    with open(pickle_filename, 'rb') as pickle_file:
-        (input_spike_times, input_spike_indices) = pickle.load(pickle_file)
+    spikes_filename = run_params['input_spikes_filename']
+    if start is not None:
+        start = float(start)
+    if end is not None:
+        end = float(end)
+    (input_spike_times, input_spike_indices) = \
+        spike_file_mod.load_spikes(spikes_filename, start, end)
     input_spike_times = input_spike_times * b2.second
 
     spikes = {}
     spikes['indices'] = input_spike_indices
     spikes['times'] = input_spike_times
+    spikes['n_inputs'] = spike_file_mod.n_inputs(spikes_filename)
 
     return spikes
 
-def init_neurons(input_spikes, layer_n_neurons, neuron_params):
+def prepare_input(run_params):
+    """
+    Set the run time to the end of the input if it wasn't specified, and load
+    the spikes needed for the start of the simulation: those in the run time,
+    or just those in the first window if the input is run in windows (see
+    run_segments).
+    """
+    if 'run_time' not in run_params:
+        last_spike_time = spike_file_mod.last_spike_time(
+            run_params['input_spikes_filename'])
+        run_params['run_time'] = np.ceil(last_spike_time) * b2.second
+
+    end = run_params['run_time']
+    if run_params.get('input_window') is not None:
+        end = min(end, run_params['input_window'])
+
+    return load_input(run_params, 0 * b2.second, end)
+
+def run_segments(run_params, periods=(), start_time=0*b2.second):
+    """
+    Split the run time from start_time on into the segments the simulation
+    is run in: a new segment starts at the start of each window of
+    run_params['input_window'] (if the input is run in windows) and every one
+    of the given periods.
+    Yields (start, end, window_end) for each segment, with window_end the end
+    of the input window starting at the start of the segment, or None if no
+    window starts there.
+    """
+    dt = float(b2.defaultclock.dt)
+    n_steps = int(np.round(float(run_params['run_time']) / dt))
+    start_step = int(np.round(float(start_time) / dt))
+
+    def steps(period):
+        period_steps = max(int(np.round(float(period) / dt)), 1)
+        return list(range(0, n_steps, period_steps))
+
+    if run_params.get('input_window') is None:
+        window_starts = [0]
+    else:
+        window_starts = steps(run_params['input_window'])
+    starts = set(window_starts)
+    for period in periods:
+        starts |= set(steps(period))
+    starts = sorted(set([start_step]) |
+                    set(step for step in starts if step >= start_step))
+    window_ends = dict(zip(window_starts, window_starts[1:] + [n_steps]))
+
+    for (start, end) in zip(starts, starts[1:] + [n_steps]):
+        if start in window_ends:
+            window_end = window_ends[start] * dt * b2.second
+        else:
+            window_end = None
+        yield (start * dt * b2.second, end * dt * b2.second, window_end)
+
+def run_windows(net, set_spikes, run_params, listeners=(),
+                start_time=0*b2.second, profile=None):
+    """
+    Run the network from start_time (later than 0 if resuming from a
+    checkpoint) to the end of the run time, either in one go or in segments
+    (see run_segments): window by window, replacing the input spikes (using
+    set_spikes(indices, times)) at the start of each window so that only one
+    window's spikes are loaded at a time, and/or every listener.period, with
+    listener.segment_done(end) being called for each listener (e.g. a
+    recorder_mod.DiskRecorder or selectivity_mod.SelectivityTracker) every
+    listener.period and at the end of the run. If any of them returns True,
+    the run stops there. Listeners with a count_segment(end) method have it
+    called at the end of every segment, before any segment_done, so that
+    they see everything the monitors recorded before a recorder empties
+    them, whatever their periods. The runs are recorded in profile, if given
+    (see profiling_mod.RunProfile.run_network).
+    """
+    if profile is None:
+        profile = profiling_mod.RunProfile(code_objects=False)
+    windowed = run_params.get('input_window') is not None
+    if not windowed and len(listeners) == 0:
+        profile.run_network(net, run_params['run_time'] - start_time)
+        return
+
+    periods = [listener.period for listener in listeners]
+    tolerance = b2.defaultclock.dt / 2
+    # when each listener is next due to be called
+    due = [period * (np.floor((start_time + tolerance) / period) + 1)
+           for period in periods]
+    for (start, end, window_end) in run_segments(run_params, periods,
+                                                 start_time):
+        if windowed and window_end is not None:
+            print("Input window %.1f s to %.1f s" %
+                  (start / b2.second, window_end / b2.second))
+            spikes = load_input(run_params, start, window_end)
+            set_spikes(spikes['indices'], spikes['times'])
+        profile.run_network(net, end - start)
+        for listener in listeners:
+            if hasattr(listener, 'count_segment'):
+                listener.count_segment(end)
+        last = end > run_params['run_time'] - tolerance
+        stop = False
+        for (k, listener) in enumerate(listeners):
+            if end < due[k] - tolerance and not last:
+                continue
+            while due[k] < end + tolerance:
+                due[k] += periods[k]
+            if listener.segment_done(end):
+                stop = True
+        if stop:
+            return
+
+def init_neurons(input_spikes, layer_n_neurons, neuron_params,
+                 variable_params=None, batch_size=1, frozen=False):
     """
     Initialise neurons.
+    (See neuron_mod.excitatory_neurons for variable_params and frozen.)
+    With batch_size > 1, each layer holds that many copies of the layer,
+    one after the other (see batch_mod).
     """
     neurons = {}
+    n_neurons = layer_n_neurons * batch_size
 
-    n_inputs = 513
+    n_inputs = input_spikes['n_inputs']
     neurons['input'] = neuron_mod.prespecified_spike_neurons(
         n_neurons=n_inputs,
         spike_indices=input_spikes['indices'],
@@ -59,29 +196,43 @@ def init_neurons(input_spikes, layer_n_neurons, neuron_params):
 
     # excitatory neurons
     neurons['layer1e'] = neuron_mod.excitatory_neurons(
-        n_neurons=layer_n_neurons,
-        params=neuron_params
+        n_neurons=n_neurons,
+        params=neuron_params,
+        variable_params=variable_params,
+        frozen=frozen
     )
 
     # inhibitory neurons
     neurons['layer1i'] = neuron_mod.inhibitory_neurons(
-        n_neurons=layer_n_neurons,
+        n_neurons=n_neurons,
         params=neuron_params
     )
 
     # visualisation neurons
     if neuron_params['vis']:
         neurons['layer1vis'] = neuron_mod.visualisation_neurons(
-            n_neurons=layer_n_neurons,
+            n_neurons=n_neurons,
             params=neuron_params
         )
 
     return neurons
 
-def init_connections(neurons, connection_params):
+def init_connections(neurons, connection_params, variable_params=None,
+                     batch_size=1, weights=None, synapses=None):
     """
     Initialise synaptic connections between different layers of neurons.
+    If variable_params is given, the tunable parameters (including the weights
+    of the connections between the excitatory and inhibitory layers) are left
+    for the caller to set; see tunable_param_values.
+    With batch_size > 1, the layers hold that many independent copies of the
+    network, which are only connected to the neurons of their own copy.
+    If weights (e.g. of a trained network) are given, the input-layer1e
+    connections use those and aren't plastic; synapses then optionally gives
+    the (i, j) of each of the weights, if not all-to-all (e.g. after pruning;
+    see inference_mod.prune_model).
     """
+    n_inputs = len(neurons['input'])
+    n_neurons = len(neurons['layer1e']) // batch_size
 
     connections = {}
 
@@ -89,24 +240,28 @@ def init_connections(neurons, connection_params):
 
     source = neurons['input']
     target = neurons['layer1e']
-    connections['input-layer1e'] = synapse_mod.stdp_ex_synapses(
-        source=source,
-        target=target,
-        connectivity=True, # all-to-all connectivity
-        params=connection_params
-    )
-
-    # load saved weights, if they exist
-
-    if os.path.exists('input-layer1e-weights.pickle'):
-        with open('input-layer1e-weights.pickle', 'rb') as pickle_file:
-            pickle_obj = pickle.load(pickle_file)
-            connections['input-layer1e'].w = pickle_obj
+    if weights is not None:
+        if synapses is None:
+            synapses = True
+        connections['input-layer1e'] = synapse_mod.nonplastic_synapses(
+            source=source,
+            target=target,
+            connectivity=synapses,
+            synapse_type='excitatory'
+        )
     else:
-        connections['input-layer1e'].w = 'rand() * 0.4'
-        weights = np.array(connections['input-layer1e'].w)
-        with open('input-layer1e-weights.pickle', 'wb') as pickle_file:
-            pickle.dump(weights, pickle_file)
+        connections['input-layer1e'] = synapse_mod.stdp_ex_synapses(
+            source=source,
+            target=target,
+            connectivity=True, # all-to-all connectivity
+            params=connection_params,
+            variable_params=variable_params
+        )
+        # load saved weights, if they exist (or generate them)
+        weights = synapse_mod.initial_weights(n_inputs, n_neurons)
+    if batch_size > 1:
+        weights = batch_mod.tile_weights(weights, n_inputs, batch_size)
+    connections['input-layer1e'].w = weights
 
     # excitatory to inhibitory
     connections['layer1e-layer1i'] = synapse_mod.nonplastic_synapses(
@@ -115,16 +270,23 @@ def init_connections(neurons, connection_params):
         connectivity='i == j',
         synapse_type='excitatory'
     )
-    connections['layer1e-layer1i'].w = connection_params['ex-in-w']
+    if variable_params is None:
+        connections['layer1e-layer1i'].w = connection_params['ex-in-w']
 
     # inhibitory to excitatory
+    if batch_size == 1:
+        connectivity = 'i != j'
+    else:
+        connectivity = 'i != j and i // %d == j // %d' % \
+            (n_neurons, n_neurons)
     connections['layer1i-layer1e'] = synapse_mod.nonplastic_synapses(
         source=neurons['layer1i'],
         target=neurons['layer1e'],
-        connectivity='i != j',
+        connectivity=connectivity,
         synapse_type='inhibitory'
     )
-    connections['layer1i-layer1e'].w = connection_params['in-ex-w']
+    if variable_params is None:
+        connections['layer1i-layer1e'].w = connection_params['in-ex-w']
 
     # excitatory to visualisation
     if 'layer1vis' in neurons:
@@ -136,9 +298,112 @@ def init_connections(neurons, connection_params):
 
     return connections
 
-def init_monitors(neurons, connections, monitor_params):
+def tunable_param_values(neurons, connections, neuron_params,
+                         connection_params):
+    """
+    Values for the tunable parameters of a network initialised with
+    variable_params, as run-time arguments for a standalone binary.
+    """
+    values = {}
+    for (name, (var_name, _)) in eqs_mod.variable_params_e.items():
+        values[getattr(neurons['layer1e'], var_name)] = neuron_params[name]
+    for (name, (var_name, _)) in eqs_mod.variable_params_stdp_ee.items():
+        values[getattr(connections['input-layer1e'], var_name)] = \
+            connection_params[name]
+    values[connections['layer1e-layer1i'].w] = connection_params['ex-in-w']
+    values[connections['layer1i-layer1e'].w] = connection_params['in-ex-w']
+    return values
+
+def batch_param_values(neurons, connections, params_list):
+    """
+    Per-neuron/per-synapse values of the tunable parameters of a batched
+    network initialised with variable_params, with copy k of the network
+    using the parameters params_list[k].
+    """
+    batch_size = len(params_list)
+    n_inputs = len(neurons['input'])
+    n_neurons = len(neurons['layer1e']) // batch_size
+    neuron_params_list = [params[0] for params in params_list]
+    connection_params_list = [params[1] for params in params_list]
+
+    def per_neuron(group_params_list, name):
+        return np.repeat([float(params[name]) for params in group_params_list],
+                         n_neurons)
+
+    values = {}
+    for (name, (var_name, _)) in eqs_mod.variable_params_e.items():
+        values[getattr(neurons['layer1e'], var_name)] = \
+            per_neuron(neuron_params_list, name)
+    for (name, (var_name, _)) in eqs_mod.variable_params_stdp_ee.items():
+        # synapses are ordered by input, then by output neuron
+        values[getattr(connections['input-layer1e'], var_name)] = \
+            np.tile(per_neuron(connection_params_list, name), n_inputs)
+    # one synapse from each excitatory neuron
+    values[connections['layer1e-layer1i'].w] = \
+        per_neuron(connection_params_list, 'ex-in-w')
+    # n_neurons - 1 synapses from each inhibitory neuron
+    values[connections['layer1i-layer1e'].w] = np.repeat(
+        per_neuron(connection_params_list, 'in-ex-w'), n_neurons - 1)
+
+    for variable in values:
+        values[variable] = values[variable] * b2.get_unit(variable.dim)
+
+    return values
+
+def network_structure(params, input_spikes, batch_size=1):
+    """
+    Describe everything about a simulation which ends up in the code generated
+    for it, i.e. everything apart from the values of the tunable parameters.
+    """
+    (neuron_params, connection_params, monitor_params, run_params,
+     analysis_params) = params
+
+    structure = {
+        'layer_n_neurons': run_params['layer_n_neurons'],
+        'n_inputs': input_spikes['n_inputs'],
+        'n_input_spikes': len(input_spikes['indices']),
+        'run_time': run_params['run_time'],
+        'monitor_params': monitor_params,
+        'batch_size': batch_size
+    }
+    if run_params.get('profile', False):
+        # (profiling adds timing code to every code object)
+        structure['profile'] = True
+    for (prefix, group_params) in [('neuron_params', neuron_params),
+                                   ('connection_params', connection_params)]:
+        for name in group_params:
+            if name not in TUNABLE_PARAMS:
+                structure[prefix + '.' + name] = group_params[name]
+
+    return structure
+
+def init_numpy_network(input_spikes, run_params, neuron_params,
+                       connection_params, monitor_params):
     """
-    Initialise Brian objects monitoring state variables in the network.
+    Initialise the NumPy implementation of the network, using the same
+    cached initial weights as init_connections.
+    """
+    n_inputs = input_spikes['n_inputs']
+    n_neurons = run_params['layer_n_neurons']
+    initial_weights = synapse_mod.initial_weights(n_inputs, n_neurons)
+
+    net = numpy_mod.Network(
+        input_spikes=input_spikes,
+        n_inputs=n_inputs,
+        layer_n_neurons=n_neurons,
+        neuron_params=neuron_params,
+        connection_params=connection_params,
+        monitor_params=monitor_params,
+        initial_weights=initial_weights,
+        run_time=run_params['run_time']
+    )
+
+    return net
+
+def init_monitors(neurons, connections, plans):
+    """
+    Initialise Brian objects monitoring state variables in the network,
+    following the monitor plan of each group (see monitoring_mod).
     """
 
     monitors = {
@@ -150,41 +415,148 @@ def init_monitors(neurons, connections, monitor_params):
     for layer in ['input', 'layer1e']:
         monitors['spikes'][layer] = b2.SpikeMonitor(neurons[layer])
 
-    if 'monitors_dt' not in monitor_params:
-        timestep = None
-    else:
-        timestep = monitor_params['monitors_dt']
-
-    monitors['neurons']['layer1e'] = b2.StateMonitor(
-        neurons['layer1e'],
-        ['v', 'ge', 'max_ge', 'theta'],
-        # record=True is currently broken for standalone simulations
-        record=range(len(neurons['layer1e'])),
-        dt=timestep
+    for ((group_type, group), plan) in plans.items():
+        if group_type == 'neurons':
+            source = neurons[group]
+            n_elements = len(source)
+        else:
+            source = connections[group]
+            n_elements = len(source.target) * len(source.source)
+        for (key, variables, _, dt) in plan:
+            monitors[group_type][key] = b2.StateMonitor(
+                source,
+                variables,
+                # record=True is currently broken for standalone simulations
+                record=range(n_elements),
+                dt=dt
+            )
+
+    return monitors
+
+def init_recorder(monitors, monitor_params, run_id):
+    """
+    If monitor_params['record_to_disk'] is set, set up the recording of the
+    monitors to results/monitors_<run_id>/ during the run (see recorder_mod).
+    """
+    if not monitor_params.get('record_to_disk', False):
+        return None
+    return recorder_mod.DiskRecorder(
+        'results/monitors_%s' % run_id,
+        monitors,
+        monitor_params['record_chunk']
     )
-    if 'layer1vis' in neurons:
-        monitors['neurons']['layer1vis'] = b2.StateMonitor(
-            neurons['layer1vis'],
-            ['v'],
-            # record=True is currently broken for standalone simulations
-            record=range(len(neurons['layer1vis'])),
-            dt=b2.second/60
-        )
 
-    conn = connections['input-layer1e']
-    n_connections = len(conn.target) * len(conn.source)
-    monitors['connections']['input-layer1e'] = b2.StateMonitor(
-        connections['input-layer1e'],
-        ['w', 'post', 'pre'],
-        record=range(n_connections),
-        dt=timestep
+def segment_listeners(*listeners):
+    """
+    The listeners to pass to run_windows, leaving out any which are None.
+    (The tracker and convergence monitor count the spikes of every segment
+    with count_segment, before the recorder empties the monitors.)
+    """
+    return [listener for listener in listeners if listener is not None]
+
+def finish_monitors(monitors, connections, plans, run_params, group_state):
+    """
+    Apply the monitoring modes which need the results of the run (see
+    monitoring_mod.finish_monitors).
+    """
+    monitoring_mod.finish_monitors(
+        monitors, plans,
+        end_time=run_params.get('stopped_at', run_params['run_time']),
+        group_state=group_state,
+        firing_neurons=set(np.asarray(monitors['spikes']['layer1e'].i)),
+        post_neurons=connections['input-layer1e'].j
     )
 
-    return monitors
+def init_tracker(monitors, run_params, analysis_params):
+    """
+    If run_params['track_selectivity'] is set, set up tracking of the note
+    selectivity of the output neurons during the run (see selectivity_mod).
+    """
+    if run_params.get('track_selectivity') is None:
+        return None
+    if analysis_params['note_separation'] is None or \
+            analysis_params['n_notes'] is None:
+        raise ValueError("Tracking selectivity needs --note_separation and "
+                         "--n_notes")
+    return selectivity_mod.SelectivityTracker(
+        monitors['spikes']['layer1e'],
+        n_neurons=run_params['layer_n_neurons'],
+        note_length=analysis_params['note_separation'],
+        n_notes=analysis_params['n_notes'],
+        period=run_params['track_selectivity'],
+        abort_after=run_params.get('abort_after', 0 * b2.second),
+        abort_below=run_params.get('abort_below')
+    )
+
+def init_convergence(neurons, connections, monitors, run_params,
+                     connection_params, analysis_params):
+    """
+    If run_params['stop_on_convergence'] is set, set up stopping the run once
+    learning has converged (see convergence_mod), using the note structure in
+    analysis_params if it's known.
+    """
+    if run_params.get('stop_on_convergence') is None:
+        return None
+    if analysis_params['note_separation'] is not None and \
+            analysis_params['n_notes'] is not None:
+        (note_length, n_notes) = (analysis_params['note_separation'],
+                                  analysis_params['n_notes'])
+    else:
+        (note_length, n_notes) = (None, 1)
+    return convergence_mod.ConvergenceMonitor(
+        connections['input-layer1e'],
+        monitors['spikes']['layer1e'],
+        n_neurons=len(neurons['layer1e']),
+        period=run_params['stop_on_convergence'],
+        max_weight=connection_params['wmax_ee'],
+        max_weight_change=run_params['max_weight_change'],
+        max_winner_change=run_params['max_winner_change'],
+        patience=run_params['convergence_patience'],
+        note_length=note_length,
+        n_notes=n_notes
+    )
 
-def run_simulation(run_params, neurons, connections, monitors, run_id):
+def finish_run(run_params, listeners, run_id):
+    """
+    If one of the listeners stopped the run early, record when in
+    run_params['stopped_at'], and if learning converged, save the final
+    weights to results/final_weights_<run_id>.npy.
+    """
+    for listener in listeners:
+        if getattr(listener, 'stopped_at', None) is not None:
+            run_params['stopped_at'] = listener.stopped_at
+            break
+    for listener in listeners:
+        if getattr(listener, 'final_weights', None) is not None:
+            fname = 'results/final_weights_%s.npy' % run_id
+            np.save(fname, listener.final_weights)
+            print("Saved final weights to %s" % fname)
+
+def init_checkpoints(net, run_params, run_id, listeners):
+    """
+    If run_params['checkpoint'] is set, add a listener saving checkpoints to
+    checkpoint_mod.checkpoint_filename(run_id) to listeners, and if
+    run_params['resume'] is set, restore net and listeners from that
+    checkpoint. Returns (listeners, the time to start running from).
+    """
+    filename = checkpoint_mod.checkpoint_filename(run_id)
+    start_time = 0 * b2.second
+    if run_params.get('resume', False):
+        start_time = checkpoint_mod.resume(filename, net, run_params,
+                                           listeners)
+    if run_params.get('checkpoint') is not None:
+        checkpointer = checkpoint_mod.Checkpointer(
+            filename, net, run_params['checkpoint'], run_params, listeners)
+        # (last, so that the other listeners are up to date when it saves)
+        listeners = list(listeners) + [checkpointer]
+    return (listeners, start_time)
+
+def run_simulation(run_params, neurons, connections, monitors, run_id,
+                   listeners=(), profile=None):
     """
     Run the simulation using all the objects created so far.
+    (See run_windows for listeners and profile, and init_checkpoints for
+    checkpoints.)
     """
 
     net = b2.Network()
@@ -196,7 +568,10 @@ def run_simulation(run_params, neurons, connections, monitors, run_id):
         for neuron_group in monitors[mon_type]:
             net.add(monitors[mon_type][neuron_group])
 
-    net.run(run_params['run_time'], report='text')
+    (listeners, start_time) = init_checkpoints(net, run_params, run_id,
+                                               listeners)
+    run_windows(net, neurons['input'].set_spikes, run_params, listeners,
+                start_time, profile)
 
     return net
 
@@ -221,6 +596,9 @@ def analyse_results(monitors, connections, analysis_params):
             to_time=end_time
         )
 
+    if analysis_params.get('no_plots', False):
+        return
+
     plt.ion()
 
     plt.figure()
@@ -255,133 +633,455 @@ def analyse_results(monitors, connections, analysis_params):
         return
 
     firing_neurons = set(monitors['spikes']['layer1e'].i)
-    utils_mod.plot_state_var(
-        monitors['neurons']['layer1e'],
-        monitors['neurons']['layer1e'].ge/b2.siemens,
-        firing_neurons,
-        'Current'
-    )
-    utils_mod.plot_state_var(
-        monitors['neurons']['layer1e'],
-        monitors['neurons']['layer1e'].theta/b2.mV,
-        firing_neurons,
-        'Threshold increase'
-    )
-    utils_mod.plot_state_var(
-        monitors['neurons']['layer1e'],
-        monitors['neurons']['layer1e'].v/b2.mV,
-        firing_neurons,
-        'Membrane potential'
-    )
+    # (only plotting the variables which were recorded)
+    for (var, unit, title) in [('ge', b2.siemens, 'Current'),
+                               ('theta', b2.mV, 'Threshold increase'),
+                               ('v', b2.mV, 'Membrane potential')]:
+        monitor = monitoring_mod.state_monitor(monitors, 'neurons',
+                                               'layer1e', var)
+        if monitor is None:
+            continue
+        utils_mod.plot_state_var(
+            monitor,
+            getattr(monitor, var)/unit,
+            firing_neurons,
+            title
+        )
 
-    utils_mod.plot_weight_diff(
-        connections['input-layer1e'],
-        monitors['connections']['input-layer1e']
+    weight_monitor = monitoring_mod.state_monitor(monitors, 'connections',
+                                                  'input-layer1e', 'w')
+    if weight_monitor is not None:
+        utils_mod.plot_weight_diff(
+            connections['input-layer1e'],
+            weight_monitor
+        )
+
+def save_results(monitors, run_id, connections=None, analysis_params=None):
+    """
+    Save everything the monitors recorded to results/monitors_<run_id>.results
+    for future plotting (see results_file_mod.load_results and report.py),
+    along with the pre- and postsynaptic neurons of each input-layer1e
+    synapse and the note structure to analyse the spikes with, if given.
+    """
+    metadata = {'run_id': run_id}
+    arrays = {}
+    if connections is not None:
+        arrays['input-layer1e.i'] = np.asarray(connections['input-layer1e'].i)
+        arrays['input-layer1e.j'] = np.asarray(connections['input-layer1e'].j)
+    if analysis_params is not None and \
+            analysis_params['note_separation'] is not None:
+        metadata['note_separation'] = \
+            float(analysis_params['note_separation'] / b2.second)
+        metadata['n_notes'] = analysis_params['n_notes']
+    results_file_mod.write_results(
+        'results/monitors_' + run_id + results_file_mod.FILE_EXTENSION,
+        monitors,
+        metadata=metadata,
+        arrays=arrays
     )
 
-def pickle_results(monitors, run_id):
-    """
-    Pickle results for future plotting.
-    """
-    monitors_safe = {}
-    for group_type in monitors:
-        monitors_safe[group_type] = {}
-        for group in monitors[group_type]:
-            monitor = monitors[group_type][group]
-            var_dict = {}
-            if isinstance(monitor, b2.SpikeMonitor):
-                var_dict['t'] = np.copy(monitor.t)
-                var_dict['i'] = np.copy(monitor.i)
-            else:
-                for var in monitor.needed_variables:
-                    var_dict[var] = np.copy(getattr(monitor, var))
-            monitors_safe[group_type][group] = var_dict
-
-    with open('results/monitors_' + run_id + '.pickle', 'w') as pickle_file:
-        pickle.dump(monitors_safe, pickle_file)
-
-def pickle_visualisation(monitors, connections, run_id):
-    """
-    Pickle variables used for visualisation.
-    (Separate from main pickle function because that one can take aaaages to
-    run.)
-    """
-    fname = 'results/vis_vars_%s.pickle' % run_id
-    with open(fname, 'wb') as pickle_file:
-        objects = (monitors['neurons']['layer1vis'].v / b2.mV,
-                   monitors['connections']['input-layer1e'].w,
-                   np.array(connections['input-layer1e'].j),
-                   monitors['spikes']['input'].t / b2.second,
-                   np.array(monitors['spikes']['input'].i),
-                   monitors['spikes']['layer1e'].t / b2.second,
-                   np.array(monitors['spikes']['layer1e'].i))
-        pickle.dump(objects, pickle_file)
+def save_visualisation(monitors, connections, run_id):
+    """
+    Save variables used for visualisation (see modules/movie.py).
+    """
+    vis_monitor = monitoring_mod.state_monitor(monitors, 'neurons',
+                                               'layer1vis', 'v')
+    weight_monitor = monitoring_mod.state_monitor(monitors, 'connections',
+                                                  'input-layer1e', 'w')
+    if vis_monitor is None or weight_monitor is None:
+        print("Visualisation variables weren't recorded; not saving them")
+        return
 
-def main_simulation(params):
+    movie_mod.save_vis_vars(
+        movie_mod.vis_vars_filename(run_id),
+        potential=np.asarray(vis_monitor.v / b2.mV).T,
+        weights=np.asarray(weight_monitor.w).T,
+        weight_targets=np.array(connections['input-layer1e'].j),
+        input_spike_times=monitors['spikes']['input'].t / b2.second,
+        input_spike_indices=np.array(monitors['spikes']['input'].i),
+        output_spike_times=monitors['spikes']['layer1e'].t / b2.second,
+        output_spike_indices=np.array(monitors['spikes']['layer1e'].i))
+
+def standalone_build_dir(run_params, run_id):
     """
-    Initialise simulation objects and run the simulation.
+    The directory to build a standalone project in.
+    """
+    if run_params.get('build_dir') is not None:
+        return run_params['build_dir']
+    if os.name == 'nt':
+        build_dir = 'C:\\temp\\'
+    else:
+        build_dir = '/tmp/'
+    return build_dir + run_id
+
+def simulate(params, input_spikes, run_id, batch_params=None, profile=None,
+             run_listeners=None):
+    """
+    Set up the network with the chosen backend and run it, recording the
+    time and memory use of each phase in profile, if given (see
+    profiling_mod.RunProfile). If run_listeners (a list) is given, the
+    listeners of the run (see segment_listeners) are added to it.
+    If batch_params (a list of parameter sets) is given, one copy of the
+    network is simulated for each of them instead; see simulate_batch.
     """
     (neuron_params, connection_params, monitor_params, run_params,
      analysis_params) = params
+    if profile is None:
+        profile = profiling_mod.RunProfile(
+            code_objects=run_params.get('profile', False))
 
-    spike_filename = os.path.basename(run_params['input_spikes_filename'])
-    run_id = spike_filename.replace('.pickle', '')
-    if not run_params['from_paramfile']:
-        param_mod.record_params(params, run_id)
-    input_spikes = load_input(run_params)
+    backend = run_params.get('backend', 'brian')
+    if batch_params is not None:
+        batch_size = len(batch_params)
+    else:
+        batch_size = 1
+    # (set if the run is stopped early)
+    run_params.pop('stopped_at', None)
+    checkpointing = (run_params.get('checkpoint') is not None or
+                     run_params.get('resume', False))
+    if checkpointing and monitor_params.get('record_to_disk', False):
+        raise ValueError("Checkpoints can't be used with --record_to_disk")
+
+    if backend == 'numpy':
+        if batch_params is not None:
+            raise ValueError("Batches can only be simulated with Brian")
+        print("Initialising NumPy network...")
+        with profile.phase('init_network'):
+            net = init_numpy_network(input_spikes, run_params, neuron_params,
+                                     connection_params, monitor_params)
+            (neurons, connections, monitors) = \
+                (net.neurons, net.connections, net.monitors)
+            tracker = init_tracker(monitors, run_params, analysis_params)
+            convergence = init_convergence(neurons, connections, monitors,
+                                           run_params, connection_params,
+                                           analysis_params)
+            recorder = init_recorder(monitors, monitor_params, run_id)
+        print("done!")
 
-    input_end_time = np.ceil(np.amax(input_spikes['times']))
-    if 'run_time' not in run_params:
-        run_params['run_time'] = input_end_time
+        print("Running simulation...")
+        with profile.phase('run'):
+            listeners = segment_listeners(tracker, convergence, recorder)
+            if run_listeners is not None:
+                run_listeners.extend(listeners)
+            (listeners, start_time) = init_checkpoints(net, run_params,
+                                                       run_id, listeners)
+            run_windows(net, net.set_spikes, run_params, listeners,
+                        start_time, profile)
+            finish_run(run_params, listeners, run_id)
+        with profile.phase('finish_monitors'):
+            if recorder is not None:
+                monitors = recorder.close()
+            finish_monitors(monitors, connections, net.plans, run_params,
+                            net.group_state)
+        print("done!")
 
+        return (neurons, connections, monitors, net)
+
+    tracking = (run_params.get('track_selectivity') is not None or
+                run_params.get('stop_on_convergence') is not None)
+    if (monitor_params.get('record_to_disk', False) or tracking or
+            checkpointing) and not run_params['no_standalone']:
+        # (a standalone simulation can't hand over its state mid-run)
+        raise ValueError("Monitors can only be recorded to disk or tracked, "
+                         "and runs checkpointed, in runtime mode "
+                         "(--no_standalone) or with --backend numpy")
+    if batch_params is not None and (tracking or checkpointing):
+        raise ValueError("Selectivity and convergence can't be tracked, or "
+                         "checkpoints used, in batches")
+
+    use_build_cache = False
+    # a standalone project with several runs (one per input window) must be
+    # built explicitly after all of them
+    windowed = run_params.get('input_window') is not None
     if not run_params['no_standalone']:
-        if os.name == 'nt':
-            build_dir = 'C:\\temp\\'
-        else:
-            build_dir = '/tmp/'
-        build_dir += run_id
-        b2.set_device('cpp_standalone', directory=build_dir)
+        build_dir = standalone_build_dir(run_params, run_id)
+        if run_params.get('build_cache', False):
+            if windowed:
+                # (the spikes of every window would be part of the structure)
+                raise ValueError("The build cache can't be used with "
+                                 "input windows")
+            use_build_cache = True
+            cache_dir = run_params['build_cache_dir']
+            if cache_dir is None:
+                cache_dir = build_cache_mod.default_cache_dir()
+            cache_key = build_cache_mod.structure_key(
+                network_structure(params, input_spikes, batch_size))
+            cached = build_cache_mod.checkout(cache_dir, cache_key, build_dir)
+            if cached:
+                print("Reusing cached build %s" % cache_key)
+        # (built explicitly after the run, so that generating code, compiling
+        # and running can be profiled separately)
+        b2.set_device('cpp_standalone', directory=build_dir,
+                      build_on_run=False)
+
+    if batch_params is not None:
+        variable_params = 'constant'
+    elif use_build_cache:
+        variable_params = 'shared, constant'
+    else:
+        variable_params = None
 
     print("Initialising neurons...")
-    neurons = init_neurons(
-        input_spikes, run_params['layer_n_neurons'],
-        neuron_params
-    )
+    with profile.phase('init_neurons'):
+        neurons = init_neurons(
+            input_spikes, run_params['layer_n_neurons'],
+            neuron_params,
+            variable_params,
+            batch_size
+        )
     print("done!")
 
     print("Initialising connections...")
-    connections = init_connections(
-        neurons,
-        connection_params
-    )
+    with profile.phase('init_connections'):
+        connections = init_connections(
+            neurons,
+            connection_params,
+            variable_params,
+            batch_size
+        )
+        param_values = None
+        if batch_params is not None:
+            param_values = batch_param_values(neurons, connections,
+                                              batch_params)
+        elif use_build_cache:
+            param_values = tunable_param_values(
+                neurons, connections, neuron_params, connection_params)
+        if batch_params is not None and not use_build_cache:
+            for (variable, values) in param_values.items():
+                variable[:] = values
+            param_values = None
     print("done!")
 
     print("Initialising monitors...")
-    monitors = init_monitors(neurons, connections, monitor_params)
+    with profile.phase('init_monitors'):
+        plans = monitoring_mod.monitor_plans(monitor_params,
+                                             run_params['run_time'],
+                                             'layer1vis' in neurons)
+        monitors = init_monitors(neurons, connections, plans)
+        tracker = init_tracker(monitors, run_params, analysis_params)
+        convergence = init_convergence(neurons, connections, monitors,
+                                       run_params, connection_params,
+                                       analysis_params)
+        recorder = init_recorder(monitors, monitor_params, run_id)
+    profile.name_objects(neurons, connections, monitors)
     print("done!")
 
     print("Running simulation...")
-    net = run_simulation(run_params, neurons, connections, monitors, run_id)
+    # (in standalone mode, this only records what to run)
+    with profile.phase('run' if run_params['no_standalone'] else 'network'):
+        listeners = segment_listeners(tracker, convergence, recorder)
+        if run_listeners is not None:
+            run_listeners.extend(listeners)
+        net = run_simulation(run_params, neurons, connections, monitors,
+                             run_id, listeners, profile)
+        finish_run(run_params, listeners, run_id)
+    if not run_params['no_standalone']:
+        with profile.phase('codegen'):
+            b2.device.build(directory=build_dir, compile=False, run=False)
+            if use_build_cache:
+                build_cache_mod.restore_reordered_sources(
+                    cache_dir, cache_key, build_dir)
+        with profile.phase('compile'):
+            compiler, _ = get_compiler_and_args()
+            b2.device.compile_source(build_dir, compiler, debug=False,
+                                     clean=False)
+        with profile.phase('run'):
+            b2.device.run(run_args=param_values)
+        profile.add_code_objects(net)
+        if use_build_cache and not cached:
+            build_cache_mod.store(cache_dir, cache_key, build_dir,
+                                  run_params['build_cache_size'])
+
+    def group_state(group_type, group):
+        if group_type == 'neurons':
+            source = neurons[group]
+        else:
+            source = connections[group]
+        return dict((var, np.asarray(getattr(source, var + '_')))
+                    for var in monitoring_mod.group_variables(group))
+    with profile.phase('finish_monitors'):
+        if recorder is not None:
+            monitors = recorder.close()
+        finish_monitors(monitors, connections, plans, run_params,
+                        group_state)
     print("done!")
 
-    analyse_results(
-        monitors,
-        connections,
-        analysis_params
+    return (neurons, connections, monitors, net)
+
+def simulate_batch(params_list, input_spikes, run_id):
+    """
+    Simulate one copy of the network for each set of parameters in
+    params_list in a single Brian run. The parameter sets may only differ in
+    TUNABLE_PARAMS.
+    Returns a list of (connections, monitors) for each copy (see
+    batch_mod.split_results), and the network.
+    """
+    structures = [network_structure(params, input_spikes)
+                  for params in params_list]
+    for structure in structures[1:]:
+        if structure != structures[0]:
+            raise ValueError("Simulations in a batch can only differ in %s" %
+                             ', '.join(sorted(TUNABLE_PARAMS)))
+
+    params = params_list[0]
+    (neurons, connections, monitors, net) = \
+        simulate(params, input_spikes, run_id, batch_params=params_list)
+
+    print("Splitting results...")
+    copies = batch_mod.split_results(
+        connections, monitors,
+        batch_size=len(params_list),
+        n_inputs=len(neurons['input']),
+        n_neurons=params[3]['layer_n_neurons']
     )
-    if analysis_params['save_figs']:
-        utils_mod.save_figures(run_id)
+    print("done!")
+
+    return (copies, net)
+
+def save_model(neurons, connections, params, run_id):
+    """
+    Save the trained weights and thresholds of the network, along with the
+    parameters it was trained with, to inference_mod.model_filename(run_id)
+    (see infer.py).
+    """
+    (neuron_params, connection_params, _, _, _) = params
+    fname = inference_mod.model_filename(run_id)
+    inference_mod.save_model(
+        fname,
+        weights=np.asarray(connections['input-layer1e'].w),
+        theta=np.asarray(neurons['layer1e'].theta),
+        neuron_params=neuron_params,
+        connection_params=connection_params
+    )
+    print("Saved model to %s" % fname)
+
+def simulate_inference(model, run_params, input_spikes, run_id):
+    """
+    Run the network of a trained model (see inference_mod) on input_spikes,
+    with the weights and thresholds fixed, only recording the output spikes.
+    Returns (neurons, connections, monitors, net) as simulate does.
+    """
+    neuron_params = dict(model['neuron_params'])
+    neuron_params['vis'] = False
+    connection_params = model['connection_params']
+    n_inputs = model['n_inputs']
+    n_neurons = model['layer_n_neurons']
+    run_time = run_params['run_time']
+    (i, j) = inference_mod.model_synapses(model)
+
+    if run_params.get('backend', 'brian') == 'numpy':
+        # (the NumPy backend records input spikes and the state variables
+        # its monitor plans say to, so turn them all off)
+        monitor_params = {'monitor_policy': monitoring_mod.parse_policy(
+            ['%s=off' % group
+             for (_, group, _) in monitoring_mod.STATE_VARIABLES])}
+        # (pruned synapses are just left with zero weights)
+        weights = np.zeros(n_inputs * n_neurons)
+        weights[i * n_neurons + j] = model['weights']
+        net = numpy_mod.Network(
+            input_spikes=input_spikes,
+            n_inputs=n_inputs,
+            layer_n_neurons=n_neurons,
+            neuron_params=neuron_params,
+            connection_params=connection_params,
+            monitor_params=monitor_params,
+            initial_weights=weights,
+            run_time=run_time
+        )
+        net.freeze(model['theta'])
+        net.run(run_time, report='text')
+        return (net.neurons, net.connections, net.monitors, net)
+
+    if not run_params['no_standalone']:
+        b2.set_device('cpp_standalone',
+                      directory=standalone_build_dir(run_params, run_id))
+
+    neurons = init_neurons(input_spikes, n_neurons, neuron_params,
+                           frozen=True)
+    neurons['layer1e'].theta = model['theta'] * b2.volt
+    connections = init_connections(neurons, connection_params,
+                                   weights=model['weights'],
+                                   synapses=(i, j))
+    monitors = {
+        'spikes': {'layer1e': b2.SpikeMonitor(neurons['layer1e'])},
+        'neurons': {},
+        'connections': {}
+    }
+    net = b2.Network()
+    for group in neurons.values():
+        net.add(group)
+    for connection in connections.values():
+        net.add(connection)
+    net.add(monitors['spikes']['layer1e'])
+    net.run(run_time, report='text')
+
+    return (neurons, connections, monitors, net)
+
+def save_profile(profile, run_params, run_id):
+    """
+    Save the profile of a run to results/profile_<run_id>.json and .txt (see
+    profiling_mod).
+    """
+    if run_params.get('backend', 'brian') == 'numpy':
+        mode = 'numpy'
+    elif run_params['no_standalone']:
+        mode = 'runtime'
+    else:
+        mode = 'standalone'
+    info = {'run_id': run_id,
+            'mode': mode,
+            'layer_n_neurons': run_params['layer_n_neurons'],
+            'run_time': float(run_params['run_time'] / b2.second)}
+    fname = profiling_mod.profile_filename_base(run_id)
+    profile.save(fname, info)
+    print("Saved profile to %s.txt" % fname)
+
+def main_simulation(params):
+    """
+    Initialise simulation objects and run the simulation.
+    """
+    (neuron_params, connection_params, monitor_params, run_params,
+     analysis_params) = params
+
+    spike_filename = os.path.basename(run_params['input_spikes_filename'])
+    run_id = os.path.splitext(spike_filename)[0]
+    if not run_params['from_paramfile']:
+        param_mod.record_params(params, run_id)
+    profile = profiling_mod.RunProfile(
+        code_objects=run_params.get('profile', False))
+    with profile.phase('load_input'):
+        input_spikes = prepare_input(run_params)
+
+    (neurons, connections, monitors, net) = \
+        simulate(params, input_spikes, run_id, profile=profile)
+
+    with profile.phase('analysis'):
+        analyse_results(
+            monitors,
+            connections,
+            analysis_params
+        )
+        if analysis_params['save_figs']:
+            utils_mod.save_figures(run_id)
 
     if run_params['save_results']:
         print("Saving results...")
-        pickle_results(monitors, run_id)
+        with profile.phase('save_results'):
+            save_results(monitors, run_id, connections, analysis_params)
         print("done!")
 
-    if 'layer1vis' in monitors['neurons']:
+    if run_params.get('save_model', False):
+        with profile.phase('save_model'):
+            save_model(neurons, connections, params, run_id)
+
+    if neuron_params['vis']:
         print("Saving visualisation variables...")
-        pickle_visualisation(monitors, connections, run_id)
+        with profile.phase('save_visualisation'):
+            save_visualisation(monitors, connections, run_id)
         print("done!")
 
+    save_profile(profile, run_params, run_id)
+
     return (neurons, connections, monitors, net)
 
 def main():
@@ -390,12 +1090,12 @@ def main():
     the test suite or actually run the simulate.
     """
 
-    np.random.seed(1)
-
     params = param_mod.get_params()
     (neuron_params, connection_params, monitor_params, run_params,
      analysis_params) = params
 
+    np.random.seed(run_params.get('seed', 1))
+
     if run_params['test_stdp_curve']:
         neurons, connections, monitors, net = \
             test_mod.test_stdp_curve(connection_params)
@@ -411,10 +1111,17 @@ def main():
             connection_params,
             with_competition=True
         )
+    elif run_params.get('test_numpy_backend', False):
+        neurons, connections, monitors, net = \
+            test_mod.test_numpy_backend(params, load_input, simulate)
+    elif run_params.get('test_segment_listeners', False):
+        neurons, connections, monitors, net = \
+            test_mod.test_segment_listeners(params, prepare_input, simulate)
     else:
         neurons, connections, monitors, net = main_simulation(params)
 
     return (neuron_params, connection_params, monitor_params, run_params, \
         neurons, connections, monitors, net)
 
-(n_p, c_p, m_p, r_p, ns, cs, ms, n) = main()
+if __name__ == '__main__':
+    (n_p, c_p, m_p, r_p, ns, cs, ms, n) = main()
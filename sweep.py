@@ -0,0 +1,365 @@
+#!/usr/bin/env python
+
+"""
+Run stdp_sounds.py simulations for every combination of a grid of parameter
+values (or a random sample of them) on one or more configurations, using a pool
+of processes, and collect how well the neurons learnt to respond to individual
+notes into one table.
+
+A configuration is either a spike file or one of the params/*_cmdline.txt
+files recorded by stdp_sounds.py, in which case the arguments it was run with
+are used as the starting point for each simulation. Any other arguments are
+passed on to every simulation, e.g.:
+
+$ ./sweep.py params/two_notes_0.5_s_cmdline.txt --theta_coef 0.01 0.02 0.03 \\
+    --ex_in_w 10.4 20 --run_time 20 --build_cache
+
+With --batch_size, simulations of the same configuration which only differ in
+the parameters which can be batched are run in batches of up to that many
+copies of the network in one Brian run (see stdp_sounds.simulate_batch).
+"""
+
+from __future__ import print_function, division
+import os
+import os.path
+import re
+import sys
+import csv
+import time
+import shutil
+import random
+import argparse
+import itertools
+import collections
+import traceback
+import multiprocessing
+import numpy as np
+import brian2 as b2
+
+import stdp_sounds
+import modules.params as param_mod
+import modules.utils as utils_mod
+
+# parameters which can be swept, with their types
+SWEEP_PARAMS = [
+    ('theta_coef', float),
+    ('nu_ee_post', float),
+    ('max_theta', float),
+    ('ex_in_w', float),
+    ('in_ex_w', float),
+    ('pre_w_decrease', float),
+    ('layer_n_neurons', int)
+]
+
+# swept parameters which simulations in the same batch can differ in
+# (all of which are in stdp_sounds.TUNABLE_PARAMS)
+BATCH_PARAMS = ['theta_coef', 'nu_ee_post', 'max_theta', 'ex_in_w', 'in_ex_w',
+                'pre_w_decrease']
+
+RESULT_FIELDS = ['n_output_spikes', 'n_selective_neurons', 'n_notes_learnt',
+                 'accuracy', 'sim_time', 'stopped_at', 'error']
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('configs', nargs='+',
+                        metavar='spikes_file|params/*_cmdline.txt')
+    for (name, param_type) in SWEEP_PARAMS:
+        parser.add_argument('--' + name, type=param_type, nargs='+')
+    # run a random sample of this many combinations instead of the whole grid
+    parser.add_argument('--random', type=int)
+    parser.add_argument('--sample_seed', type=int, default=0)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--output_dir')
+    parser.add_argument('--keep_builds', action='store_true')
+    parser.add_argument('--batch_size', type=int, default=1)
+    (args, sim_args) = parser.parse_known_args()
+    return (args, sim_args)
+
+def config_args(config):
+    """
+    Get the stdp_sounds.py arguments for a configuration.
+    """
+    if config.endswith('_cmdline.txt'):
+        with open(config, 'r') as cmdline_file:
+            cmdline = cmdline_file.read().split()
+        # drop the name of the script
+        return cmdline[1:]
+    else:
+        return ['--input_spikes_file', config]
+
+def guess_note_structure(spikes_filename):
+    """
+    Guess the note length (in seconds) and the number of different notes in a
+    test sequence from its name, as write_movie.py does.
+    """
+    name = os.path.basename(spikes_filename)
+
+    match = re.search(r'_([0-9.]+)_s', name)
+    if match is not None:
+        note_length = float(match.group(1))
+    else:
+        note_length = None
+
+    if 'scale' in name:
+        n_notes = 7
+    elif 'three_notes' in name:
+        n_notes = 3
+    elif 'two_notes' in name:
+        n_notes = 2
+    else:
+        n_notes = None
+
+    return (note_length, n_notes)
+
+def make_jobs(args, sim_args, output_dir, build_root):
+    swept = [(name, getattr(args, name)) for (name, _) in SWEEP_PARAMS
+             if getattr(args, name) is not None]
+    names = [name for (name, _) in swept]
+    combinations = list(itertools.product(*[values for (_, values) in swept]))
+    if args.random is not None and args.random < len(combinations):
+        rng = random.Random(args.sample_seed)
+        combinations = rng.sample(combinations, args.random)
+
+    # group runs which can be batched together
+    groups = collections.OrderedDict()
+    n_runs = 0
+    for config in args.configs:
+        config_name = os.path.basename(config)
+        if config_name.endswith('_cmdline.txt'):
+            config_name = config_name.replace('_cmdline.txt', '')
+        else:
+            config_name = os.path.splitext(config_name)[0]
+        for values in combinations:
+            run_id = '%04d_%s' % (n_runs, config_name)
+            n_runs += 1
+            argv = config_args(config) + sim_args
+            for (name, value) in zip(names, values):
+                argv += ['--' + name, str(value)]
+            run = {
+                'run_id': run_id,
+                'config': config_name,
+                'argv': argv,
+                'values': dict(zip(names, values))
+            }
+            group = (config,) + tuple(value
+                                      for (name, value) in zip(names, values)
+                                      if name not in BATCH_PARAMS)
+            groups.setdefault(group, []).append(run)
+
+    jobs = []
+    for runs in groups.values():
+        for start in range(0, len(runs), args.batch_size):
+            batch = runs[start:start + args.batch_size]
+            job_id = batch[0]['run_id']
+            job = {
+                'job_id': job_id,
+                'runs': batch,
+                'output_dir': output_dir,
+                'build_dir': os.path.join(build_root, job_id),
+                'keep_builds': args.keep_builds
+            }
+            jobs.append(job)
+
+    return (jobs, names)
+
+def analyse_run(monitors, run_params, analysis_params):
+    """
+    Analyse the note responses of the output neurons over the second half of
+    the simulation, as in stdp_sounds.analyse_results.
+    """
+    result = {}
+
+    spike_indices = np.asarray(monitors['spikes']['layer1e'].i)
+    spike_times = np.asarray(monitors['spikes']['layer1e'].t / b2.second)
+    result['n_output_spikes'] = len(spike_indices)
+
+    (note_length, n_notes) = \
+        guess_note_structure(run_params['input_spikes_filename'])
+    if analysis_params['note_separation'] is not None:
+        note_length = analysis_params['note_separation'] / b2.second
+    if analysis_params['n_notes'] is not None:
+        n_notes = analysis_params['n_notes']
+    if len(spike_indices) == 0 or note_length is None or n_notes is None:
+        return result
+
+    end_time = np.amax(spike_times)
+    favourite_notes = utils_mod.analyse_note_responses(
+        spike_indices=spike_indices,
+        spike_times=spike_times,
+        note_length=note_length,
+        n_notes=n_notes,
+        from_time=end_time/2,
+        to_time=end_time
+    )
+    result['n_selective_neurons'] = len(favourite_notes)
+    result['n_notes_learnt'] = len(set(favourite_notes.values()))
+    result['accuracy'] = utils_mod.note_response_accuracy(
+        spike_indices=spike_indices,
+        spike_times=spike_times,
+        favourite_notes=favourite_notes,
+        note_length=note_length,
+        n_notes=n_notes,
+        from_time=end_time/2,
+        to_time=end_time
+    )
+
+    return result
+
+def simulate_job(job):
+    """
+    Run the simulation(s) for one job, and return the results for each run.
+    """
+    params_list = [param_mod.get_params(run['argv']) for run in job['runs']]
+    run_params = params_list[0][3]
+    np.random.seed(run_params['seed'])
+
+    input_spikes = stdp_sounds.prepare_input(run_params)
+    (note_length, n_notes) = \
+        guess_note_structure(run_params['input_spikes_filename'])
+    for params in params_list:
+        params[3]['run_time'] = run_params['run_time']
+        params[3]['build_dir'] = job['build_dir']
+        # (so that selectivity can be tracked during the run without giving
+        # the note structure of every configuration explicitly)
+        analysis_params = params[4]
+        if analysis_params['note_separation'] is None and \
+                note_length is not None:
+            analysis_params['note_separation'] = note_length * b2.second
+        if analysis_params['n_notes'] is None:
+            analysis_params['n_notes'] = n_notes
+
+    start_time = time.time()
+    if len(params_list) == 1:
+        (neurons, connections, monitors, net) = \
+            stdp_sounds.simulate(params_list[0], input_spikes, job['job_id'])
+        monitors_list = [monitors]
+    else:
+        (copies, net) = stdp_sounds.simulate_batch(params_list, input_spikes,
+                                                   job['job_id'])
+        monitors_list = [monitors for (_, monitors) in copies]
+    sim_time = (time.time() - start_time) / len(params_list)
+
+    results = []
+    for (run, params, monitors) in zip(job['runs'], params_list,
+                                       monitors_list):
+        print("Run %s:" % run['run_id'])
+        result = analyse_run(monitors, params[3], params[4])
+        result['sim_time'] = sim_time
+        if 'stopped_at' in params[3]:
+            result['stopped_at'] = float(params[3]['stopped_at'] / b2.second)
+        results.append(result)
+
+    return results
+
+def run_job(job):
+    """
+    Run one job in a pool worker, with everything it prints going to its own
+    log file.
+    """
+    log_filename = os.path.join(job['output_dir'], 'logs',
+                                job['job_id'] + '.txt')
+    with open(log_filename, 'w') as log_file:
+        # redirect at the file descriptor level so that output from
+        # compilation and standalone binaries ends up in the log too
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log_file.fileno(), 1)
+        os.dup2(log_file.fileno(), 2)
+        for run in job['runs']:
+            print(run['run_id'], ' '.join(run['argv']))
+        try:
+            results = simulate_job(job)
+            for result in results:
+                result['error'] = ''
+        except Exception as e:
+            traceback.print_exc()
+            results = [{'error': repr(e)} for _ in job['runs']]
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    if not job['keep_builds']:
+        shutil.rmtree(job['build_dir'], ignore_errors=True)
+
+    for (run, result) in zip(job['runs'], results):
+        result['run_id'] = run['run_id']
+        result['config'] = run['config']
+        result.update(run['values'])
+    return results
+
+def sort_key(result):
+    # best accuracy first, failed runs last
+    accuracy = result.get('accuracy', float('nan'))
+    if np.isnan(accuracy):
+        accuracy = -1
+    return (-accuracy, result['run_id'])
+
+def print_table(results, fields):
+    print(' '.join('%16s' % field[:16] for field in fields))
+    for result in results:
+        values = []
+        for field in fields:
+            value = result.get(field, '')
+            if isinstance(value, float):
+                values.append('%16.4g' % value)
+            else:
+                values.append('%16s' % str(value)[:16])
+        print(' '.join(values))
+
+def main():
+    (args, sim_args) = get_args()
+
+    if args.output_dir is not None:
+        output_dir = args.output_dir
+    else:
+        output_dir = 'results/sweep_' + time.strftime('%Y%m%d-%H%M%S')
+    if not os.path.isdir(os.path.join(output_dir, 'logs')):
+        os.makedirs(os.path.join(output_dir, 'logs'))
+    if os.name == 'nt':
+        build_root = 'C:\\temp\\stdp_sounds_sweep_%d' % os.getpid()
+    else:
+        build_root = '/tmp/stdp_sounds_sweep_%d' % os.getpid()
+
+    (jobs, swept_names) = make_jobs(args, sim_args, output_dir, build_root)
+    with open(os.path.join(output_dir, 'jobs.txt'), 'w') as jobs_file:
+        for job in jobs:
+            for run in job['runs']:
+                print(job['job_id'], run['run_id'], ' '.join(run['argv']),
+                      file=jobs_file)
+
+    fields = ['run_id', 'config'] + swept_names + RESULT_FIELDS
+    table_filename = os.path.join(output_dir, 'sweep.csv')
+    n_runs = sum(len(job['runs']) for job in jobs)
+    print("Running %d simulations as %d jobs in %d processes..." %
+          (n_runs, len(jobs), args.processes))
+
+    results = []
+    # one process per job, so that each starts with a fresh Brian device
+    pool = multiprocessing.Pool(args.processes, maxtasksperchild=1)
+    with open(table_filename, 'w') as table_file:
+        writer = csv.DictWriter(table_file, fieldnames=fields)
+        writer.writeheader()
+        for job_results in pool.imap_unordered(run_job, jobs):
+            for result in job_results:
+                writer.writerow(result)
+                results.append(result)
+                if result['error']:
+                    status = "failed (%s)" % result['error']
+                else:
+                    status = "accuracy %s" % result.get('accuracy')
+                print("%d/%d: %s %s" %
+                      (len(results), n_runs, result['run_id'], status))
+            table_file.flush()
+    pool.close()
+    pool.join()
+    shutil.rmtree(build_root, ignore_errors=True)
+    print("done!")
+
+    results.sort(key=sort_key)
+    print_table(results, fields)
+    print("Results saved in %s" % table_filename)
+
+    return results
+
+if __name__ == '__main__':
+    results = main()
@@ -1,53 +1,66 @@
 #!/usr/bin/env python
 
+"""
+Render an animation of a simulation run with --vis from the variables saved
+in results/vis_vars_<run id>.results (see modules/movie.py; .pickle files
+saved by older versions can be read too), with batches of frames rendered by
+a pool of --processes processes and encoded by a single ffmpeg process. The
+variables are memory-mapped, so each renderer reads only the frames it
+draws. With --audio, the audio is muxed in in the same pass, giving the
+final movie (results/vis_vars_<run id>.mp4) directly; otherwise just the
+video is written (to results/vis_vars_<run id>.video.mp4).
+"""
+
 from __future__ import print_function, division
-import matplotlib.animation as animation
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
+import matplotlib
+matplotlib.use('Agg')
 import numpy as np
-import pickle
+import os.path
 import argparse
-import utils
-from IPython.core.debugger import Tracer
-
-def get_input_filename():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("pickle_filename", metavar="variables.pickle")
-    args = parser.parse_args()
-    return args.pickle_filename
-
-pickle_filename = get_input_filename()
+import multiprocessing
 
-if 'scale' in pickle_filename:
-    n_notes = 7
-elif '_three_' in pickle_filename:
-    n_notes = 3
-elif '_two_' in pickle_filename:
-    n_notes = 2
-elif 'comptine' not in pickle_filename:
-    raise Exception("Unknown number of notes for pickle '%s'" %
-                    pickle_filename)
+import modules.utils as utils_mod
+import modules.movie as movie_mod
 
-print("Loading pickle...", end='')
-with open(pickle_filename, 'rb') as f:
-    objects = pickle.load(f)
-    (potential, weights, weight_targets, input_spike_times, input_spike_indices,
-     output_spike_times, output_spike_indices) = objects
-print("done!")
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("vars_filename", metavar="vis_vars.results")
+    # how many processes to render frames in
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--dpi', type=int, default=100)
+    # .wav file to add as the soundtrack
+    parser.add_argument('--audio')
+    # where to write the movie, if not next to the variables
+    parser.add_argument('--output')
+    return parser.parse_args()
+
+def neurons_to_show(vars_filename, output_spike_times, output_spike_indices):
+    """
+    The neurons which learnt a note, ordered by note.
+    """
+    if 'comptine' in vars_filename:
+        return [8, 7, 14, 1]
+
+    if 'scale' in vars_filename:
+        n_notes = 7
+    elif '_three_' in vars_filename:
+        n_notes = 3
+    elif '_two_' in vars_filename:
+        n_notes = 2
+    else:
+        raise Exception("Unknown number of notes for variables '%s'" %
+                        vars_filename)
 
-if 'comptine' in pickle_filename:
-    neurons_ordered_by_note = [8, 7, 14, 1]
-else:
     max_time = np.amax(output_spike_times)
-    if 'scale-three_notes' in pickle_filename:
+    if 'scale-three_notes' in vars_filename:
         from_time = 5
         to_time = 12
     else:
         from_time = max_time/2
         to_time = max_time
     note_length = 0.5
-    # output spikes
-    favourite_notes = utils.analyse_note_responses(
+    favourite_notes = utils_mod.analyse_note_responses(
         output_spike_indices,
         output_spike_times,
         note_length,
@@ -55,117 +68,35 @@ else:
         from_time=from_time,
         to_time=to_time
     )
-
-    (output_spike_times_sorted, output_spike_indices_sorted,
-     neurons_ordered_by_note) = utils.order_spikes_by_note(output_spike_indices,
-                                                           output_spike_times,
-                                                           favourite_notes)
-
-n_neurons = potential.shape[0]
-max_spike_index = np.amax(input_spike_indices)
-n_afferents = weights.shape[0] / n_neurons
-max_afferent_shown = max(n_afferents, max_spike_index)
-min_pot = np.amin(potential)
-max_pot = np.amax(potential)
-n_neurons_to_plot = len(neurons_ordered_by_note)
-
-def get_potential(frame_n):
-    p = potential[:, frame_n]
-    p -= min_pot
-    p /= (max_pot - min_pot)
-    return p
-
-def get_weight_diffs(frame_n):
-    diff = weights[:, frame_n] - weights[:, 0]
-    return diff
-
-def input_spikes_range(start_s, end_s):
-    relevant_spikes = \
-        (input_spike_times >= start_s) & (input_spike_times <= end_s)
-    times = input_spike_times[relevant_spikes]
-    indices = input_spike_indices[relevant_spikes]
-    return (times, indices)
-
-n_spike_rows = 4
-
-def initial_plot():
-    fig = plt.figure()
-    weight_lines = []
-    potential_ims = []
-
-    gs = gridspec.GridSpec(n_neurons_to_plot+n_spike_rows, 5)
-
-    # draw input spike raster at top
-    plt.subplot(gs[0:n_spike_rows, 0:-1])
-    cur_time = 0
-    times, indices = input_spikes_range(cur_time, cur_time+1.0)
-    input_spike_raster = \
-        plt.plot(indices, times, 'k.', markersize=1)[0]
-    plt.xlim([0, max_afferent_shown])
-    plt.xticks([])
-    plt.yticks([])
-
-    pot = get_potential(0)
-    diff = get_weight_diffs(0)
-    for i, neuron_n in enumerate(neurons_ordered_by_note):
-        # draw weights down the left
-        plt.subplot(gs[i+n_spike_rows, 0:-1])
-        relevant_weight_idx = (weight_targets == neuron_n)
-        relevant_weights = diff[relevant_weight_idx]
-        line = plt.plot(relevant_weights, 'k')[0]
-        weight_lines.append(line)
-        plt.xlim([0, max_afferent_shown])
-        plt.xticks([])
-        plt.yticks([])
-        plt.ylim([min_diff*1.05, max_diff * 1.05])
-
-        # draw membrane potential on the right
-        plt.subplot(gs[i+n_spike_rows, -1])
-        im = plt.imshow(X=np.matrix(pot[neuron_n]), interpolation='none')
-        potential_ims.append(im)
-        im.set_clim([0,1])
-        ax = im.get_axes()
-        ax.set_xticks([])
-        ax.set_yticks([])
-
-    plt.tight_layout(pad=0)
-
-    return (fig, input_spike_raster, weight_lines, potential_ims)
-
-def update_plots(frame_n):
-    global input_spike_raster, weight_lines, potential_ims
-    print("Frame %d" % frame_n)
-
-    # update input spike raster
-    cur_time = frame_n * 1/60.0
-    times, indices = input_spikes_range(cur_time, cur_time+5)
-    times -= cur_time
-    input_spike_raster.set_data(indices, times)
-
-    # update weights/membrane potential
-    pot = get_potential(frame_n)
-    diff = get_weight_diffs(frame_n)
-    for i, neuron_n in enumerate(neurons_ordered_by_note):
-        relevant_weights = (weight_targets == neuron_n)
-        weight_lines[i].set_ydata(diff[relevant_weights])
-        potential_ims[i].set_data(np.matrix(pot[neuron_n]))
-
-    return [input_spike_raster, weight_lines, potential_ims]
-
-full_diff = get_weight_diffs(weights.shape[1]-1)
-max_diff = np.max(full_diff)
-min_diff = np.min(full_diff)
-
-print("Setting up plot...", end='')
-fig, input_spike_raster, weight_lines, potential_ims = initial_plot()
-print("done!")
-
-print("Generating movie...")
-n_frames = potential.shape[1]
-interval_ms = 1000/60
-ani = animation.FuncAnimation(fig, func=update_plots,
-        frames=n_frames, interval=interval_ms)
-writer = animation.writers['ffmpeg'](bitrate=-1, fps=60)
-movie_filename = pickle_filename.replace('.pickle', '.video.mp4')
-ani.save(movie_filename)
-print("done!")
+    (_, _, neurons_ordered_by_note) = utils_mod.order_spikes_by_note(
+        output_spike_indices, output_spike_times, favourite_notes)
+    return neurons_ordered_by_note
+
+def main():
+    args = get_args()
+    base_filename = os.path.splitext(args.vars_filename)[0]
+    if args.output is not None:
+        movie_filename = args.output
+    elif args.audio is not None:
+        movie_filename = base_filename + '.mp4'
+    else:
+        movie_filename = base_filename + '.video.mp4'
+
+    print("Loading variables...")
+    vis_vars = movie_mod.load_vis_vars(args.vars_filename)
+    neurons = neurons_to_show(args.vars_filename,
+                              np.asarray(vis_vars['output_spike_times']),
+                              np.asarray(vis_vars['output_spike_indices']))
+    n_frames = len(vis_vars['potential'])
+    # (the renderers load the variables themselves)
+    del vis_vars
+    print("done!")
+
+    print("Generating movie...")
+    movie_mod.write_movie(args.vars_filename, neurons, n_frames,
+                          movie_filename, audio_filename=args.audio,
+                          processes=args.processes, dpi=args.dpi)
+    print("done!")
+
+if __name__ == '__main__':
+    main()